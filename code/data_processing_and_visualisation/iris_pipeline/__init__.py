@@ -0,0 +1 @@
+'''Helper modules used by data_processing_and_visualisation.py to load and process the IRIS datasets.'''
@@ -0,0 +1,286 @@
+'''Benchmarks of each processing step on synthetic data (see synthetic.py).
+
+Each benchmark times one step of the analysis (in the calling process, without the stage cache) and records
+its peak memory use above the level at the start of the step and the number of rows it produced.  The isolate
+table is generated in memory at the requested scale; reading the Excel exports, and loading the query service
+data (see service.py) from them, are benchmarked separately on a smaller set of files (--excel-isolates), since
+writing Excel files is slow and limited to about a million rows per organism.
+
+Example:
+    python -m iris_pipeline.benchmark --isolates 10000000 --countries 200 --years 10 --skip figure_2 --json bench.json
+'''
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from . import synthetic
+from .isolates import (add_study_week, compact_isolates, load_isolates, merge_isolates, restrict_to_study_period,
+                       write_isolate_dataset)
+from .mobility import read_mobility_report, residential_and_workplaces, tidy_mobility, with_iso_week
+from .oxcgrt import merge_with_isolates, process_oxcgrt, read_oxcgrt, weekly_indices
+from .summaries import summary_tables, write_summaries
+from .weekly import figure_1_tables, global_weekly_counts, weekly_counts_by_country, write_figure_1_data
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    '''Decorator registering a benchmark, called as func(state) and returning the number of rows produced.'''
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+
+def _rss():
+    '''Resident set size of this process in bytes, or None where /proc isn't available.'''
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakMemory:
+    '''Context manager recording the peak memory use above the level on entry.
+
+    The resident set size is sampled in a background thread (so memory allocated outside Python, e.g. by Arrow,
+    is included); where it can't be read, allocations are traced with tracemalloc instead.
+    '''
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, start):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss() - start)
+
+    def __enter__(self):
+        start = _rss()
+        if start is None:
+            tracemalloc.start()
+        else:
+            self._thread = threading.Thread(target=self._sample, args=(start,), daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is None:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            self._stop.set()
+            self._thread.join()
+
+
+# Benchmarks, in run order.  state holds the synthetic inputs and the results of earlier steps.
+
+@benchmark('excel_ingest')
+def _excel_ingest(state):
+    data = state['excel_data']
+    return len(load_isolates(data.isolate_files, data.study_start, data.study_end))
+
+
+@benchmark('merge')
+def _merge(state):
+    # As read_isolates does after reading each export
+    exports = [export.assign(species=species).rename(columns={'diagnosis': 'disease'}) for species, export in state['exports'].items()]
+    iris_orgs = merge_isolates([compact_isolates(export) for export in exports])
+    iris_orgs = restrict_to_study_period(iris_orgs, state['study_start'], state['study_end'])
+    state['iris_orgs'] = add_study_week(iris_orgs, state['study_start'], state['study_end'])
+    return len(state['iris_orgs'])
+
+
+@benchmark('summaries')
+def _summaries(state):
+    state['summaries'] = summary_tables(state['iris_orgs'])
+    return sum(len(table) for table in state['summaries'].values())
+
+
+@benchmark('figure_1_data')
+def _figure_1_data(state):
+    state['figure_1_data'] = figure_1_tables(global_weekly_counts(state['iris_orgs']))
+    return len(state['figure_1_data'][0])
+
+
+@benchmark('weekly_cube')
+def _weekly_cube(state):
+    state['iris_summary'] = weekly_counts_by_country(state['iris_orgs'], state['study_years'], state['study_start'], state['study_end'])
+    return len(state['iris_summary'])
+
+
+@benchmark('oxcgrt')
+def _oxcgrt(state):
+    countries = state['iris_summary'].index.get_level_values('country').unique().to_list()
+    state['grt_iris'] = process_oxcgrt(read_oxcgrt(state['data'].oxcgrt_file, countries=countries, all_columns=True), countries, state['study_end'])
+    state['grt_iris_indices'] = weekly_indices(state['grt_iris'])
+    return len(state['grt_iris'])
+
+
+@benchmark('oxcgrt_merge')
+def _oxcgrt_merge(state):
+    state['merged_iris_grt'] = merge_with_isolates(state['iris_summary'], state['grt_iris_indices'])
+    return len(state['merged_iris_grt'])
+
+
+@benchmark('mobility')
+def _mobility(state):
+    google_iris = read_mobility_report(state['data'].mobility_file, state['data'].countries, study_end=state['study_end'])
+    state['google_iris'] = tidy_mobility(google_iris)
+    state['google_res_work'] = residential_and_workplaces(state['google_iris'])
+    return len(state['google_iris'])
+
+
+@benchmark('service_load')
+def _service_load(state):
+    # On the Excel inputs of excel_ingest, whose countries include the UK nations (which share the United
+    # Kingdom's mobility data)
+    from .service import ServiceData
+    data = state['excel_data']
+    config = {'isolate_files': data.isolate_files, 'oxcgrt_file': data.oxcgrt_file, 'mobility_file': data.mobility_file,
+              'study_start': state['study_start'], 'study_end': state['study_end'], 'study_years': state['study_years']}
+    return int(ServiceData.load(config).cube.counts.size)
+
+
+@benchmark('export_csv')
+def _export_csv(state):
+    out = state['workdir']
+    write_isolate_dataset(state['iris_orgs'], out/'publication_dataset_iris.csv')
+    state['grt_iris'].to_csv(out/'publication_dataset_oxcgrt.csv', index=False, date_format='%Y-%m-%d')
+    with_iso_week(state['google_iris']).to_csv(out/'publication_dataset_google.csv')
+    state['merged_iris_grt'].to_csv(out/'figure_2_data.csv', index=False)
+    return len(state['iris_orgs']) + len(state['grt_iris']) + len(state['google_iris']) + len(state['merged_iris_grt'])
+
+
+@benchmark('export_excel')
+def _export_excel(state):
+    write_summaries(state['summaries'], state['workdir']/'publication_summaries.xlsx')
+    write_figure_1_data(*state['figure_1_data'], state['workdir']/'figure_1_data.xlsx')
+    return sum(len(table) for table in state['summaries'].values()) + len(state['figure_1_data'][0])
+
+
+def _render(jobs):
+    from .render import _use_headless_backend, render_job
+    _use_headless_backend()
+    for job in jobs:
+        render_job(job)
+    return len(jobs)
+
+
+@benchmark('figure_1')
+def _figure_1(state):
+    from .render import figure_1_jobs
+    return _render(figure_1_jobs(state['figure_1_data'][0], state['workdir']))
+
+
+@benchmark('figure_2')
+def _figure_2(state):
+    from .figures import stringency_bar_data
+    from .render import figure_2_jobs
+    final_year, final_week, _ = pd.Timestamp(state['study_end']).isocalendar()
+    bars = stringency_bar_data(state['merged_iris_grt'], state['study_years'], final_year, final_week)
+    return _render(figure_2_jobs(bars, state['workdir']))
+
+
+@benchmark('figure_S5')
+def _figure_S5(state):
+    from .render import figure_S5_jobs
+    return _render(figure_S5_jobs(state['google_res_work'], state['workdir']))
+
+
+def run(scale, workdir, excel_isolates=50000, skip=(), repeat=1):
+    '''Generates synthetic data at the given scale and runs each benchmark, returning a list of result dicts.
+
+    Each benchmark is run repeat times; the fastest time is reported, with the peak memory of the first run.
+    '''
+    workdir = pathlib.Path(workdir)
+    study_start, study_end = synthetic.study_period(scale)
+    state = {
+        'workdir': workdir,
+        'study_start': study_start.strftime('%Y-%m-%d'),
+        'study_end': study_end.strftime('%Y-%m-%d'),
+        'study_years': list(range(scale.final_year - scale.years + 1, scale.final_year + 1)),
+    }
+
+    started = time.perf_counter()
+    state['data'] = synthetic.write(scale, workdir/'inputs', excel=False)
+    state['exports'] = synthetic.isolate_exports(scale)
+    if 'excel_ingest' not in skip or 'service_load' not in skip:
+        state['excel_data'] = synthetic.write(scale._replace(isolates=min(excel_isolates, scale.isolates)), workdir/'excel_inputs')
+    generated = time.perf_counter() - started
+
+    results = [{'benchmark': 'generate', 'seconds': generated, 'peak_mb': None, 'rows': scale.isolates}]
+    for name, func in BENCHMARKS:
+        if name in skip:
+            continue
+        times = []
+        for i in range(repeat):
+            with PeakMemory() as memory:
+                started = time.perf_counter()
+                rows = func(state)
+                times.append(time.perf_counter() - started)
+            if i == 0:
+                peak = memory.peak
+        results.append({'benchmark': name, 'seconds': min(times), 'peak_mb': peak / 2**20, 'rows': rows})
+    return results
+
+
+def report(results):
+    lines = ['{:15} {:>10} {:>10} {:>12}'.format('benchmark', 'seconds', 'peak MB', 'rows')]
+    for result in results:
+        peak = '' if result['peak_mb'] is None else '{:.1f}'.format(result['peak_mb'])
+        lines.append('{:15} {:>10.3f} {:>10} {:>12,}'.format(result['benchmark'], result['seconds'], peak, result['rows']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m iris_pipeline.benchmark', description='Benchmark each processing step on synthetic data.')
+    parser.add_argument('--isolates', type=int, default=1000000, help='total number of isolates (default: 1000000)')
+    parser.add_argument('--countries', type=int, default=len(synthetic.IRIS_COUNTRIES), help='number of countries (default: the IRIS countries)')
+    parser.add_argument('--years', type=int, default=3, help='number of ISO years in the study period (default: 3)')
+    parser.add_argument('--excel-isolates', type=int, default=50000, help='isolates in the Excel exports for excel_ingest and service_load (default: 50000)')
+    parser.add_argument('--skip', nargs='+', default=[], metavar='BENCHMARK', choices=[name for name, _ in BENCHMARKS],
+                        help='benchmarks to skip (e.g. the figures at large scale)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each benchmark; the fastest is reported (default: 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', type=pathlib.Path, help='directory for the synthetic inputs and outputs (default: a temporary directory)')
+    parser.add_argument('--json', type=pathlib.Path, help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    scale = synthetic.Scale(args.isolates, args.countries, args.years, seed=args.seed)
+    with tempfile.TemporaryDirectory(prefix='iris_benchmark_') as tmp:
+        results = run(scale, args.workdir or tmp, args.excel_isolates, args.skip, args.repeat)
+    print(report(results))
+
+    if args.json is not None:
+        with open(args.json, 'w') as handle:
+            json.dump({
+                'scale': scale._asdict(),
+                'environment': {
+                    'python': platform.python_version(),
+                    'pandas': pd.__version__,
+                    'numpy': np.__version__,
+                    'platform': platform.platform(),
+                    'cpus': os.cpu_count(),
+                },
+                'results': results,
+            }, handle, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,246 @@
+'''Content-hashed columnar cache for the raw input datasets.
+
+Parsing the PubMLST Excel exports and the large OxCGRT/Google CSV files is the slowest part of a cold run.
+The cache stores each parsed, typed dataframe in a columnar file (Parquet by default, or Feather) keyed on a
+hash of the raw file's contents and the arguments used to read it, so reruns with unchanged inputs load the
+stored frame instead of re-parsing the raw file.
+
+Entries for a source file are evicted as soon as the file changes, and the least recently used entries are
+evicted whenever the cache grows past its size cap.
+'''
+
+import hashlib
+import json
+import os
+import pathlib
+import time
+import warnings
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401 (required by pandas for Parquet and Feather)
+except ImportError:
+    pyarrow = None
+
+
+# Bump to invalidate all existing cache entries if the storage layout or what a reader returns changes
+CACHE_VERSION = 3
+
+DEFAULT_CACHE_DIR = '.iris_cache'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+FORMATS = {'parquet', 'feather'}
+
+_INDEX_FILE = 'index.json'
+# Column holding the (unnamed) row index of frames stored as Feather, when it isn't the default RangeIndex
+_FEATHER_INDEX = '__index__'
+_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    '''Returns the SHA-256 hex digest of a file's contents, reading it in blocks.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _reader_key(reader, kwargs):
+    '''Returns a stable string describing how a file was read (reader function and its arguments).'''
+    name = '{}.{}'.format(getattr(reader, '__module__', ''), getattr(reader, '__qualname__', repr(reader)))
+    args = ', '.join('{}={!r}'.format(k, kwargs[k]) for k in sorted(kwargs))
+    return 'v{}:{}({})'.format(CACHE_VERSION, name, args)
+
+
+def _storable(frame):
+    '''Converts object columns holding a mix of types (e.g. numeric and text isolate names) to strings.
+
+    Columnar formats require a single type per column, whereas Excel exports often mix numbers and text.
+    Missing values are left as missing.
+    '''
+    mixed = [
+        col for col in frame.columns
+        if frame[col].dtype == object
+        and pd.api.types.infer_dtype(frame[col], skipna=True).startswith('mixed')
+    ]
+    if not mixed:
+        return frame
+
+    frame = frame.copy()
+    for col in mixed:
+        frame[col] = frame[col].where(frame[col].isna(), frame[col].astype(str))
+    return frame
+
+
+class FrameCache:
+    '''Cache of parsed input dataframes stored as columnar files in a local directory.
+
+    Example:
+        cache = FrameCache('.iris_cache')
+        iris_sp = cache.read_excel('IRIS_Sp_corrected_20052021.xlsx', parse_dates=['date_sampled'])
+        grt = cache.load('OxCGRT_latest13102020.csv', pd.read_csv, low_memory=False)
+    '''
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, fmt='parquet'):
+        if fmt not in FORMATS:
+            raise ValueError("fmt must be one of {}, not '{}'".format(sorted(FORMATS), fmt))
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.enabled = pyarrow is not None
+        if not self.enabled:
+            warnings.warn('pyarrow is not installed, input files will be parsed without caching')
+        self._index = None
+
+    # Index of cache entries and of known file digests
+
+    @property
+    def index(self):
+        if self._index is None:
+            try:
+                with open(self.directory/_INDEX_FILE) as handle:
+                    self._index = json.load(handle)
+            except (FileNotFoundError, ValueError):
+                self._index = {}
+            self._index.setdefault('entries', {})
+            self._index.setdefault('digests', {})
+        return self._index
+
+    def _save_index(self):
+        # Write to a temporary file first so an interrupted run can't leave a truncated index
+        tmp = self.directory/(_INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as handle:
+            json.dump(self.index, handle, indent=1, sort_keys=True)
+        os.replace(tmp, self.directory/_INDEX_FILE)
+
+    def digest(self, path):
+        '''Returns the content digest of path, re-hashing only if its size or modification time changed.'''
+        path = pathlib.Path(path).resolve()
+        stat = path.stat()
+        known = self.index['digests'].get(str(path))
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+
+        sha256 = file_digest(path)
+        self.index['digests'][str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._save_index()
+        return sha256
+
+    # Reading and writing entries
+
+    def _entry_path(self, key):
+        return self.directory/'{}.{}'.format(key, self.fmt)
+
+    def _read_entry(self, key):
+        if self.fmt == 'feather':
+            frame = pd.read_feather(self._entry_path(key))
+            if _FEATHER_INDEX in frame:
+                frame = frame.set_index(_FEATHER_INDEX).rename_axis(None)
+            return frame
+        return pd.read_parquet(self._entry_path(key))
+
+    def _write_entry(self, key, frame):
+        if self.fmt == 'feather':
+            # Feather can't store an index, so one other than the default RangeIndex (e.g. the row numbers of the
+            # mobility report rows kept) is stored as a column
+            default = frame.index.equals(pd.RangeIndex(len(frame)))
+            frame.reset_index(drop=default, names=None if default else _FEATHER_INDEX).to_feather(self._entry_path(key))
+        else:
+            frame.to_parquet(self._entry_path(key))
+        return self._entry_path(key).stat().st_size
+
+    def _remove_entry(self, key):
+        self.index['entries'].pop(key, None)
+        try:
+            self._entry_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _key(self, path, reader, kwargs):
+        digest = self.digest(path)
+        how = _reader_key(reader, kwargs)
+        return hashlib.sha256('{}\n{}'.format(digest, how).encode()).hexdigest()[:32], digest, how
+
+    def lookup(self, path, reader, **kwargs):
+        '''Returns the cached result of reader(path, **kwargs), or None if it isn't in the cache.'''
+        if not self.enabled:
+            return None
+        key, _, _ = self._key(path, reader, kwargs)
+        entry = self.index['entries'].get(key)
+        if entry is None or not self._entry_path(key).exists():
+            return None
+        frame = self._read_entry(key)
+        entry['last_used'] = time.time()
+        self._save_index()
+        return frame
+
+    def store(self, path, reader, frame, **kwargs):
+        '''Stores frame as the result of reader(path, **kwargs), e.g. when it was read in another process.
+
+        Returns the frame as it will be loaded from the cache.
+        '''
+        frame = _storable(frame)
+        if not self.enabled:
+            return frame
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        source = str(pathlib.Path(path).resolve())
+        key, digest, how = self._key(path, reader, kwargs)
+        nbytes = self._write_entry(key, frame)
+
+        # Evict entries made from a previous version of the same file
+        stale = [k for k, e in self.index['entries'].items() if e['source'] == source and e['sha256'] != digest]
+        for k in stale:
+            self._remove_entry(k)
+
+        self.index['entries'][key] = {
+            'source': source,
+            'reader': how,
+            'sha256': digest,
+            'bytes': nbytes,
+            'last_used': time.time(),
+        }
+        self._evict_to_size(keep=key)
+        self._save_index()
+        return frame
+
+    def load(self, path, reader, **kwargs):
+        '''Returns reader(path, **kwargs), loading it from the cache if the file has been read this way before.'''
+        if not self.enabled:
+            return reader(path, **kwargs)
+        frame = self.lookup(path, reader, **kwargs)
+        if frame is None:
+            frame = self.store(path, reader, reader(path, **kwargs), **kwargs)
+        return frame
+
+    def _evict_to_size(self, keep=None):
+        '''Removes the least recently used entries until the cache is within its size cap.'''
+        entries = self.index['entries']
+        total = sum(e['bytes'] for e in entries.values())
+        for k in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if k == keep:
+                continue
+            total -= entries[k]['bytes']
+            self._remove_entry(k)
+
+    def clear(self):
+        '''Removes every entry from the cache.'''
+        for key in list(self.index['entries']):
+            self._remove_entry(key)
+        self.index['digests'].clear()
+        if self.directory.exists():
+            self._save_index()
+
+    # Convenience wrappers for the readers used by the IRIS pipeline
+
+    def read_excel(self, path, **kwargs):
+        return self.load(path, pd.read_excel, **kwargs)
+
+    def read_csv(self, path, **kwargs):
+        return self.load(path, pd.read_csv, **kwargs)
@@ -0,0 +1,189 @@
+'''Command-line entry point for the manuscript pipeline.
+
+Runs the selected stages (or groups of stages, see pipeline.STAGE_GROUPS) for a study period, reading the input
+files from a data directory and writing to a persistent output directory, so that reruns only recompute stages
+whose inputs changed.  The pipeline (and with it pandas) is only imported once the arguments are parsed, and the
+plotting libraries only when a figure is rendered.
+
+Examples (from code/data_processing_and_visualisation):
+    python -m iris_pipeline --list-stages
+    python -m iris_pipeline --stages datasets --data-dir ~/iris_data --output nightly
+    python -m iris_pipeline --start 2018-01-01 --end 2020-05-31 --stages figure_2 --render-workers 4
+    python -m iris_pipeline --isolates "S. pneumoniae=IRIS_Sp_20052021.xlsx" --oxcgrt OxCGRT_latest.csv
+    python -m iris_pipeline --stages figure_2 --force figure_2_data --profile figure_2_data
+    python -m iris_pipeline --update --isolates "S. pneumoniae=IRIS_Sp_latest.xlsx"
+    python -m iris_pipeline --snapshot 2020-10-13 --snapshot "2021-05-20:S. pneumoniae=IRIS_Sp_corrected_20052021.xlsx"
+
+Each run writes run_report.json (time, memory, rows and bytes written per stage) to the output directory.
+'''
+
+import argparse
+import pathlib
+import time
+
+
+DEFAULT_OUTPUT = 'IRIS_manuscript_outputs'
+
+
+def _isolate_file(value):
+    species, sep, path = value.partition('=')
+    if not sep or not species or not path:
+        raise argparse.ArgumentTypeError("expected SPECIES=PATH, e.g. 'S. pneumoniae=IRIS_Sp.xlsx', got '{}'".format(value))
+    return species, path
+
+
+def _snapshot_file(value):
+    label, sep, isolates = value.partition(':')
+    if not label:
+        raise argparse.ArgumentTypeError("expected LABEL or LABEL:SPECIES=PATH, got '{}'".format(value))
+    return label, _isolate_file(isolates) if sep else None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m iris_pipeline',
+        description='Reproduce the IRIS data summaries, publication datasets and figures.',
+    )
+    inputs = parser.add_argument_group('input files (relative to --data-dir unless absolute)')
+    inputs.add_argument('--data-dir', type=pathlib.Path, default=pathlib.Path('.'),
+                        help='directory containing the input files (default: current directory)')
+    inputs.add_argument('--isolates', metavar='SPECIES=PATH', type=_isolate_file, action='append',
+                        help='PubMLST export for an organism (repeat for each organism to replace; others keep their default file)')
+    inputs.add_argument('--oxcgrt', metavar='PATH', help='OxCGRT dataset')
+    inputs.add_argument('--mobility', metavar='PATH', help='Google COVID-19 Community Mobility Reports dataset (.csv or .csv.zip)')
+
+    study = parser.add_argument_group('study period')
+    study.add_argument('--start', metavar='YYYY-MM-DD', help='first day of the study period (default: 2018-01-01)')
+    study.add_argument('--end', metavar='YYYY-MM-DD', help='last day of the study period (default: 2020-05-31)')
+
+    run = parser.add_argument_group('run')
+    run.add_argument('--stages', nargs='+', metavar='STAGE',
+                     help='stages or stage groups to run, with the stages they depend on (default: all)')
+    run.add_argument('--force', nargs='+', metavar='STAGE', default=[], help='stages to rerun even if up to date')
+    run.add_argument('--output', type=pathlib.Path, default=pathlib.Path(DEFAULT_OUTPUT),
+                     help='output directory, reused between runs (default: {})'.format(DEFAULT_OUTPUT))
+    run.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path('.iris_cache'),
+                     help='cache of parsed input files (default: .iris_cache)')
+    run.add_argument('--no-cache', action='store_true', help="don't cache parsed input files")
+    run.add_argument('--render-workers', type=int, default=1, metavar='N',
+                     help='render figures in N worker processes (0 for one per CPU, default: 1)')
+    run.add_argument('--profile', nargs='+', metavar='STAGE', default=[],
+                     help='run these stages under cProfile, writing profiles/<stage>.prof to the output directory')
+    run.add_argument('--no-report', action='store_true', help="don't write run_report.json to the output directory")
+    run.add_argument('--stata', action='store_true',
+                     help='also write the publication datasets and weekly counts per species as Stata .dta files')
+    run.add_argument('--update', action='store_true',
+                     help='only add isolates received since the last update to the IRIS dataset and Figure 2 data (see incremental.py)')
+    run.add_argument('--snapshot', metavar='LABEL[:SPECIES=PATH]', type=_snapshot_file, action='append',
+                     help='compare the isolate exports of snapshots (repeat for each snapshot and each file replacing '
+                          'one of the --isolates exports in it, see snapshots.py)')
+    run.add_argument('--list-stages', action='store_true', help='list the stages and stage groups and exit')
+    return parser
+
+
+def _config(args, pipeline):
+    '''Run configuration from the defaults, overridden by the command-line arguments.'''
+    defaults = pipeline.DEFAULT_CONFIG
+    resolve = lambda path: str(args.data_dir/path)
+
+    isolate_files = dict(defaults['isolate_files'])
+    isolate_files.update(args.isolates or [])
+    return pipeline.study_config(
+        args.start or defaults['study_start'],
+        args.end or defaults['study_end'],
+        isolate_files={species: resolve(path) for species, path in isolate_files.items()},
+        oxcgrt_file=resolve(args.oxcgrt or defaults['oxcgrt_file']),
+        mobility_file=resolve(args.mobility or defaults['mobility_file']),
+        stata_export=args.stata,
+    )
+
+
+def _snapshots(args, config):
+    '''Snapshots in the order first given, each with the isolate exports of config replaced by its own files.'''
+    from .snapshots import Snapshot
+
+    files = {}
+    for label, isolates in args.snapshot:
+        files.setdefault(label, dict(config['isolate_files']))
+        if isolates is not None:
+            species, path = isolates
+            files[label][species] = str(args.data_dir/path)
+    return [Snapshot(label, isolate_files) for label, isolate_files in files.items()]
+
+
+def _list_stages(pipeline):
+    for name, stage in pipeline.manuscript.stages.items():
+        print('{:15} {}'.format(name, ', '.join(stage.deps) if stage.deps else ''))
+    print()
+    for group, stages in pipeline.STAGE_GROUPS.items():
+        print('{:15} = {}'.format(group, ' '.join(stages)))
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    from . import pipeline
+
+    if args.list_stages:
+        _list_stages(pipeline)
+        return 0
+
+    known = set(pipeline.manuscript.stages) | set(pipeline.STAGE_GROUPS)
+    unknown = [name for name in (args.stages or []) + args.force + args.profile if name not in known]
+    if unknown:
+        parser.error('unknown stages: {} (see --list-stages)'.format(', '.join(unknown)))
+
+    import pandas as pd
+
+    try:
+        config = _config(args, pipeline)
+    except ValueError as error:
+        parser.error('invalid study period: {}'.format(error))
+    if pd.Timestamp(config['study_end']) < pd.Timestamp(config['study_start']):
+        parser.error('the study period ends before it starts')
+
+    started = time.time()
+    if args.update:
+        from . import incremental
+        result = incremental.update(config, args.output, cache_dir=None if args.no_cache else args.cache_dir)
+        if result.rebuilt:
+            print('Counted all {} isolates (no previous update state, or the IRIS dataset was rewritten since)'.format(result.new_isolates))
+        else:
+            print('Added {} isolates, {} changed Figure 2 rows'.format(result.new_isolates, result.changed_rows))
+        if result.watermark is not None:
+            print('Isolates received up to {:%Y-%m-%d}'.format(result.watermark))
+        print('Finished in {:.1f}s, outputs in {}'.format(time.time() - started, args.output))
+        return 0
+
+    if args.snapshot:
+        from .cache import FrameCache
+        from . import snapshots
+        selected = _snapshots(args, config)
+        if len(selected) < 2:
+            parser.error('--snapshot needs at least two snapshots to compare')
+        comparison = snapshots.compare_snapshots(
+            selected, config['study_years'], config['study_start'], config['study_end'],
+            cache=None if args.no_cache else FrameCache(args.cache_dir))
+        totals = snapshots.write_comparison(comparison, args.output/snapshots.COMPARISON_DIR)
+        for row in totals.itertuples():
+            print('{} -> {}: {} added ({} back-dated), {} removed, {} moved'.format(
+                row.before, row.after, row.added, row.backdated, row.removed, row.moved_in))
+        print('Finished in {:.1f}s, outputs in {}'.format(time.time() - started, args.output/snapshots.COMPARISON_DIR))
+        return 0
+
+    status = pipeline.run(
+        config,
+        args.output,
+        targets=pipeline.expand_stages(args.stages) if args.stages else None,
+        force=pipeline.expand_stages(args.force),
+        cache_dir=None if args.no_cache else args.cache_dir,
+        render_workers=args.render_workers or None,
+        profile=pipeline.expand_stages(args.profile),
+        report=not args.no_report,
+    )
+    for name, outcome in status.items():
+        print('{:15} {}'.format(name, outcome))
+    print('Finished in {:.1f}s, outputs in {}'.format(time.time() - started, args.output))
+    return 0
+
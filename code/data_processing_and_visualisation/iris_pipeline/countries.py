@@ -0,0 +1,159 @@
+'''Country dimension shared by the isolate, OxCGRT and Google mobility data.
+
+Each source names countries its own way: PubMLST exports have e.g. 'The Netherlands' and 'UK [England]', OxCGRT
+reports the UK nations as regions of the United Kingdom, and Google calls the Czech Republic 'Czechia'.  The
+CountryDimension holds one row per country with its canonical name (as used in all outputs), ISO codes, its name
+in each source, the nation it is part of (the UK nations are IRIS countries in their own right) and its
+continent.  A country's code is its row number.  Source names are mapped to codes or canonical names by looking
+up each distinct name once (the categories of a categorical column), rather than by string replacement over
+every row.
+
+Example:
+    codes = COUNTRIES.codes(isolates['country'], 'pubmlst')
+    isolates['country'] = COUNTRIES.canonical(isolates['country'], 'pubmlst')
+'''
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+SOURCES = ('name', 'pubmlst', 'oxcgrt', 'google')
+
+# iso2 and iso3 are ISO 3166-1 codes; subdivision is the ISO 3166-2 code of the UK nations.  For the UK nations,
+# oxcgrt is their RegionName (their CountryName being the parent, United Kingdom).  iris marks IRIS countries.
+Country = collections.namedtuple('Country', ['name', 'iso2', 'iso3', 'subdivision', 'pubmlst', 'oxcgrt', 'google',
+                                             'parent', 'continent', 'iris'])
+
+COUNTRY_TABLE = [
+    Country('Belgium', 'BE', 'BEL', None, 'Belgium', 'Belgium', 'Belgium', None, 'Europe', True),
+    Country('Brazil', 'BR', 'BRA', None, 'Brazil', 'Brazil', 'Brazil', None, 'South America', True),
+    Country('Canada', 'CA', 'CAN', None, 'Canada', 'Canada', 'Canada', None, 'North America', True),
+    Country('China', 'CN', 'CHN', None, 'China', 'China', 'China', None, 'Asia', True),
+    Country('Czech Republic', 'CZ', 'CZE', None, 'Czech Republic', 'Czech Republic', 'Czechia', None, 'Europe', True),
+    Country('Denmark', 'DK', 'DNK', None, 'Denmark', 'Denmark', 'Denmark', None, 'Europe', True),
+    Country('England', 'GB', 'GBR', 'GB-ENG', 'UK [England]', 'England', None, 'United Kingdom', 'Europe', True),
+    Country('Finland', 'FI', 'FIN', None, 'Finland', 'Finland', 'Finland', None, 'Europe', True),
+    Country('France', 'FR', 'FRA', None, 'France', 'France', 'France', None, 'Europe', True),
+    Country('Germany', 'DE', 'DEU', None, 'Germany', 'Germany', 'Germany', None, 'Europe', True),
+    Country('Hong Kong', 'HK', 'HKG', None, 'China [Hong Kong]', 'Hong Kong', 'Hong Kong', None, 'Asia', True),
+    Country('Iceland', 'IS', 'ISL', None, 'Iceland', 'Iceland', 'Iceland', None, 'Europe', True),
+    Country('Ireland', 'IE', 'IRL', None, 'Ireland', 'Ireland', 'Ireland', None, 'Europe', True),
+    Country('Israel', 'IL', 'ISR', None, 'Israel', 'Israel', 'Israel', None, 'Asia', True),
+    Country('Luxembourg', 'LU', 'LUX', None, 'Luxembourg', 'Luxembourg', 'Luxembourg', None, 'Europe', True),
+    Country('Netherlands', 'NL', 'NLD', None, 'The Netherlands', 'Netherlands', 'Netherlands', None, 'Europe', True),
+    Country('New Zealand', 'NZ', 'NZL', None, 'New Zealand', 'New Zealand', 'New Zealand', None, 'Oceania', True),
+    Country('Northern Ireland', 'GB', 'GBR', 'GB-NIR', 'UK [Northern Ireland]', 'Northern Ireland', None,
+            'United Kingdom', 'Europe', True),
+    Country('Poland', 'PL', 'POL', None, 'Poland', 'Poland', 'Poland', None, 'Europe', True),
+    Country('Scotland', 'GB', 'GBR', 'GB-SCT', 'UK [Scotland]', 'Scotland', None, 'United Kingdom', 'Europe', True),
+    Country('South Africa', 'ZA', 'ZAF', None, 'South Africa', 'South Africa', 'South Africa', None, 'Africa', True),
+    Country('South Korea', 'KR', 'KOR', None, 'South Korea', 'South Korea', 'South Korea', None, 'Asia', True),
+    Country('Spain', 'ES', 'ESP', None, 'Spain', 'Spain', 'Spain', None, 'Europe', True),
+    Country('Sweden', 'SE', 'SWE', None, 'Sweden', 'Sweden', 'Sweden', None, 'Europe', True),
+    Country('Switzerland', 'CH', 'CHE', None, 'Switzerland', 'Switzerland', 'Switzerland', None, 'Europe', True),
+    Country('United Kingdom', 'GB', 'GBR', None, None, 'United Kingdom', 'United Kingdom', None, 'Europe', False),
+    Country('Wales', 'GB', 'GBR', 'GB-WLS', 'UK [Wales]', 'Wales', None, 'United Kingdom', 'Europe', True),
+]
+
+
+def _distinct(values):
+    '''Integer codes of values and their distinct values (the codes and categories of a categorical).'''
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return np.asarray(values.cat.codes), values.cat.categories
+    return pd.factorize(values)
+
+
+class CountryDimension:
+    '''Countries with their canonical names, ISO codes, names in each source, parent nation and continent.'''
+
+    def __init__(self, countries=COUNTRY_TABLE):
+        self.table = pd.DataFrame(list(countries), columns=Country._fields)
+        if self.table['name'].duplicated().any():
+            raise ValueError('duplicate country names: {}'.format(
+                ', '.join(self.table.loc[self.table['name'].duplicated(), 'name'])))
+        self.names = pd.Index(self.table['name'])
+
+    def __len__(self):
+        return len(self.table)
+
+    def _source_rows(self, names, source):
+        '''Row of each name in source (-1 for names not in the dimension).  Countries without a name in source
+        (e.g. the UK nations in the Google data) are left out of the lookup.'''
+        if source not in SOURCES:
+            raise ValueError('unknown source {!r}, expected one of {}'.format(source, ', '.join(SOURCES)))
+        named = np.flatnonzero(self.table[source].notna())
+        rows = pd.Index(self.table[source].to_numpy()[named]).get_indexer(names)
+        return np.where(rows >= 0, named[rows], -1)
+
+    def aliases(self, source):
+        '''{name in source: canonical name} for the countries named differently in source.'''
+        named = self.table.loc[self.table[source].notna() & (self.table[source] != self.table['name'])]
+        return dict(zip(named[source], named['name']))
+
+    def codes(self, values, source='name'):
+        '''Country code of each value, a country name in source (-1 for names not in the dimension).
+
+        Each distinct name is looked up once.
+        '''
+        codes, distinct = _distinct(values)
+        lookup = np.append(self._source_rows(distinct, source), -1)
+        return lookup[codes]
+
+    def _canonical_names(self, distinct, source):
+        # Canonical names of distinct source names, keeping names not in the dimension as they are
+        found = self._source_rows(distinct, source)
+        return np.where(found >= 0, self.names.to_numpy()[found], np.asarray(distinct, dtype=object))
+
+    def canonical(self, values, source):
+        '''values (country names in source) as a categorical of canonical names with sorted categories.
+
+        Names not in the dimension are kept as they are.  Where two source names are the same country, their
+        categories are merged.
+        '''
+        values = pd.Series(values)
+        codes, distinct = _distinct(values)
+        names = self._canonical_names(distinct, source)
+        categories = sorted(set(names))
+        recode = np.append(pd.Index(categories).get_indexer(names), -1)
+        return pd.Series(pd.Categorical.from_codes(recode[codes], categories), index=values.index, name=values.name)
+
+    def canonical_names(self, values, source):
+        '''values (country names in source) as canonical names, as an array of strings (see canonical).'''
+        codes, distinct = _distinct(values)
+        return np.append(self._canonical_names(distinct, source), np.nan)[codes]
+
+    def source_names(self, names, source):
+        '''Name in source of each canonical name (names not in the dimension, or not in source, kept as they are).'''
+        names = list(names)
+        found = self.names.get_indexer(names)
+        in_source = self.table[source].to_numpy()
+        return [in_source[i] if i >= 0 and pd.notna(in_source[i]) else name for i, name in zip(found, names)]
+
+    def nations(self, parent):
+        '''Canonical names of the countries that are part of parent (e.g. the UK nations).'''
+        return self.table.loc[self.table['parent'] == parent, 'name'].tolist()
+
+    def continents(self):
+        '''{canonical name: continent} of every country.'''
+        return dict(zip(self.table['name'], self.table['continent']))
+
+    def national(self, names):
+        '''National level country of each canonical name: the parent of the UK nations, others as they are.'''
+        names = list(names)
+        found = self.names.get_indexer(names)
+        parents = self.table['parent'].to_numpy()
+        return [parents[i] if i >= 0 and pd.notna(parents[i]) else name for i, name in zip(found, names)]
+
+    def iris_countries(self, grouped=False):
+        '''Canonical names of the IRIS countries, or with grouped, of the national level countries they are
+        part of (the UK nations grouped as the United Kingdom, as in the Google mobility reports).'''
+        iris = self.table.loc[self.table['iris']]
+        if not grouped:
+            return iris['name'].tolist()
+        return sorted(set(iris['parent'].fillna(iris['name'])))
+
+
+COUNTRIES = CountryDimension()
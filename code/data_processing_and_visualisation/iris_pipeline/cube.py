@@ -0,0 +1,181 @@
+'''Dense species x country x ISO year x ISO week count cube.
+
+Weekly isolate counts are held in a single integer array built in one pass over the isolate table: each
+isolate's (species, country, ISO year, ISO week) is converted to integer codes, the codes are combined into a
+flat cell number and the cells are counted with np.bincount.  Two masks record which cells are meaningful:
+
+- reported: (species, country) pairs that submitted data (pairs that never did are left out of summaries,
+  whereas pairs in KNOWN_ZERO_REPORTERS submitted data but received no isolates)
+- week_valid: (ISO year, ISO week) cells that exist (week 53 only exists in some ISO years) and fall inside the
+  study period, so partial first and final years are handled
+
+Cumulative counts are a cumsum along the week axis.  to_frame() returns the long-form weekly summary used for
+Figure 2 (iris_summary), with NaN counts for weeks outside the study period.
+
+Cubes over the same study period can be added, e.g. to count newly received isolates into an existing cube
+(see incremental.py); add() also reports which cells' counts or cumulative counts changed.
+'''
+
+import numpy as np
+import pandas as pd
+
+from .dates import iso_weeks_in_year
+
+
+# (species, country) pairs known to have reported no isolates during the study period, as opposed to not
+# providing data at all.  These keep their rows (with zero counts) in the weekly summaries.
+KNOWN_ZERO_REPORTERS = {('N. meningitidis', 'Iceland')}
+
+MAX_ISO_WEEKS = 53
+
+INDEX_NAMES = ['species', 'country', 'isoyear_sampled', 'week_sampled']
+
+
+def _pair_order(species_codes, country_codes, n_species, n_countries):
+    '''Positions of the species and countries in the order they appear in a sorted (species, country) index.'''
+    pairs = np.flatnonzero(np.bincount(species_codes * n_countries + country_codes, minlength=n_species * n_countries))
+    return pd.unique(pairs // n_countries), pd.unique(pairs % n_countries)
+
+
+def _recode(codes, order, n):
+    '''Maps factorized codes onto their positions in order (codes not in order and -1 stay -1).'''
+    lookup = np.full(n + 1, -1)
+    lookup[order] = np.arange(len(order))
+    return lookup[codes]
+
+
+class WeeklyCube:
+    '''Weekly isolate counts as a dense (species, country, year, week) array with validity masks.'''
+
+    def __init__(self, counts, species, countries, years, reported, week_valid):
+        self.counts = counts
+        self.species = list(species)
+        self.countries = list(countries)
+        self.years = np.asarray(years)
+        self.reported = reported
+        self.week_valid = week_valid
+
+    @classmethod
+    def from_isolates(cls, iris_orgs, study_years, study_start, study_end):
+        '''Counts isolates per species, country, ISO year and ISO week in a single pass.'''
+        # Only isolates with a name and an ISO year and week are counted
+        iris_orgs = iris_orgs.dropna(subset=['isolate', 'isoyear_sampled', 'week_sampled'])
+        years = np.asarray(study_years)
+
+        # Integer-code each key once (codes of -1 mark missing values or values outside the cube)
+        s, species = pd.factorize(iris_orgs['species'], sort=True)
+        c, countries = pd.factorize(iris_orgs['country'], sort=True)
+        y = pd.Index(years).get_indexer(iris_orgs['isoyear_sampled'].to_numpy())
+        w = iris_orgs['week_sampled'].to_numpy(dtype='float64', na_value=np.nan) - 1
+        known = (s >= 0) & (c >= 0)
+        inside = known & (y >= 0) & (w >= 0) & (w < MAX_ISO_WEEKS)
+
+        # Species and countries are ordered as in the sorted (species, country) index of the isolates
+        species_order, country_order = _pair_order(s[known], c[known], len(species), len(countries))
+        s = _recode(s, species_order, len(species))
+        c = _recode(c, country_order, len(countries))
+        species = species.take(species_order).tolist()
+        countries = countries.take(country_order).tolist()
+
+        shape = (len(species), len(countries), len(years), MAX_ISO_WEEKS)
+        cells = np.ravel_multi_index((s[inside], c[inside], y[inside], w[inside].astype('int64')), shape)
+        counts = np.bincount(cells, minlength=int(np.prod(shape))).reshape(shape)
+
+        week_valid = study_week_mask(years, study_start, study_end)
+
+        # A pair submitted data if any isolates were counted for it, or if it is a known zero reporter
+        reported = counts.sum(axis=(2, 3)) > 0
+        for pair in KNOWN_ZERO_REPORTERS:
+            if pair[0] in species and pair[1] in countries:
+                reported[species.index(pair[0]), countries.index(pair[1])] = True
+
+        return cls(counts, species, countries, years, reported, week_valid)
+
+    def _aligned(self, species, countries):
+        '''The counts and reported mask with the species and countries axes laid out as the given lists (which
+        must include all of the cube's species and countries).'''
+        s = pd.Index(species).get_indexer(self.species)
+        c = pd.Index(countries).get_indexer(self.countries)
+        counts = np.zeros((len(species), len(countries)) + self.counts.shape[2:], dtype=self.counts.dtype)
+        counts[np.ix_(s, c)] = self.counts
+        reported = np.zeros((len(species), len(countries)), dtype=bool)
+        reported[np.ix_(s, c)] = self.reported
+        return counts, reported
+
+    def add(self, other):
+        '''Adds the counts of another cube over the same study period, e.g. one of newly received isolates.
+
+        Returns the combined cube and a mask of its cells whose count or cumulative count changed: each week
+        with added isolates and the rest of its ISO year, and every cell of (species, country) pairs reported
+        for the first time.
+        '''
+        if not (np.array_equal(self.years, other.years) and np.array_equal(self.week_valid, other.week_valid)):
+            raise ValueError('cannot add weekly counts over different study periods')
+        species = sorted(set(self.species) | set(other.species))
+        countries = sorted(set(self.countries) | set(other.countries))
+        counts, reported = self._aligned(species, countries)
+        added, added_reported = other._aligned(species, countries)
+
+        # A late, back-dated isolate changes its own week and the cumulative counts of later weeks in the year
+        changed = np.logical_or.accumulate((added > 0) & self.week_valid, axis=3) & self.week_valid
+        changed |= (added_reported & ~reported)[:, :, None, None]
+        counts = counts + added
+        reported = reported | added_reported
+
+        # Keep species and countries in the order of the sorted (species, country) index, as from_isolates does
+        species_order, country_order = _pair_order(*np.nonzero(reported), len(species), len(countries))
+        reorder = np.ix_(species_order, country_order)
+        cube = WeeklyCube(counts[reorder], [species[i] for i in species_order], [countries[i] for i in country_order],
+                          self.years, reported[reorder], self.week_valid)
+        return cube, changed[reorder]
+
+    @property
+    def valid(self):
+        '''Boolean mask of cells that hold a meaningful count (reported pair and valid study week).'''
+        return self.reported[:, :, None, None] & self.week_valid[None, None, :, :]
+
+    def cumulative(self):
+        '''Cumulative counts within each ISO year, NaN outside the study period.'''
+        cumulative = np.cumsum(np.where(self.week_valid, self.counts, 0), axis=3).astype('float64')
+        cumulative[..., ~self.week_valid] = np.nan
+        return cumulative
+
+    def to_frame(self, weeks=None, cells=None):
+        '''Long-form weekly counts with a row per reported (species, country), study year and week.
+
+        Counts and cumulative counts are NaN for weeks outside the study period.  By default every year has rows
+        for weeks 1-52, or 1-53 if the study period includes a week 53.  cells (a boolean array shaped like
+        counts) restricts the rows to the selected cells, e.g. the changed cells returned by add().
+        '''
+        if weeks is None:
+            weeks = range(1, MAX_ISO_WEEKS + 1 if self.week_valid[:, MAX_ISO_WEEKS - 1].any() else MAX_ISO_WEEKS)
+        weeks = np.asarray(weeks)
+        w = weeks - 1
+        counts = np.where(self.week_valid, self.counts, np.nan)[..., w]
+        cumulative = self.cumulative()[..., w]
+
+        index = pd.MultiIndex.from_product([self.species, self.countries, self.years.tolist(), weeks], names=INDEX_NAMES)
+        keep = np.broadcast_to(self.reported[:, :, None, None], counts.shape)
+        if cells is not None:
+            keep = keep & cells[..., w]
+        keep = keep.ravel()
+
+        return pd.DataFrame({
+            'count': counts.ravel()[keep],
+            'Cumulative isolate count': cumulative.ravel()[keep],
+        }, index=index[keep])
+
+
+def study_week_mask(years, study_start, study_end):
+    '''(year, week) mask of ISO weeks that exist in each ISO year and fall within the study period.'''
+    years = np.asarray(years)
+    weeks = np.arange(1, MAX_ISO_WEEKS + 1)
+    n_weeks = iso_weeks_in_year(years)
+    mask = weeks[None, :] <= n_weeks[:, None]
+
+    start_year, start_week, _ = pd.Timestamp(study_start).isocalendar()
+    end_year, end_week, _ = pd.Timestamp(study_end).isocalendar()
+    year_week = years[:, None] * 100 + weeks[None, :]
+    mask &= year_week >= start_year * 100 + start_week
+    mask &= year_week <= end_year * 100 + end_week
+    return mask
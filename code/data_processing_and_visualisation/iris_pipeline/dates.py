@@ -0,0 +1,128 @@
+'''ISO 8601 calendar date dimension shared by the isolate, OxCGRT and Google mobility data.
+
+A DateDimension maps every date in a range to its ISO year, ISO week and a continuous study week index (1 for
+the ISO week containing the study start date, then counting on across year boundaries, so that 53-week ISO
+years are handled).  The dimension is computed once with integer arithmetic on day numbers, and dates are
+joined to it by their offset from the first day rather than by formatting each date as a string.
+
+Example:
+    calendar = DateDimension.covering(grt_iris['Date'])
+    grt_iris[['year', 'week']] = calendar.lookup(grt_iris['Date'])[['isoyear', 'week']]
+'''
+
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = ['isoyear', 'week', 'study_week']
+
+# Day 0 (1970-01-01) was a Thursday, i.e. day 3 of its ISO week counting from Monday = 0
+EPOCH_WEEKDAY = 3
+
+
+def _day_numbers(dates):
+    '''Days since 1970-01-01 of each date (NaT becomes the minimum int64).'''
+    return np.asarray(pd.to_datetime(dates).values.astype('datetime64[D]'), dtype='int64')
+
+
+def _mondays(days):
+    return days - (days + EPOCH_WEEKDAY) % 7
+
+
+def _iso_calendar(days):
+    '''ISO year and ISO week of each day number.
+
+    The ISO year is the calendar year of the Thursday in the same week, and the ISO week counts the Thursdays
+    from the start of that year.
+    '''
+    thursdays = _mondays(days) + 3
+    isoyear = thursdays.astype('datetime64[D]').astype('datetime64[Y]').astype('int64') + 1970
+    new_year = (isoyear - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype('int64')
+    week = (thursdays - new_year) // 7 + 1
+    return isoyear, week
+
+
+def iso_weeks_in_year(year):
+    '''Number of ISO weeks (52 or 53) in each ISO year; 28 December always falls in the final week.'''
+    year = np.asarray(year, dtype='int64')
+    # 4 days before the next 1 January, so leap years are counted
+    december_28 = (year + 1 - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype('int64') - 4
+    return _iso_calendar(december_28)[1]
+
+
+def study_years(study_start, study_end):
+    '''ISO years overlapping the study period, e.g. [2018, 2019, 2020] for 2018-01-01 to 2020-05-31.'''
+    return list(range(pd.Timestamp(study_start).isocalendar()[0], pd.Timestamp(study_end).isocalendar()[0] + 1))
+
+
+class DateDimension:
+    '''ISO year, ISO week and study week of every date from first to last (inclusive).
+
+    Study weeks count from the ISO week containing study_start (by default the first date).
+    '''
+
+    def __init__(self, first, last, study_start=None):
+        self.first = pd.Timestamp(first).normalize()
+        self.last = pd.Timestamp(last).normalize()
+        self.study_start = pd.Timestamp(study_start if study_start is not None else first).normalize()
+        if self.last < self.first:
+            raise ValueError('date dimension ends ({:%Y-%m-%d}) before it starts ({:%Y-%m-%d})'.format(self.last, self.first))
+
+        days = np.arange(_day_numbers([self.first])[0], _day_numbers([self.last])[0] + 1)
+        isoyear, week = _iso_calendar(days)
+        study_week = (_mondays(days) - _mondays(_day_numbers([self.study_start]))[0]) // 7 + 1
+        self.table = pd.DataFrame({'isoyear': isoyear, 'week': week, 'study_week': study_week},
+                                  index=pd.DatetimeIndex(days.astype('datetime64[D]'), name='date'))
+
+    @classmethod
+    def covering(cls, dates, study_start=None):
+        '''A dimension spanning the earliest to the latest of dates (and study_start, if given).'''
+        bounds = pd.Series(pd.to_datetime(dates)).agg(['min', 'max'])
+        if bounds.isna().any():
+            raise ValueError('cannot build a date dimension without any dates')
+        first, last = bounds['min'], bounds['max']
+        if study_start is not None:
+            first = min(first, pd.Timestamp(study_start))
+        return cls(first, last, study_start)
+
+    def lookup(self, dates):
+        '''ISO year, ISO week and study week of each date (aligned with dates' index if it is a Series).
+
+        Missing dates get missing values (the columns are then nullable integers).  Dates outside the dimension
+        raise a ValueError.
+        '''
+        offsets = _day_numbers(dates) - _day_numbers([self.first])[0]
+        missing = np.asarray(pd.isna(dates))
+        outside = ~missing & ((offsets < 0) | (offsets >= len(self.table)))
+        if outside.any():
+            raise ValueError('{} dates fall outside the date dimension ({:%Y-%m-%d} to {:%Y-%m-%d})'.format(
+                outside.sum(), self.first, self.last))
+
+        index = dates.index if isinstance(dates, pd.Series) else None
+        offsets = np.where(missing, 0, offsets)
+        columns = {}
+        for column in COLUMNS:
+            values = self.table[column].to_numpy()[offsets]
+            if missing.any():
+                values = pd.array(values, dtype='Int64')
+                values[missing] = pd.NA
+            columns[column] = values
+        return pd.DataFrame(columns, index=index)
+
+    def weeks(self):
+        '''One row per ISO week in the dimension, with the date of its Monday (or the first date).'''
+        first_days = ~self.table.duplicated(['isoyear', 'week'])
+        return self.table.loc[first_days].reset_index().set_index('study_week')
+
+    def study_weeks(self, isoyear, week):
+        '''Study week of each (ISO year, ISO week), e.g. the isoyear_sampled and week_sampled of isolates.
+
+        Weeks outside the dimension (or with a missing year or week) get missing values.
+        '''
+        weeks = self.weeks()
+        keys = pd.Index(weeks['isoyear'] * 100 + weeks['week'])
+        wanted = pd.Series(isoyear, dtype='float64').to_numpy() * 100 + pd.Series(week, dtype='float64').to_numpy()
+        positions = keys.get_indexer(np.where(np.isnan(wanted), -1, wanted).astype('int64'))
+        study_week = pd.array(weeks.index.to_numpy()[positions], dtype='Int64')
+        study_week[positions < 0] = pd.NA
+        return study_week
@@ -0,0 +1,420 @@
+'''Concurrent download of the input data: IRIS isolates from the PubMLST (BIGSdb) REST API, and the OxCGRT and
+Google COVID-19 Community Mobility Reports files.
+
+- Requests share a pool of persistent HTTP connections (at most max_per_host open to each host), and the
+  pages of each isolate database are requested concurrently once the first page gives the number of records.
+- Failed requests (connection errors, 429 and 5xx responses) are retried with exponential backoff, honouring
+  Retry-After.
+- Requests are conditional (If-None-Match/If-Modified-Since, using the validators saved in fetch_state.json in
+  the data directory), so unchanged files, and the unchanged pages of each isolate database after its first,
+  aren't downloaded again.  Downloads are streamed to disk, and files are only replaced if their contents
+  changed, so unchanged inputs don't invalidate the pipeline's stages.
+- With a cache, each downloaded file is parsed into the columnar cache (see cache.py) straight away, so the
+  next pipeline run starts from the parsed data.
+
+Isolates are written as one CSV export per organism (FETCH_FILES) in the columns of the PubMLST Excel exports,
+for use with `python -m iris_pipeline --isolates SPECIES=PATH`.  The IRIS project in each PubMLST database is
+given by its project id.  A local stand-in for all three sources is in mockserver.py.
+
+Example:
+    python -m iris_pipeline.fetch --data-dir ~/iris_data --project "S. pneumoniae=3" --project "H. influenzae=2" ...
+'''
+
+import argparse
+import collections
+import concurrent.futures
+import email.utils
+import http.client
+import json
+import math
+import os
+import pathlib
+import queue
+import random
+import threading
+import time
+import urllib.parse
+
+import pandas as pd
+
+from .cache import file_digest
+from .dates import DateDimension
+from .isolates import KEY_COLS
+
+
+BIGSDB_URL = 'https://rest.pubmlst.org'
+
+# PubMLST isolate database of each organism
+BIGSDB_DATABASES = {
+    'S. pneumoniae': 'pubmlst_spneumoniae_isolates',
+    'H. influenzae': 'pubmlst_hinfluenzae_isolates',
+    'N. meningitidis': 'pubmlst_neisseria_isolates',
+    'S. agalactiae': 'pubmlst_sagalactiae_isolates',
+}
+
+OXCGRT_URL = 'https://raw.githubusercontent.com/OxCGRT/covid-policy-tracker/master/data/OxCGRT_latest.csv'
+MOBILITY_URL = 'https://www.gstatic.com/covid19/mobility/Global_Mobility_Report.csv'
+
+# Isolate export written for each organism
+FETCH_FILES = {
+    'S. pneumoniae': 'IRIS_Sp_pubmlst.csv',
+    'H. influenzae': 'IRIS_Hi_pubmlst.csv',
+    'N. meningitidis': 'IRIS_Nm_pubmlst.csv',
+    'S. agalactiae': 'IRIS_Sa_pubmlst.csv',
+}
+
+# Columns of the isolate exports
+EXPORT_COLUMNS = [c for c in KEY_COLS if c != 'species'] + ['disease']
+
+STATE_FILE = 'fetch_state.json'
+PAGE_SIZE = 1000
+DEFAULT_WORKERS = 8
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_BLOCK_SIZE = 1 << 20
+
+Response = collections.namedtuple('Response', ['status', 'headers', 'body'])
+FetchResult = collections.namedtuple('FetchResult', ['source', 'path', 'changed'])
+
+
+class FetchError(Exception):
+    '''A request that failed after all retries, or returned an unexpected status.'''
+
+
+class ConnectionPool:
+    '''Persistent HTTP(S) connections shared between threads, with retries.
+
+    At most max_per_host requests are in flight to each host; idle connections are kept for reuse.
+    '''
+
+    def __init__(self, max_per_host=DEFAULT_WORKERS, timeout=60, retries=5, backoff=0.5):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def _host(self, url):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+                self._idle[key] = queue.LifoQueue()
+        return key
+
+    def _connect(self, key):
+        scheme, host, port = key
+        connection = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection(host, port, timeout=self.timeout)
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                when = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, when.timestamp() - time.time())
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+    def get(self, url, headers=None, path=None):
+        '''GETs url, returning a Response.
+
+        With path, a 200 response body is streamed to that file (written in full or not at all) instead of being
+        returned.  Statuses other than 200 and 304 raise a FetchError once retries are exhausted.
+        '''
+        key = self._host(url)
+        parts = urllib.parse.urlsplit(url)
+        target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        headers = dict(headers or {}, **{'Accept-Encoding': 'identity', 'User-Agent': 'iris_pipeline'})
+
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            with self._slots[key]:
+                try:
+                    connection = self._idle[key].get_nowait()
+                except queue.Empty:
+                    connection = self._connect(key)
+                try:
+                    connection.request('GET', target, headers=headers)
+                    response = connection.getresponse()
+                    if response.status == 200 and path is not None:
+                        _stream(response, path)
+                        body = None
+                    else:
+                        body = response.read()
+                except (OSError, http.client.HTTPException) as error:
+                    connection.close()
+                    failure = error
+                else:
+                    self._idle[key].put(connection)
+                    if response.status in (200, 304):
+                        return Response(response.status, response.headers, body)
+                    failure = FetchError('{} returned {} {}'.format(url, response.status, response.reason))
+                    if response.status not in RETRY_STATUSES:
+                        raise failure
+                    retry_after = response.headers.get('Retry-After')
+            if attempt < self.retries:
+                time.sleep(self._delay(attempt, retry_after))
+        raise FetchError('{} failed after {} attempts: {}'.format(url, self.retries + 1, failure))
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+
+
+def _stream(response, path):
+    partial = pathlib.Path(str(path) + '.partial')
+    try:
+        with open(partial, 'wb') as handle:
+            for block in iter(lambda: response.read(_BLOCK_SIZE), b''):
+                handle.write(block)
+        partial.replace(path)
+    finally:
+        if partial.exists():
+            partial.unlink()
+
+
+def _replace_if_changed(new, path):
+    '''Moves new over path unless the contents are identical (keeping path's modification time), returning
+    whether path changed.'''
+    new, path = pathlib.Path(new), pathlib.Path(path)
+    if path.exists() and path.stat().st_size == new.stat().st_size and file_digest(path) == file_digest(new):
+        new.unlink()
+        return False
+    new.replace(path)
+    return True
+
+
+class Validators:
+    '''ETag and Last-Modified of each URL downloaded to the data directory, saved in STATE_FILE.'''
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as handle:
+                self.known = json.load(handle)
+        except (FileNotFoundError, ValueError):
+            self.known = {}
+
+    def headers(self, url):
+        known = self.known.get(url, {})
+        headers = {}
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+        return headers
+
+    @staticmethod
+    def entry(response, **saved):
+        '''Validators of response, with any other values to save alongside them.'''
+        return dict({'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')},
+                    **saved)
+
+    def update(self, url, response, **saved):
+        self.save({url: self.entry(response, **saved)})
+
+    def save(self, entries):
+        '''Saves a {url: entry} dict of validators, replacing those of the same urls.'''
+        with self._lock:
+            self.known.update(entries)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as handle:
+                json.dump(self.known, handle, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+def download(pool, url, path, validators):
+    '''Downloads url to path unless it is unchanged since the last download, returning whether path changed.'''
+    path = pathlib.Path(path)
+    headers = validators.headers(url) if path.exists() else {}
+    partial = pathlib.Path(str(path) + '.download')
+    response = pool.get(url, headers, path=partial)
+    if response.status == 304:
+        return False
+    changed = _replace_if_changed(partial, path)
+    validators.update(url, response)
+    return changed
+
+
+# PubMLST isolates
+
+def isolates_url(base_url, database, project, page, page_size=PAGE_SIZE):
+    query = urllib.parse.urlencode({'page': page, 'page_size': page_size, 'include_records': 1})
+    return '{}/db/{}/projects/{}/isolates?{}'.format(base_url.rstrip('/'), database, project, query)
+
+
+def records_frame(records):
+    '''Isolate records from the BIGSdb API (their provenance fields) as rows of a PubMLST export.
+
+    ISO years and weeks are derived from date_sampled where the database doesn't hold them.
+    '''
+    frame = pd.DataFrame([record.get('provenance', record) for record in records])
+    # The S. pneumoniae database names the 'disease' field 'diagnosis'
+    if 'diagnosis' in frame:
+        frame['disease'] = frame['diagnosis'] if 'disease' not in frame else frame['disease'].fillna(frame['diagnosis'])
+    frame = frame.reindex(columns=EXPORT_COLUMNS)
+
+    missing = frame['isoyear_sampled'].isna() | frame['week_sampled'].isna()
+    date_sampled = pd.to_datetime(frame['date_sampled'], errors='coerce')
+    if (missing & date_sampled.notna()).any():
+        iso = DateDimension.covering(date_sampled.dropna()).lookup(date_sampled)
+        frame.loc[missing, 'isoyear_sampled'] = iso.loc[missing, 'isoyear']
+        frame.loc[missing, 'week_sampled'] = iso.loc[missing, 'week']
+    return frame
+
+
+def _ordered(executor, func, items, window):
+    '''Like executor.map, but with at most window calls in flight, so results are consumed as they arrive.'''
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _export_pages(path, page_size):
+    '''Rows of an isolate export (as text, so they are written back unchanged) in pages of page_size.'''
+    with pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=page_size) as reader:
+        yield from reader
+
+
+def fetch_isolates(pool, pages, base_url, database, project, path, validators, page_size=PAGE_SIZE):
+    '''Writes the isolates of a PubMLST project to a CSV export, fetching its pages concurrently on pages (an
+    executor).  Returns whether the export changed.
+
+    The first page (which gives the number of records) is always fetched.  The other pages are requested
+    conditionally if path is the export written with the saved validators, and pages that are unchanged since
+    then are copied from it, so records added to or changed anywhere in the project are fetched.
+    '''
+    path = pathlib.Path(path)
+    first_url = isolates_url(base_url, database, project, 1, page_size)
+    response = pool.get(first_url)
+    first = json.loads(response.body)
+    n_pages = max(1, math.ceil(first.get('records', 0) / page_size))
+    previous = path.exists() and validators.known.get(first_url, {}).get('export') == file_digest(path)
+
+    def page(number):
+        url = isolates_url(base_url, database, project, number, page_size)
+        page_response = pool.get(url, validators.headers(url) if previous else {})
+        if page_response.status == 304:
+            return url, None, None
+        return url, validators.entry(page_response), json.loads(page_response.body)['isolates']
+
+    # Pages are written in order as they arrive, so only a window of pages is held in memory
+    partial = pathlib.Path(str(path) + '.download')
+    rest = _ordered(pages, page, range(2, n_pages + 1), window=2 * pool.max_per_host)
+    old_pages = _export_pages(path, page_size) if previous else iter(())
+    entries = {}
+    with open(partial, 'w', newline='') as handle:
+        records_frame(first['isolates']).to_csv(handle, index=False)
+        next(old_pages, None)
+        for url, entry, records in rest:
+            old = next(old_pages, None)
+            if entry is not None:
+                records_frame(records).to_csv(handle, index=False, header=False)
+                entries[url] = entry
+            elif old is not None:
+                old.to_csv(handle, index=False, header=False)
+            else:
+                raise FetchError('{} is unchanged, but not in the previous export {}'.format(url, path))
+    changed = _replace_if_changed(partial, path)
+    entries[first_url] = validators.entry(response, export=file_digest(path))
+    validators.save(entries)
+    return changed
+
+
+def fetch_all(data_dir, projects, bigsdb_url=BIGSDB_URL, oxcgrt_url=OXCGRT_URL, mobility_url=MOBILITY_URL,
+              workers=DEFAULT_WORKERS, page_size=PAGE_SIZE, pool=None):
+    '''Fetches the isolates of each organism in projects (a {species: project id} dict) and the OxCGRT and
+    mobility files (unless their URL is None) into data_dir, concurrently.
+
+    Returns a list of FetchResults naming the file written for each source and whether it changed.
+    '''
+    data_dir = pathlib.Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    validators = Validators(data_dir/STATE_FILE)
+    own_pool = pool is None
+    pool = pool or ConnectionPool(workers)
+
+    jobs = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as pages, concurrent.futures.ThreadPoolExecutor(len(projects) + 2) as sources:
+        for species, project in projects.items():
+            path = data_dir/FETCH_FILES[species]
+            jobs[species, path] = sources.submit(fetch_isolates, pool, pages, bigsdb_url, BIGSDB_DATABASES[species],
+                                                 project, path, validators, page_size)
+        for source, url in (('oxcgrt', oxcgrt_url), ('mobility', mobility_url)):
+            if url is not None:
+                path = data_dir/pathlib.PurePosixPath(urllib.parse.urlsplit(url).path).name
+                jobs[source, path] = sources.submit(download, pool, url, path, validators)
+        try:
+            return [FetchResult(source, path, job.result()) for (source, path), job in jobs.items()]
+        finally:
+            if own_pool:
+                pool.close()
+
+
+def prime_cache(cache, results, config):
+    '''Parses each fetched file into the cache, as the pipeline stages will read it with config.'''
+    from .isolates import read_isolates
+    from .mobility import read_mobility_report
+    from .oxcgrt import read_oxcgrt
+
+    for result in results:
+        if result.source in BIGSDB_DATABASES:
+            read_isolates(result.path, result.source, cache)
+        elif result.source == 'oxcgrt':
+            read_oxcgrt(result.path, cache)
+        elif result.source == 'mobility':
+            cache.load(result.path, read_mobility_report, countries=config['iris_countries'], study_end=config['study_end'])
+
+
+def _project(value):
+    species, sep, project = value.partition('=')
+    if not sep or species not in BIGSDB_DATABASES or not project:
+        raise argparse.ArgumentTypeError("expected SPECIES=PROJECT_ID for one of {}, got '{}'".format(', '.join(BIGSDB_DATABASES), value))
+    return species, project
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m iris_pipeline.fetch', description='Download the IRIS input data.')
+    parser.add_argument('--data-dir', type=pathlib.Path, default=pathlib.Path('.'), help='directory to write the files to (default: current directory)')
+    parser.add_argument('--project', metavar='SPECIES=PROJECT_ID', type=_project, action='append', default=[],
+                        help='PubMLST project holding the IRIS isolates of an organism (repeat for each organism to fetch)')
+    parser.add_argument('--bigsdb-url', default=BIGSDB_URL, help='BIGSdb REST API (default: {})'.format(BIGSDB_URL))
+    parser.add_argument('--oxcgrt-url', default=OXCGRT_URL)
+    parser.add_argument('--mobility-url', default=MOBILITY_URL)
+    parser.add_argument('--skip-oxcgrt', action='store_true')
+    parser.add_argument('--skip-mobility', action='store_true')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='concurrent requests per host (default: {})'.format(DEFAULT_WORKERS))
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path('.iris_cache'),
+                        help='cache to parse the files into (default: .iris_cache)')
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    results = fetch_all(args.data_dir, dict(args.project), args.bigsdb_url,
+                        None if args.skip_oxcgrt else args.oxcgrt_url, None if args.skip_mobility else args.mobility_url,
+                        args.workers, args.page_size)
+    for result in results:
+        print('{:15} {:10} {}'.format(result.source, 'changed' if result.changed else 'unchanged', result.path))
+
+    if not args.no_cache:
+        from .cache import FrameCache
+        from .pipeline import DEFAULT_CONFIG
+        prime_cache(FrameCache(args.cache_dir), [r for r in results if r.changed], DEFAULT_CONFIG)
+    print('Finished in {:.1f}s'.format(time.time() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
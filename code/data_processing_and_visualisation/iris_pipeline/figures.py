@@ -0,0 +1,442 @@
+'''Figure 1, Figure 2 (and Supplementary Figures 2-4) and Supplementary Figure 5.'''
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.lines import Line2D
+from matplotlib.ticker import MaxNLocator
+
+from .outputs import figure_2_filename, species_slug
+from .panels import AXES_RECT, LEGEND_SIZE, PANEL_DIR, PANEL_SIZE, PanelCache
+
+
+# Species in the order they are shown in Figure 1
+SPECIES_ORDER = ['S. pneumoniae', 'H. influenzae', 'N. meningitidis', 'S. agalactiae']
+
+# Stringency Index colour scale used for the Figure 2 bar graphs
+STRINGENCY_PALETTE = {
+    0:  "#d6debf",
+    10: "#aecea1",
+    20: "#98C59A",
+    30: "#82bb92",
+    40: "#5ea28d",
+    50: "#54938C",
+    60: "#49838a",
+    70: "#3e5f7e",
+    80: "#383c65",
+    90: "#2b1e3e",
+    100: "#000000",
+#    -9: "#d9cdc3",
+}
+
+
+# Figure 2 and Figure S5 show this many countries per row
+FACET_COLUMNS = 5
+
+# Line colour and style of each study year in Figure 2, the final year in red to improve visibility
+FIGURE_2_LINE_STYLES = {'color': ['#000000', '#000000', '#ED0000'], 'linestyle': [':', '--' ,'-']}
+
+# Columns of the Figure 2 data that each country's panel is drawn from
+FIGURE_2_PANEL_COLUMNS = ['Year sampled', 'Week of year', 'count', 'Cumulative isolate count', 'mock_bar',
+                          'Stringency Index']
+
+# Height of the twin axis the Stringency Index bars were drawn on (the full bar height of 100 plus the default
+# margin); the bars are drawn on the curves' axes at the same fraction of its height
+STRINGENCY_BAR_TOP = 105
+
+FIGURE_S5_PALETTE = ['#ED0000', '#011352']
+
+
+def set_style():
+    '''Applies the plot style used for all manuscript figures.'''
+    plt.rcParams['svg.fonttype'] = 'none' # Ensure SVGs contain editable text
+    sns.set_style('whitegrid')
+    sns.set_palette('pastel')
+
+
+def hextofloats(h):
+    '''Takes a hex rgb string (e.g. #ffffff) and returns an RGB tuple (float, float, float).'''
+    return tuple(int(h[i:i + 2], 16) / 255. for i in (1, 3, 5)) # skip '#'
+
+
+def stringency_cmap(base_palette=STRINGENCY_PALETTE):
+    '''Builds a colour map spanning the Stringency Index palette (0-1 for an index of 0-100).'''
+    palette = pd.DataFrame({k: hextofloats(v) for k, v in base_palette.items()}).T
+    palette.columns = "red green blue".split()
+    palette.index = palette.index / 100
+
+    return LinearSegmentedColormap('CustomColours', {
+        name: [
+            (index, color, color)
+            for index, color
+            in colors.items()
+        ]
+        for name, colors
+        in palette.items()
+    })
+
+
+cmap = stringency_cmap()
+
+
+def plot_figure_1(weekly_counts, outdir, formats=('png', 'svg')):
+    '''Cumulative isolate count per study year faceted on organism, saved as PNG and SVG.
+
+    A red, dashed vertical line marks the WHO declaration of the COVID-19 pandemic (11/03/2020, ISO week 11).
+    '''
+    # Generate per organism isolate counts to add to facet plot titles
+    title_counts = weekly_counts.groupby(['species'], observed=True)['Count'].sum().to_dict()
+
+    # Define colour palette and line style
+    line_styles = {'color': ['#000000', '#000000', '#000000'], 'linestyle': [':', '--' ,'-']}
+
+    # Set up facet plot
+    plt.clf()
+    g = sns.FacetGrid(weekly_counts,
+            col='species',
+            col_order=SPECIES_ORDER,
+            hue='Year sampled',
+            hue_kws=line_styles,
+            sharey=False,
+            margin_titles=True,
+    )
+
+    # Add line graphs
+    g = g.map(plt.plot,
+            'Week of year',
+            'Cumulative isolate count',
+    ).add_legend(title='Year')
+
+    # Make labels human-readable (adapted from https://cduvallet.github.io/posts/2018/11/facetgrid-ylabel-access)
+    for ax in g.axes.flat:
+        # Enlarge x and y-axis labels
+        ax.set_xlabel(ax.get_xlabel(), fontsize='x-large')
+        ax.set_ylabel(ax.get_ylabel(), fontsize='x-large')
+
+        # Make axis labels human-readable, add per organism isolate count, and italicize
+        if ax.get_title():
+            species_title = ax.get_title().split('=')[1]
+            n = title_counts[ax.get_title().split('=')[1].strip()]
+            ax.set_title("{} (n={})".format(species_title, n),
+                         fontsize='xx-large', style='italic')
+
+        # Add red, dashed vertical line to mark WHO declaration of COVID-19 pandemic (ISO week 11)
+        ax.axvline(x=11, color='#ED0000', linestyle='--')
+
+    # Save as PNG (at 300 dpi) and SVG
+    for ext in formats:
+        g.savefig(outdir/"figure_1.{}".format(ext), bbox_inches="tight", dpi=300 if ext == 'png' else None)
+    return g
+
+
+def stringency_bar_data(merged_iris_grt, study_years, final_year=2020, final_week=22):
+    '''Adds dummy bar graph and colour columns used to draw the Stringency Index behind the Figure 2 curves.
+
+    Bars are drawn at full height for weeks covered by OxCGRT (final_year up to final_week).
+    '''
+    iris_oxcgrt_bar = merged_iris_grt.loc[merged_iris_grt['Year sampled'].isin(study_years)].copy()
+    iris_oxcgrt_bar['mock_bar'] = 0
+
+    # Set bar height for weeks covered by OxCGRT to 100
+    oxcgrt_period = (iris_oxcgrt_bar['Year sampled'] == final_year) & (iris_oxcgrt_bar['Week of year'] <= final_week)
+    iris_oxcgrt_bar.loc[oxcgrt_period, 'mock_bar'] = 100
+
+    # Apply colour mapping to Stringency Index data
+    iris_oxcgrt_bar['mock_colour'] = iris_oxcgrt_bar['Stringency Index'].round(-1).fillna(-9).astype('int').map(STRINGENCY_PALETTE)
+
+    return iris_oxcgrt_bar.sort_values(by=['species', 'country', 'Year sampled', 'Week of year'])
+
+
+def plot_figure_2(iris_oxcgrt_bar, species, outdir, formats=('png', 'svg')):
+    '''Facet plot of per country cumulative isolate counts for one organism with the Stringency Index behind.
+
+    Only countries with data for the organism are shown.  The final study year is drawn in red.  The facets are
+    drawn on a template figure set up once for each number of countries (see Figure2Template).
+    '''
+    data = iris_oxcgrt_bar.loc[iris_oxcgrt_bar['species'] == species]
+    years = sorted(int(year) for year in data['Year sampled'].unique())
+    template = figure_2_template(data['country'].nunique(), years)
+    template.draw(data, final_year=int(iris_oxcgrt_bar['Year sampled'].max()))
+
+    for ext in formats:
+        template.figure.savefig(outdir/figure_2_filename(species, ext), bbox_inches="tight")
+    return template
+
+
+def plot_figure_S5(google_res_work, outdir, formats=('png', 'svg')):
+    '''Facet plot faceted on country showing line graphs for residential and workplaces mobility data.
+
+    A vertical line marks the start of ISO week 11 (WHO declaration of the COVID-19 pandemic).
+    '''
+    # Set up facet plot
+    plt.clf()
+    g = sns.FacetGrid(google_res_work,
+            col='country_region',
+            sharey=True,
+            hue='Metric',
+            palette=['#ED0000', '#011352'],
+            margin_titles=True,
+            col_wrap=5,
+    )
+
+    g = g.map(plt.plot,
+            'date',
+            'Percent change',
+    ).add_legend()
+
+    # Make labels human-readable
+    for ax in g.axes.flat:
+        # Make x and y-axis labels slightly larger
+        ax.set_xlabel(ax.get_xlabel().replace('date', 'Time (days)'), fontsize='x-large')
+        ax.set_ylabel(ax.get_ylabel().replace('Percent change', 'Percentage change\nrelative to baseline'), fontsize='x-large')
+
+        # Make labels human-readable
+        if ax.get_title():
+            ax.set_title(ax.get_title().split('=')[1],
+                         fontsize='xx-large')
+
+        # Convert x-axis dates to human-readable format and auto rotate/pad along axis
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %-d'))
+        for label in ax.get_xticklabels():
+            label.set_ha('right')
+            label.set_rotation(30)
+
+        # Remove vertical gridlines
+        ax.grid(False, axis='x')
+
+        # Emphasise 0 on y axis
+        ax.axhline(y=0, color='grey')
+
+        # Add vertical line at start of week 11
+        ax.axvline(x=pd.Timestamp('2020-03-09'), color='black', linestyle='--')
+
+    # Save as PNG and SVG
+    for ext in formats:
+        plt.savefig(outdir/"figure_S5.{}".format(ext), bbox_inches="tight")
+    return g
+
+
+def _padded(low, high, margin=0.05):
+    '''Axis limits around low and high with matplotlib's default margins.'''
+    pad = (high - low) * margin
+    return float(low - pad), float(high + pad)
+
+
+def _grid_position(i, n, columns=FACET_COLUMNS):
+    '''Whether facet i of n in rows of columns is on the bottom row (nothing below it) and in the left column.'''
+    return i + columns >= n, i % columns == 0
+
+
+def figure_2_xlim(data, final_year):
+    '''x limits shared by the Figure 2 facets: the weeks of the curves and of the (week wide) Stringency Index
+    bars of the final year, with matplotlib's default margins.'''
+    weeks = data['Week of year'].astype(float)
+    final_weeks = weeks[data['Year sampled'] == final_year]
+    low, high = weeks.min(), weeks.max()
+    if len(final_weeks):
+        low, high = min(low, final_weeks.min() - 0.5), max(high, final_weeks.max() + 0.5)
+    return _padded(low, high)
+
+
+def stringency_bars(ax, rows, final_year):
+    '''The Stringency Index bars of one country's final study year as a single collection behind the curves on ax.
+
+    Each bar is a week wide and mock_bar high (as a fraction of STRINGENCY_BAR_TOP of the height of ax), coloured
+    by the index.
+    '''
+    final = rows.loc[(rows['Year sampled'] == final_year) & (rows['mock_bar'] > 0)]
+    weeks = final['Week of year'].to_numpy(dtype=float)
+    tops = final['mock_bar'].to_numpy(dtype=float) / STRINGENCY_BAR_TOP
+    bottoms = np.zeros_like(tops)
+    verts = np.stack([
+        np.column_stack([weeks - 0.5, bottoms]),
+        np.column_stack([weeks - 0.5, tops]),
+        np.column_stack([weeks + 0.5, tops]),
+        np.column_stack([weeks + 0.5, bottoms]),
+    ], axis=1)
+    # x in data coordinates, y as a fraction of the axes height; drawn below the grid lines, as the twin axis was
+    return PolyCollection(verts, facecolors=cmap(final['Stringency Index'].to_numpy(dtype=float) / 100),
+                          edgecolors='none', alpha=0.65, transform=ax.get_xaxis_transform(), zorder=0.25)
+
+
+def cumulative_curves(rows, year, color, linestyle):
+    '''One country's cumulative isolate count curve for a year as a LineCollection, capped like a Line2D.'''
+    s = rows.loc[rows['Year sampled'] == year]
+    segment = np.column_stack([s['Week of year'].to_numpy(dtype=float),
+                               s['Cumulative isolate count'].to_numpy(dtype=float)])
+    capstyle = plt.rcParams['lines.solid_capstyle' if linestyle == '-' else 'lines.dash_capstyle']
+    return LineCollection([segment], colors=color, linestyles=linestyle, capstyle=capstyle, label=str(year))
+
+
+def setup_figure_2_axes(ax, bottom, left):
+    '''Labels, ticks and grid of a Figure 2 facet, which depend only on its position in the grid.'''
+    ax.get_yaxis().set_major_locator(MaxNLocator(integer=True))
+    ax.grid(False, axis='x')
+    ax.set_xlabel('Week of year' if bottom else '', fontsize='x-large')
+    ax.set_ylabel('Cumulative isolate count' if left else '', fontsize='x-large')
+    ax.tick_params(axis='x', labelbottom=bottom)
+
+
+def draw_figure_2_data(ax, rows, title, years, final_year, xlim):
+    '''Draws one country's Figure 2 data on a facet set up by setup_figure_2_axes: the Stringency Index bars of
+    the final year and a curve for each year, with limits set from the data.  Returns the artists added.'''
+    artists = [ax.add_collection(stringency_bars(ax, rows, final_year), autolim=False)]
+    for i, year in enumerate(years):
+        curve = cumulative_curves(rows, year, FIGURE_2_LINE_STYLES['color'][i], FIGURE_2_LINE_STYLES['linestyle'][i])
+        artists.append(ax.add_collection(curve, autolim=False))
+
+    counts = rows['Cumulative isolate count']
+    ax.set_xlim(xlim)
+    ax.set_ylim(ax.get_yaxis().get_major_locator().nonsingular(*_padded(counts.min(), counts.max())))
+    ax.set_title(title, fontsize='xx-large')
+    return artists
+
+
+def draw_figure_2_panel(ax, rows, title, years, final_year, xlim, bottom, left):
+    '''One country's Figure 2 panel: its cumulative isolate counts per year, with the Stringency Index of the
+    final year as background bars.'''
+    setup_figure_2_axes(ax, bottom, left)
+    draw_figure_2_data(ax, rows, title, years, final_year, xlim)
+
+
+def draw_legend(figure, title, labels, colors, linestyles, loc='center', **kwargs):
+    '''A figure legend of lines, as FacetGrid.add_legend draws it.'''
+    handles = [Line2D([], [], color=color, linestyle=linestyle) for color, linestyle in zip(colors, linestyles)]
+    figure.legend(handles, labels, title=title, loc=loc, frameon=False, **kwargs)
+
+
+def figure_2_legend(figure, years, **kwargs):
+    '''The Year sampled legend of Figure 2.'''
+    draw_legend(figure, 'Year sampled', [str(year) for year in years], FIGURE_2_LINE_STYLES['color'][:len(years)],
+                FIGURE_2_LINE_STYLES['linestyle'][:len(years)], **kwargs)
+
+
+class Figure2Template:
+    '''A Figure 2 figure for a number of countries, set up once and redrawn for each organism with that number.
+
+    Its facets are laid out in rows of FACET_COLUMNS with the panel geometry of panels.py, and their labels, ticks
+    and the legend are set up when it is created; draw() only replaces the bars, curves, titles and limits.
+    '''
+
+    def __init__(self, n, years, columns=FACET_COLUMNS):
+        self.years = list(years)
+        columns = max(1, min(columns, n))
+        rows = -(-n // columns)
+        panel_width, panel_height = PANEL_SIZE
+        width, height = columns * panel_width + LEGEND_SIZE[0], rows * panel_height
+        # A pyplot figure, so it is shown by plt.show() in the notebook
+        self.figure = plt.figure(figsize=(width, height))
+        left, bottom, axes_width, axes_height = AXES_RECT
+        self.axes = []
+        for i in range(n):
+            row, column = divmod(i, columns)
+            ax = self.figure.add_axes([(column * panel_width + left) / width,
+                                       ((rows - 1 - row) * panel_height + bottom) / height,
+                                       axes_width / width, axes_height / height])
+            setup_figure_2_axes(ax, *_grid_position(i, n, columns))
+            self.axes.append(ax)
+        figure_2_legend(self.figure, self.years, bbox_to_anchor=(1 - LEGEND_SIZE[0] / 2 / width, 0.5))
+        self._artists = []
+
+    def draw(self, data, final_year):
+        '''Draws the countries of one organism's Figure 2 data (in order of appearance) on the facets.'''
+        for artist in self._artists:
+            artist.remove()
+        self._artists = []
+        xlim = figure_2_xlim(data, final_year)
+        for ax, (country, rows) in zip(self.axes, data.groupby('country', sort=False, observed=True)):
+            title = '{} (n={})'.format(country, int(rows['count'].sum()))
+            self._artists.extend(draw_figure_2_data(ax, rows, title, self.years, final_year, xlim))
+
+
+# Figure 2 templates of this process, by number of countries and study years (see figure_2_template)
+_FIGURE_2_TEMPLATES = {}
+
+
+def figure_2_template(n, years):
+    '''The Figure 2 template for n countries and the study years, reused while its figure is open.'''
+    key = (n, tuple(years))
+    template = _FIGURE_2_TEMPLATES.get(key)
+    if template is None or not plt.fignum_exists(template.figure.number):
+        template = _FIGURE_2_TEMPLATES[key] = Figure2Template(n, years)
+    plt.figure(template.figure.number)
+    return template
+
+
+def plot_figure_2_panels(iris_oxcgrt_bar, species, outdir, formats=('png', 'svg')):
+    '''Figure 2 for one organism (see plot_figure_2) composed from cached per-country panels (see panels.py), so
+    only the panels of countries whose data changed are rendered.'''
+    data = iris_oxcgrt_bar.loc[iris_oxcgrt_bar['species'] == species]
+    countries = data['country'].unique()
+    years = sorted(int(year) for year in data['Year sampled'].unique())
+    final_year = int(iris_oxcgrt_bar['Year sampled'].max())
+    xlim = figure_2_xlim(data, final_year)
+    name = 'figure_2_' + species_slug(species)
+
+    cache = PanelCache(outdir/PANEL_DIR)
+    for ext in formats:
+        panels = []
+        for i, country in enumerate(countries):
+            rows = data.loc[data['country'] == country, FIGURE_2_PANEL_COLUMNS]
+            bottom, left = _grid_position(i, len(countries))
+            style = dict(title='{} (n={})'.format(country, int(rows['count'].sum())), years=years,
+                         final_year=final_year, xlim=xlim, bottom=bottom, left=left)
+            panels.append(cache.panel(name, draw_figure_2_panel, (rows,), rows, style, ext))
+        legend = cache.legend(name, figure_2_legend, dict(years=years), ext)
+        cache.compose(name, panels, legend, FACET_COLUMNS, outdir/figure_2_filename(species, ext))
+    return cache
+
+
+def draw_figure_S5_panel(ax, rows, title, metrics, xlim, ylim, bottom, left):
+    '''One country's Figure S5 panel: its residential and workplaces mobility lines.'''
+    for metric, color in zip(metrics, FIGURE_S5_PALETTE):
+        s = rows.loc[rows['Metric'] == metric]
+        ax.plot(s['date'], s['Percent change'], color=color, label=metric)
+
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    ax.set_title(title, fontsize='xx-large')
+    ax.set_xlabel('Time (days)' if bottom else '', fontsize='x-large')
+    ax.set_ylabel('Percentage change\nrelative to baseline' if left else '', fontsize='x-large')
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %-d'))
+    for label in ax.get_xticklabels():
+        label.set_ha('right')
+        label.set_rotation(30)
+    if not bottom:
+        ax.tick_params(axis='x', labelbottom=False)
+    if not left:
+        ax.tick_params(axis='y', labelleft=False)
+    ax.grid(False, axis='x')
+    sns.despine(ax=ax)
+    ax.axhline(y=0, color='grey')
+    ax.axvline(x=pd.Timestamp('2020-03-09'), color='black', linestyle='--')
+
+
+def plot_figure_S5_panels(google_res_work, outdir, formats=('png', 'svg')):
+    '''Figure S5 (see plot_figure_S5) composed from cached per-country panels (see panels.py), so only the panels
+    of countries whose data changed are rendered.'''
+    countries = google_res_work['country_region'].unique()
+    metrics = list(google_res_work['Metric'].unique())
+    dates = mdates.date2num(pd.to_datetime(google_res_work['date']))
+    xlim = _padded(dates.min(), dates.max())
+    ylim = _padded(google_res_work['Percent change'].min(), google_res_work['Percent change'].max())
+    columns = ['date', 'Metric', 'Percent change']
+
+    cache = PanelCache(outdir/PANEL_DIR)
+    for ext in formats:
+        panels = []
+        for i, country in enumerate(countries):
+            rows = google_res_work.loc[google_res_work['country_region'] == country, columns]
+            bottom, left = _grid_position(i, len(countries))
+            style = dict(title=str(country), metrics=metrics, xlim=xlim, ylim=ylim, bottom=bottom, left=left)
+            panels.append(cache.panel('figure_S5', draw_figure_S5_panel, (rows,), rows, style, ext))
+        legend = cache.legend('figure_S5', draw_legend, dict(
+            title='Metric', labels=metrics, colors=FIGURE_S5_PALETTE[:len(metrics)], linestyles=['-'] * len(metrics),
+        ), ext)
+        cache.compose('figure_S5', panels, legend, FACET_COLUMNS, outdir/'figure_S5.{}'.format(ext))
+    return cache
@@ -0,0 +1,170 @@
+'''Incremental weekly updates of the IRIS dataset and Figure 2 data from fresh PubMLST exports.
+
+The weekly count cube (see cube.py) is kept between runs together with a watermark: the latest date_received
+of the isolates counted so far.  An update reads the fresh exports, takes only the isolates received after the
+watermark, counts them into the cube and re-emits only what changed:
+
+- the new isolates are appended to publication_dataset_iris.csv
+- figure_2_data.csv is rewritten from the updated cube, and figure_2_data_changes.csv holds the rows of it whose
+  counts or cumulative counts changed in this update (a late, back-dated isolate changes its own week and the
+  cumulative counts of the rest of that ISO year), or all rows if the OxCGRT file changed
+
+Isolates received on the watermark date itself are matched by name, so an export taken part way through a day
+is followed correctly by the next one.  Updates only ever add isolates: isolates removed or corrected in
+PubMLST, or new isolates without a date_received, need a full rebuild (rebuild=True, or a normal pipeline run).
+A full rebuild is also done automatically when there is no saved state, the study period changed or
+publication_dataset_iris.csv isn't the file the last update wrote (e.g. a pipeline run rewrote it), so isolates
+are never appended twice.
+
+Example:
+    python -m iris_pipeline --update --data-dir ~/iris_data
+'''
+
+import collections
+import pickle
+import warnings
+
+import pandas as pd
+
+from .cache import FrameCache, file_digest
+from .cube import WeeklyCube
+from .isolates import load_isolates, write_isolate_dataset
+from .outputs import make_output_dirs
+from .oxcgrt import merge_with_isolates, process_oxcgrt, read_oxcgrt, weekly_indices
+from .stages import STATE_DIR
+
+
+STATE_FILE = 'weekly_state.pkl'
+
+UpdateResult = collections.namedtuple('UpdateResult', ['rebuilt', 'new_isolates', 'changed_rows', 'watermark'])
+
+
+class WeeklyState:
+    '''Weekly count cube of the isolates received up to the watermark, with the OxCGRT indices merged with it.
+
+    dataset_digest is the digest of publication_dataset_iris.csv as it was last written from this state.
+    '''
+
+    def __init__(self, cube, watermark, watermark_isolates, undated, study_period, oxcgrt_digest, grt_iris_indices,
+                 dataset_digest=None):
+        self.cube = cube
+        self.watermark = watermark
+        self.watermark_isolates = watermark_isolates
+        self.undated = undated
+        self.study_period = study_period
+        self.oxcgrt_digest = oxcgrt_digest
+        self.grt_iris_indices = grt_iris_indices
+        self.dataset_digest = dataset_digest
+
+    @classmethod
+    def load(cls, path):
+        '''The saved state, or None if there isn't one.'''
+        try:
+            with open(path, 'rb') as handle:
+                return pickle.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def save(self, path):
+        # Write to a temporary file first, so an interrupted save leaves the previous state intact
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix('.partial')
+        with open(partial, 'wb') as handle:
+            pickle.dump(self, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        partial.replace(path)
+
+    def matches(self, config, dataset):
+        '''Whether the state is for the study period of config and the dataset file is the one it last wrote.'''
+        if self.study_period != (config['study_start'], config['study_end']) or not dataset.exists():
+            return False
+        # States saved before the digest was kept don't have one
+        return getattr(self, 'dataset_digest', None) == file_digest(dataset)
+
+    def received(self, iris_orgs):
+        '''Mask of the isolates received after the watermark (or on it, but not yet counted).'''
+        received = iris_orgs['date_received']
+        if self.watermark is None:
+            return received.notna()
+        on_watermark = (received == self.watermark) & ~iris_orgs['isolate'].isin(self.watermark_isolates)
+        return (received > self.watermark) | on_watermark
+
+    def advance(self, counted):
+        '''Moves the watermark on to the latest date_received of the isolates just counted.'''
+        latest = counted['date_received'].max()
+        if pd.isna(latest):
+            return
+        on_latest = set(counted.loc[counted['date_received'] == latest, 'isolate'])
+        if latest == self.watermark:
+            self.watermark_isolates |= on_latest
+        else:
+            self.watermark, self.watermark_isolates = latest, on_latest
+
+
+def _oxcgrt_indices(config, cube, cache):
+    grt = read_oxcgrt(config['oxcgrt_file'], cache, cube.countries)
+    return weekly_indices(process_oxcgrt(grt, cube.countries, config['study_end']))
+
+
+def _write_figure_2_data(outputs, cube, grt_iris_indices):
+    merge_with_isolates(cube.to_frame(), grt_iris_indices).to_csv(outputs.figure_2/'figure_2_data.csv', index=False)
+
+
+def _rebuild(config, outputs, iris_orgs, oxcgrt_digest, cache):
+    '''Counts every isolate and writes the full dataset and Figure 2 data, returning the new state.'''
+    cube = WeeklyCube.from_isolates(iris_orgs, config['study_years'], config['study_start'], config['study_end'])
+    grt_iris_indices = _oxcgrt_indices(config, cube, cache)
+    dataset = outputs.datasets/'publication_dataset_iris.csv'
+    write_isolate_dataset(iris_orgs, dataset)
+    _write_figure_2_data(outputs, cube, grt_iris_indices)
+
+    state = WeeklyState(cube, None, set(), int(iris_orgs['date_received'].isna().sum()),
+                        (config['study_start'], config['study_end']), oxcgrt_digest, grt_iris_indices,
+                        file_digest(dataset))
+    state.advance(iris_orgs)
+    return state
+
+
+def update(config, output_root, cache_dir='.iris_cache', rebuild=False):
+    '''Brings the IRIS dataset and Figure 2 data in output_root up to date with the isolate exports in config.
+
+    Returns an UpdateResult with whether everything was rebuilt, the number of new isolates and changed Figure 2
+    rows, and the new watermark.
+    '''
+    cache = FrameCache(cache_dir) if cache_dir is not None else None
+    outputs = make_output_dirs(output_root)
+    state_path = outputs.root/STATE_DIR/STATE_FILE
+    dataset = outputs.datasets/'publication_dataset_iris.csv'
+    iris_orgs = load_isolates(config['isolate_files'], config['study_start'], config['study_end'], cache)
+    oxcgrt_digest = cache.digest(config['oxcgrt_file']) if cache is not None else file_digest(config['oxcgrt_file'])
+
+    state = None if rebuild else WeeklyState.load(state_path)
+    if state is None or not state.matches(config, dataset):
+        state = _rebuild(config, outputs, iris_orgs, oxcgrt_digest, cache)
+        state.save(state_path)
+        return UpdateResult(True, len(iris_orgs), None, state.watermark)
+
+    undated = int(iris_orgs['date_received'].isna().sum())
+    if undated > state.undated:
+        warnings.warn('{} new isolates have no date_received and are only counted by a full rebuild'.format(undated - state.undated))
+
+    new = iris_orgs.loc[state.received(iris_orgs)]
+    delta = WeeklyCube.from_isolates(new, config['study_years'], config['study_start'], config['study_end'])
+    cube, changed = state.cube.add(delta)
+
+    # New OxCGRT data can change the indices of any row; new countries need their indices added
+    if oxcgrt_digest != state.oxcgrt_digest:
+        changed = None
+    if changed is None or set(cube.countries) != set(state.cube.countries):
+        state.grt_iris_indices = _oxcgrt_indices(config, cube, cache)
+        state.oxcgrt_digest = oxcgrt_digest
+
+    changes = merge_with_isolates(cube.to_frame(cells=changed), state.grt_iris_indices)
+    changes.to_csv(outputs.figure_2/'figure_2_data_changes.csv', index=False)
+    _write_figure_2_data(outputs, cube, state.grt_iris_indices)
+    write_isolate_dataset(new, dataset, append=True)
+
+    state.dataset_digest = file_digest(dataset)
+    state.cube = cube
+    state.advance(new)
+    state.save(state_path)
+    return UpdateResult(False, len(new), len(changes), state.watermark)
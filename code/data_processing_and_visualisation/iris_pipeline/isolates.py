@@ -0,0 +1,217 @@
+'''Loading and processing of the IRIS bacterial isolate datasets exported from PubMLST.'''
+
+import concurrent.futures
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from .countries import COUNTRIES
+from .dates import DateDimension
+from .xlsx import read_columns
+
+
+# PubMLST export for each organism
+ISOLATE_FILES = {
+    'S. pneumoniae': 'IRIS_Sp_corrected_20052021.xlsx',
+    'H. influenzae': 'IRIS_Hi_13102020.xlsx',
+    'N. meningitidis': 'IRIS_Nm_13102020.xlsx',
+    'S. agalactiae': 'IRIS_Sa_13102020.xlsx',
+}
+
+# Columns kept from each export
+KEY_COLS = ['id', 'isolate', 'aliases', 'species', 'country', 'continent', 'year', 'date_sampled',
+            'isoyear_sampled', 'week_sampled', 'date_received', 'non_culture']
+
+DATE_COLS = ['date_sampled', 'date_received']
+
+# Columns read from each export (the S. pneumoniae export names the 'disease' column 'diagnosis')
+EXPORT_COLS = [col for col in KEY_COLS if col != 'species'] + ['disease', 'diagnosis']
+
+# Compact in-memory types for the key columns: repeated names are stored as categorical codes, years and weeks
+# as small (nullable) integers and the non-culture flag as a nullable boolean
+ISOLATE_DTYPES = {
+    'species': 'category',
+    'country': 'category',
+    'continent': 'category',
+    'year': 'Int16',
+    'isoyear_sampled': 'Int16',
+    'week_sampled': 'Int8',
+    'non_culture': 'boolean',
+    'study_week': 'Int16',
+}
+
+# Spellings of the non-culture flag in PubMLST exports
+NON_CULTURE_VALUES = {'yes': True, 'true': True, 'no': False, 'false': False}
+
+# Spelling of the non-culture flag in the publication dataset, as in the exports
+NON_CULTURE_LABELS = {True: 'yes', False: 'no'}
+
+def _categorical(values):
+    '''Categorical with sorted categories, built from the unique values only.'''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.reorder_categories(sorted(values.cat.categories))
+    codes, categories = pd.factorize(values, sort=True)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+
+
+def _non_culture_flags(values):
+    '''Parses the non-culture flag (yes/no or true/false, in any case) as a nullable boolean.
+
+    Unrecognised spellings are treated as missing, with a warning.
+    '''
+    if pd.api.types.is_bool_dtype(values):
+        return values.astype('boolean')
+    # Only the distinct spellings are parsed
+    codes, spellings = pd.factorize(values)
+    flags = pd.Series(spellings, dtype=object).astype(str).str.strip().str.lower().map(NON_CULTURE_VALUES)
+    unknown = flags.isna().to_numpy()
+    if unknown.any():
+        warnings.warn('unrecognised non_culture values treated as missing: {}'.format(
+            ', '.join(sorted(pd.Series(spellings, dtype=object)[unknown].astype(str)))))
+    # Missing values (code -1) take the NA appended after the flag of each spelling
+    lookup = pd.array(flags.tolist() + [pd.NA], dtype='boolean')
+    return pd.Series(lookup[codes], index=values.index, name=values.name)
+
+
+def compact_isolates(isolates):
+    '''Converts the key columns of an isolate table to the compact types in ISOLATE_DTYPES.
+
+    Categories are sorted, so category codes sort in the same order as the names.
+    '''
+    isolates = isolates.copy()
+    for column, dtype in ISOLATE_DTYPES.items():
+        if column not in isolates:
+            continue
+        if column == 'non_culture':
+            isolates[column] = _non_culture_flags(isolates[column])
+        elif dtype == 'category':
+            isolates[column] = _categorical(isolates[column])
+        else:
+            isolates[column] = isolates[column].astype(dtype)
+    return isolates
+
+
+def _unify_categories(exports):
+    '''Gives each categorical column the same (sorted) categories in every export, so they concatenate as codes.'''
+    for column, dtype in ISOLATE_DTYPES.items():
+        if dtype != 'category':
+            continue
+        categories = sorted(set().union(*(isolates[column].cat.categories for isolates in exports)))
+        for isolates in exports:
+            isolates[column] = isolates[column].cat.set_categories(categories)
+
+
+def read_export(path):
+    '''Reads the columns used (EXPORT_COLS) from a PubMLST isolate export, converted to compact types.
+
+    Excel workbooks are streamed, keeping only the values of the columns used (see xlsx.py); CSV exports are
+    as written by fetch.py.
+    '''
+    if str(path).lower().endswith('.csv'):
+        isolates = pd.read_csv(path, usecols=lambda col: col in EXPORT_COLS, parse_dates=DATE_COLS)
+    else:
+        isolates = read_columns(path, EXPORT_COLS, date_columns=DATE_COLS)
+
+    # The S. pneumoniae export names the 'disease' column 'diagnosis'
+    isolates.rename(columns={"diagnosis": "disease"}, inplace=True)
+    return compact_isolates(isolates)
+
+
+def label_export(isolates, species):
+    '''A copy of an isolate export with each isolate labelled with its organism.'''
+    isolates = isolates.copy()
+    isolates['species'] = pd.Categorical.from_codes(np.zeros(len(isolates), dtype='int8'), [species])
+    return isolates
+
+
+def read_isolates(path, species, cache=None):
+    '''Reads a PubMLST isolate export (see read_export) and labels each isolate with its organism.'''
+    isolates = cache.load(path, read_export) if cache is not None else read_export(path)
+    return label_export(isolates, species)
+
+
+def read_export_files(paths, cache=None, workers=None):
+    '''Reads each of the isolate exports at paths once (see read_export), returning a {path: isolates} dict.
+
+    Exports that aren't in the cache are read concurrently, in up to workers processes (by default one per
+    export, up to the number of CPUs), so a cold start takes about as long as the largest export.
+    '''
+    paths = list(dict.fromkeys(paths))
+    exports = {}
+    if cache is not None:
+        for path in paths:
+            isolates = cache.lookup(path, read_export)
+            if isolates is not None:
+                exports[path] = isolates
+    missing = [path for path in paths if path not in exports]
+
+    workers = min(len(missing), workers or os.cpu_count() or 1)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            parsed = dict(zip(missing, pool.map(read_export, missing)))
+    else:
+        parsed = {path: read_export(path) for path in missing}
+    for path, isolates in parsed.items():
+        exports[path] = cache.store(path, read_export, isolates) if cache is not None else isolates
+    return exports
+
+
+def read_exports(files, cache=None, workers=None):
+    '''Reads the isolate exports given as a {species: path} dict (see read_export_files), returning a list of
+    labelled exports.'''
+    exports = read_export_files(files.values(), cache, workers)
+    return [label_export(exports[path], species) for species, path in files.items()]
+
+
+def merge_isolates(exports):
+    '''Merges organism-specific exports into a single dataframe containing only key columns.
+
+    Country names are updated to their canonical names (see countries.py), which match OxCGRT.
+    '''
+    exports = [compact_isolates(isolates.reindex()[KEY_COLS]) for isolates in exports]
+    _unify_categories(exports)
+    iris_orgs = pd.concat(exports)
+    iris_orgs['country'] = COUNTRIES.canonical(iris_orgs['country'], 'pubmlst')
+    return iris_orgs
+
+
+def restrict_to_study_period(iris_orgs, study_start, study_end):
+    '''Excludes isolates sampled outside the study period.'''
+    iris_orgs = iris_orgs.loc[iris_orgs['date_sampled'] >= study_start, :]
+    iris_orgs = iris_orgs.loc[iris_orgs['date_sampled'] <= study_end, :]
+    return iris_orgs
+
+
+def add_study_week(iris_orgs, study_start, study_end):
+    '''Adds a continuous week index ('study_week') counting ISO weeks from the week of study_start.
+
+    The index is looked up from each isolate's ISO year and week, so it runs on across 53-week ISO years.
+    '''
+    calendar = DateDimension(study_start, study_end, study_start)
+    iris_orgs = iris_orgs.copy()
+    study_weeks = calendar.study_weeks(iris_orgs['isoyear_sampled'], iris_orgs['week_sampled'])
+    iris_orgs['study_week'] = study_weeks.astype(ISOLATE_DTYPES['study_week'])
+    return iris_orgs
+
+
+def prepare_isolates(exports, study_start, study_end):
+    '''Merges labelled exports (see read_exports), keeping the isolates sampled in the study period, with their
+    study week.'''
+    iris_orgs = restrict_to_study_period(merge_isolates(exports), study_start, study_end)
+    return add_study_week(iris_orgs, study_start, study_end)
+
+
+def load_isolates(files, study_start, study_end, cache=None, workers=None):
+    '''Reads (concurrently, see read_exports), merges and filters the isolate exports given as a {species: path}
+    dict.'''
+    return prepare_isolates(read_exports(files, cache, workers), study_start, study_end)
+
+
+def write_isolate_dataset(iris_orgs, path, append=False):
+    '''Writes isolates to the publication dataset CSV (or appends them, without a header), with the non-culture
+    flag as yes/no as in the PubMLST exports rather than as the boolean it is held as.'''
+    if 'non_culture' in iris_orgs and pd.api.types.is_bool_dtype(iris_orgs['non_culture']):
+        iris_orgs = iris_orgs.assign(non_culture=iris_orgs['non_culture'].astype(object).map(NON_CULTURE_LABELS))
+    iris_orgs.to_csv(path, mode='a' if append else 'w', header=not append, index=False, date_format='%Y-%m-%d')
@@ -0,0 +1,215 @@
+'''Interrupted time series models of weekly isolate counts, fitted for every species and country at once.
+
+The model is the one fitted country by country in meta-analysis/meta-analysis.do:
+
+    glm cases lockdown inter_lockdowntime sin* cos* time, family(poisson) scale(x2)
+
+where time is the study week, lockdown is 1 from the country's lockdown week on, inter_lockdowntime counts the
+weeks since then (the change in slope), and the sin/cos pairs are Fourier terms with a 52 week period for
+seasonality.  Standard errors are scaled for overdispersion by the Pearson chi-squared statistic over the
+residual degrees of freedom, as scale(x2) does.
+
+Every reported (species, country) series in a WeeklyCube is fitted together: the design matrices are stacked
+into one (series, weeks, terms) array and iteratively reweighted least squares runs on all series at once, with
+one batched solve of the normal equations per iteration.  Series drop out of the iterations as they converge.
+
+Example:
+    estimates = interrupted_time_series(WeeklyCube.from_isolates(iris_orgs, study_years, study_start, study_end))
+    estimates.loc[estimates['term'] == 'lockdown', ['species', 'country', 'irr', 'lower', 'upper']]
+'''
+
+import collections
+import math
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+# First ISO week of lockdown in each country (study weeks 109-117 from 1 January 2018 in meta-analysis.do)
+LOCKDOWN_WEEKS = {
+    'Belgium': (2020, 12), 'Brazil': (2020, 12), 'Canada': (2020, 12), 'China': (2020, 5),
+    'Czech Republic': (2020, 11), 'Denmark': (2020, 11), 'England': (2020, 12), 'Finland': (2020, 12),
+    'France': (2020, 11), 'Germany': (2020, 12), 'Hong Kong': (2020, 7), 'Iceland': (2020, 11),
+    'Ireland': (2020, 12), 'Israel': (2020, 11), 'Luxembourg': (2020, 11), 'Netherlands': (2020, 11),
+    'New Zealand': (2020, 13), 'Northern Ireland': (2020, 12), 'Poland': (2020, 11), 'Scotland': (2020, 12),
+    'South Africa': (2020, 12), 'South Korea': (2020, 8), 'Spain': (2020, 11), 'Sweden': (2020, 11),
+    'Switzerland': (2020, 11), 'Wales': (2020, 12),
+}
+
+# Lockdown week of countries not in LOCKDOWN_WEEKS
+DEFAULT_LOCKDOWN_WEEK = (2020, 12)
+
+# Fourier terms: number of sin/cos pairs and their period in weeks
+FOURIER_PAIRS = 2
+SEASON_WEEKS = 52
+
+# Combined effect of the step and slope this many weeks after lockdown (the lincom lines of meta-analysis.do)
+EFFECT_WEEKS = (4, 8)
+
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-8
+
+# Two-sided 95% normal quantile
+Z_95 = 1.959963984540054
+
+PoissonFit = collections.namedtuple('PoissonFit', ['beta', 'cov', 'scale', 'deviance', 'converged', 'iterations'])
+
+
+def term_names(pairs=FOURIER_PAIRS):
+    '''Names of the model terms, in the order of the columns of the design matrices.'''
+    fourier = [name for k in range(1, pairs + 1) for name in ('sin{}'.format(k), 'cos{}'.format(k))]
+    return ['_cons', 'lockdown', 'inter_lockdowntime'] + fourier + ['time']
+
+
+def cube_series(cube):
+    '''Weekly counts of each reported (species, country) pair of a WeeklyCube over the study period.
+
+    Returns the pairs (a frame with species and country columns), the counts as a (pairs, weeks) array and
+    the ISO year and week of each week.  Weeks are numbered by study week, 1 being the first week of the cube.
+    '''
+    species, countries = np.nonzero(cube.reported)
+    year, week = np.nonzero(cube.week_valid)
+    counts = cube.counts[species, countries][:, year, week].astype('float64')
+    pairs = pd.DataFrame({
+        'species': [cube.species[s] for s in species],
+        'country': [cube.countries[c] for c in countries],
+    })
+    return pairs, counts, cube.years[year], week + 1
+
+
+def design_matrices(lockdown_times, n_weeks, pairs=FOURIER_PAIRS, season=SEASON_WEEKS):
+    '''Stacked (series, weeks, terms) design matrices given the study week each series' lockdown starts in.'''
+    time = np.arange(1, n_weeks + 1, dtype='float64')
+    lockdown_times = np.asarray(lockdown_times, dtype='float64')
+    X = np.empty((len(lockdown_times), n_weeks, 3 + 2 * pairs + 1))
+    X[:, :, 0] = 1
+    X[:, :, 1] = time[None, :] >= lockdown_times[:, None]
+    X[:, :, 2] = X[:, :, 1] * (time[None, :] - lockdown_times[:, None])
+    for k in range(1, pairs + 1):
+        angle = 2 * np.pi * k * time / season
+        X[:, :, 2 * k + 1] = np.sin(angle)
+        X[:, :, 2 * k + 2] = np.cos(angle)
+    X[:, :, -1] = time
+    return X
+
+
+def _deviance(y, mu):
+    ratio = np.where(y > 0, y, 1) / mu
+    return 2 * np.sum(np.where(y > 0, y * np.log(ratio), 0) - (y - mu), axis=-1)
+
+
+def fit_poisson(y, X, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    '''Fits a log-link Poisson GLM to each row of y (series, weeks) with its design matrix in X (series, weeks,
+    terms) by batched iteratively reweighted least squares.
+
+    A series has converged when the relative change in its deviance falls below tolerance.  Returns a
+    PoissonFit of per-series coefficients, unscaled covariance matrices, Pearson scale (chi-squared over
+    residual degrees of freedom), deviance, whether it converged and the number of iterations.  Series with no
+    counts at all have no fit (NaN).
+    '''
+    n_series, n_weeks, n_terms = X.shape
+    beta = np.full((n_series, n_terms), np.nan)
+    cov = np.full((n_series, n_terms, n_terms), np.nan)
+    deviance = np.full(n_series, np.nan)
+    converged = np.zeros(n_series, dtype=bool)
+    iterations = np.zeros(n_series, dtype=int)
+
+    # Start from mu halfway between each count and the series mean, as Stata's glm does
+    fitted = y.sum(axis=1) > 0
+    mu = (y + y.mean(axis=1, keepdims=True)) / 2
+    mu[~fitted] = 1
+    eta = np.log(mu)
+    previous = np.full(n_series, np.inf)
+    active = np.flatnonzero(fitted)
+
+    for iteration in range(1, max_iterations + 1):
+        if len(active) == 0:
+            break
+        Xa, ya, mua, etaa = X[active], y[active], mu[active], eta[active]
+        # Weighted least squares on the working response, with weights mu for the log link
+        z = etaa + (ya - mua) / mua
+        XtW = Xa.transpose(0, 2, 1) * mua[:, None, :]
+        b = np.linalg.solve(XtW @ Xa, (XtW @ z[:, :, None]))[:, :, 0]
+        etaa = np.einsum('swt,st->sw', Xa, b)
+        mua = np.exp(etaa)
+
+        beta[active], eta[active], mu[active] = b, etaa, mua
+        deviance[active] = _deviance(ya, mua)
+        iterations[active] = iteration
+        done = np.abs(deviance[active] - previous[active]) / (np.abs(deviance[active]) + 0.1) < tolerance
+        converged[active[done]] = True
+        previous[active] = deviance[active]
+        active = active[~done]
+
+    # Covariance from the information matrix at the final fit
+    Xf, muf = X[fitted], mu[fitted]
+    cov[fitted] = np.linalg.inv((Xf.transpose(0, 2, 1) * muf[:, None, :]) @ Xf)
+    scale = np.where(fitted, np.sum((y - mu) ** 2 / mu, axis=1) / (n_weeks - n_terms), np.nan)
+    return PoissonFit(beta, cov, scale, deviance, converged, iterations)
+
+
+def _lockdown_times(countries, lockdown_weeks, years, weeks):
+    '''Study week of the first lockdown week of each country, or 0 if it isn't after the first study week.'''
+    study_weeks = {(int(y), int(w)): i + 1 for i, (y, w) in enumerate(zip(years, weeks))}
+    times = [study_weeks.get(tuple(lockdown_weeks.get(country, DEFAULT_LOCKDOWN_WEEK)), 0) for country in countries]
+    return np.where(np.array(times) > 1, times, 0)
+
+
+def _effects(fit, weights, scale):
+    '''Estimate and overdispersion-scaled standard error of a linear combination of coefficients per series.'''
+    estimate = fit.beta @ weights
+    variance = np.einsum('t,stu,u->s', weights, fit.cov, weights) * scale
+    return estimate, np.sqrt(variance)
+
+
+def interrupted_time_series(cube, lockdown_weeks=LOCKDOWN_WEEKS, pairs=FOURIER_PAIRS, effect_weeks=EFFECT_WEEKS,
+                            max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    '''Fits the interrupted time series model to every reported (species, country) series of a WeeklyCube.
+
+    lockdown_weeks maps countries to the ISO (year, week) their lockdown started in (DEFAULT_LOCKDOWN_WEEK for
+    countries not listed); series whose lockdown week isn't after the first week of the study period are left
+    out.  Returns one row per series and term: the step ('lockdown'), the change in slope per week
+    ('inter_lockdowntime'), and their combined effect effect_weeks after lockdown ('after_4_weeks', ...).
+    Estimates and standard errors are on the log scale, with incidence rate ratios and their 95% confidence
+    intervals alongside.
+    '''
+    series, counts, years, weeks = cube_series(cube)
+    lockdown_times = _lockdown_times(series['country'], lockdown_weeks, years, weeks)
+    outside = lockdown_times == 0
+    if outside.any():
+        warnings.warn('lockdown weeks of {} are not within the study period, their series are left out'.format(
+            ', '.join(sorted(set(series.loc[outside, 'country'])))))
+        series = series.loc[~outside].reset_index(drop=True)
+        counts, lockdown_times = counts[~outside], lockdown_times[~outside]
+    fit = fit_poisson(counts, design_matrices(lockdown_times, counts.shape[1], pairs), max_iterations, tolerance)
+
+    # Effects as weights on the coefficients: the step, the slope, and the step plus the slope times n weeks
+    names = term_names(pairs)
+    step, slope = np.eye(len(names))[names.index('lockdown')], np.eye(len(names))[names.index('inter_lockdowntime')]
+    effects = {'lockdown': step, 'inter_lockdowntime': slope}
+    effects.update({'after_{}_weeks'.format(n): step + n * slope for n in effect_weeks})
+
+    rows = []
+    for term, weights in effects.items():
+        estimate, se = _effects(fit, weights, fit.scale)
+        z = estimate / se
+        rows.append(series.assign(
+            lockdown_week=lockdown_times,
+            isolates=counts.sum(axis=1).astype(int),
+            term=term,
+            estimate=estimate,
+            se=se,
+            z=z,
+            p=[math.erfc(abs(v) / math.sqrt(2)) if np.isfinite(v) else np.nan for v in z],
+            irr=np.exp(estimate),
+            lower=np.exp(estimate - Z_95 * se),
+            upper=np.exp(estimate + Z_95 * se),
+            scale=fit.scale,
+            converged=fit.converged,
+        ))
+
+    # One block of rows per series, in the order of the cube
+    estimates = pd.concat(rows)
+    estimates['term'] = pd.Categorical(estimates['term'], categories=list(effects))
+    return estimates.sort_index(kind='stable').reset_index(drop=True)
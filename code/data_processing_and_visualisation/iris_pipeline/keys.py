@@ -0,0 +1,140 @@
+'''Integer keys for joining weekly tables on country, ISO year and ISO week.
+
+pd.merge on the (country, ISO year, ISO week) columns hashes the three values of every row of both tables and
+builds a hash table of the key tuples.  Here country names get integer codes shared by both tables, and each
+row's (country, ISO year, ISO week) is packed into a single int64 key.  The packing is worked out once per
+distinct country, year and week (taken straight from the levels and codes of a MultiIndex where the keys are
+index levels) rather than per row.  The join is then an array lookup: a dense table holds the row of each key in
+the right-hand table, and the right-hand columns are gathered by position.
+
+Example:
+    merged = left_join(iris_summary, grt_iris_indices, ['country', 'isoyear_sampled', 'week_sampled'],
+                       ['CountryName', 'year', 'week'])
+'''
+
+import numpy as np
+import pandas as pd
+
+
+# Week numbers run from 1 to 53, slot 0 is unused
+WEEK_SLOTS = 54
+
+# Offset given to values outside the keys, large enough that any key with one is negative
+_INVALID = -2 ** 60
+
+
+def _codes(frame, name):
+    '''Integer codes and distinct values of a column or index level (codes of -1 mark missing values).
+
+    The codes of a MultiIndex level are used as they are, so the level's values aren't expanded to every row.
+    '''
+    if name in frame.index.names:
+        index = frame.index
+        if isinstance(index, pd.MultiIndex):
+            level = index.names.index(name)
+            return np.asarray(index.codes[level]), index.levels[level]
+        return pd.factorize(index)
+    return pd.factorize(frame[name])
+
+
+def _numbers(values):
+    return pd.Series(values, dtype=object).to_numpy(dtype='float64', na_value=np.nan)
+
+
+class WeekKeys:
+    '''Packs (country, ISO year, ISO week) into int64 keys for the given countries and range of years.
+
+    The key of a row is (country code * number of years + year offset) * WEEK_SLOTS + week, where country codes
+    are positions in countries.
+    '''
+
+    def __init__(self, countries, first_year, last_year):
+        self.countries = pd.Index(countries)
+        self.first_year = int(first_year)
+        self.n_years = int(last_year) - self.first_year + 1
+
+    @classmethod
+    def covering(cls, *tables):
+        '''Keys covering the encoded (country, year, week) columns of one or more tables (see encode).'''
+        countries = pd.Index([]).append([pd.Index(country[1]) for country, _, _ in tables]).dropna().unique()
+        years = np.concatenate([_numbers(year[1]) for _, year, _ in tables])
+        years = years[~np.isnan(years)]
+        if len(years) == 0:
+            return cls(countries, 0, 0)
+        return cls(countries, years.min(), years.max())
+
+    @property
+    def size(self):
+        '''Number of distinct keys.'''
+        return len(self.countries) * self.n_years * WEEK_SLOTS
+
+    def _offsets(self, positions, valid, step):
+        # Offset of each distinct value within the key, plus a final entry for code -1 (missing)
+        return np.append(np.where(valid, positions * step, _INVALID), _INVALID).astype(np.int64)
+
+    def encode(self, country, year, week):
+        '''int64 keys of rows given the (codes, distinct values) of their country, ISO year and ISO week.
+
+        The offset of each distinct value within the key is worked out once, and each row's key is the sum of
+        the offsets of its three codes.  Rows with a missing or unknown country, year or week get a key of -1.
+        '''
+        countries = self.countries.get_indexer(country[1])
+        years = _numbers(year[1]) - self.first_year
+        weeks = _numbers(week[1])
+        country_offsets = self._offsets(countries, countries >= 0, self.n_years * WEEK_SLOTS)
+        year_offsets = self._offsets(years, (years >= 0) & (years < self.n_years) & (years % 1 == 0), WEEK_SLOTS)
+        week_offsets = self._offsets(weeks, (weeks >= 1) & (weeks < WEEK_SLOTS) & (weeks % 1 == 0), 1)
+
+        keys = country_offsets[country[0]]
+        keys += year_offsets[year[0]]
+        keys += week_offsets[week[0]]
+        keys[keys < 0] = -1
+        return keys
+
+    def positions(self, keys):
+        '''Dense lookup table of the row holding each key, with -1 for keys not present (and in a final entry,
+        which key -1 looks up).
+
+        Raises ValueError if a key is held by more than one row.
+        '''
+        valid = keys >= 0
+        if np.bincount(keys[valid], minlength=self.size).max(initial=0) > 1:
+            raise ValueError('the right-hand table has more than one row per country, ISO year and week')
+        table = np.full(self.size + 1, -1, dtype=np.int64)
+        table[keys[valid]] = np.flatnonzero(valid)
+        return table
+
+
+def left_join(left, right, left_on, right_on):
+    '''Left join of two tables on (country, ISO year, ISO week), given as column or index level names.
+
+    Gives the same result as pd.merge(left.reset_index(), right.reset_index(), how='left', left_on=left_on,
+    right_on=right_on) where right has at most one row per key and the tables share no other column names: the
+    rows of left in order, followed by the columns of right (missing for rows without a match).
+    '''
+    left_codes = [_codes(left, name) for name in left_on]
+    right_codes = [_codes(right, name) for name in right_on]
+    keys = WeekKeys.covering(left_codes, right_codes)
+    rows = keys.positions(keys.encode(*right_codes))[keys.encode(*left_codes)]
+
+    return pd.concat([left.reset_index()] + _gather(right.reset_index(), rows), axis=1)
+
+
+def _gather(frame, rows):
+    '''The rows of frame at the given positions (missing where -1), as a list of frames of adjacent columns.
+
+    Runs of float64 columns (the OxCGRT indices) are gathered from a single 2D array, so each run is one block
+    of the result instead of a column at a time.
+    '''
+    pieces, run = [], []
+    for col in list(frame.columns) + [None]:
+        if col is not None and frame[col].dtype == 'float64':
+            run.append(col)
+            continue
+        if run:
+            values = np.vstack([frame[run].to_numpy(), np.full((1, len(run)), np.nan)])
+            pieces.append(pd.DataFrame(values[rows], columns=run, copy=False))
+            run = []
+        if col is not None:
+            pieces.append(pd.DataFrame({col: pd.api.extensions.take(frame[col].array, rows, allow_fill=True)}))
+    return pieces
@@ -0,0 +1,240 @@
+'''Random-effects meta-analysis of the per-country interrupted time series estimates, and forest plot tables.
+
+meta-analysis.do pools the per-country lockdown effects for S. pneumoniae with meta set, and
+meta-analysis_forest_plot.R pools them again with metagen(..., method.tau = "REML") to draw the forest plots.
+Here the estimates of its.py are pooled for every term and species at once: each meta-analysis is a row of a
+(meta-analyses, studies) array, with missing studies as NaN, and the fixed and random-effects estimates, the
+between-study variance (DerSimonian-Laird, or REML by Fisher scoring from the DerSimonian-Laird value) and
+heterogeneity statistics are worked out for all rows together.  Leave-one-out and other sensitivity analyses
+are more rows of the same arrays.
+
+Example:
+    pooled = meta_analysis(interrupted_time_series(cube), subgroup='continent')
+    forest = forest_table(interrupted_time_series(cube))
+'''
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from .countries import COUNTRIES
+from .its import Z_95
+
+
+METHODS = ('DL', 'REML')
+
+# Continent of each country, for subgroup analyses
+CONTINENTS = COUNTRIES.continents()
+
+# Terms of its.py that are pooled
+POOLED_TERMS = ['lockdown', 'inter_lockdowntime', 'after_4_weeks', 'after_8_weeks']
+
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-10
+
+
+def _two_sided_p(z):
+    return np.array([math.erfc(abs(v) / math.sqrt(2)) if np.isfinite(v) else np.nan for v in np.ravel(z)])
+
+
+def chi2_sf(x, df):
+    '''Upper tail probability of the chi-squared distribution for integer degrees of freedom (NaN where df < 1).
+
+    Uses the closed forms for integer df: a Poisson sum for even df, and the normal tail plus a finite series
+    for odd df.
+    '''
+    x, df = np.broadcast_arrays(np.asarray(x, dtype='float64'), np.asarray(df))
+    x = np.maximum(x, 0)
+    odd = df % 2 == 1
+    # Even df: exp(-x/2) * sum of (x/2)^i / i! for i < df/2
+    term = np.exp(-x / 2)
+    even_sum = np.where(df >= 2, term, 0)
+    # Odd df: 2 * normal tail at sqrt(x) plus sqrt(2x/pi) exp(-x/2) * sum of x^i / (3*5*...*(2i+1)) for i < (df-1)/2
+    odd_term = np.sqrt(2 * x / np.pi) * np.exp(-x / 2)
+    odd_sum = np.where(df >= 3, odd_term, 0)
+    for i in range(1, int(np.max(df, initial=0)) // 2 + 1):
+        term = term * (x / 2) / i
+        even_sum = even_sum + np.where(df >= 2 * (i + 1), term, 0)
+        odd_term = odd_term * x / (2 * i + 1)
+        odd_sum = odd_sum + np.where(df >= 2 * i + 3, odd_term, 0)
+    tail = np.array([math.erfc(math.sqrt(v / 2)) for v in x.ravel()]).reshape(x.shape)
+    p = np.where(odd, tail + odd_sum, even_sum)
+    return np.where(df >= 1, np.minimum(p, 1), np.nan)
+
+
+def _weighted(w, y):
+    sw = w.sum(axis=1)
+    return sw, (w * y).sum(axis=1) / sw
+
+
+def _reml_tau2(y, v, present, tau2, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    '''REML between-study variance by Fisher scoring, starting from tau2, for every row at once.'''
+    tau2 = tau2.copy()
+    active = np.flatnonzero(present.sum(axis=1) > 1)
+    for _ in range(max_iterations):
+        if len(active) == 0:
+            break
+        w = present[active] / (v[active] + tau2[active, None])
+        sw, mu = _weighted(w, y[active])
+        sw2, sw3 = (w ** 2).sum(axis=1), (w ** 3).sum(axis=1)
+        # Score and information of the restricted likelihood: y'PPy - tr(P) and tr(PP)
+        score = (w ** 2 * (y[active] - mu[:, None]) ** 2).sum(axis=1) - (sw - sw2 / sw)
+        information = sw2 - 2 * sw3 / sw + (sw2 / sw) ** 2
+        updated = np.maximum(tau2[active] + score / information, 0)
+        done = np.abs(updated - tau2[active]) < tolerance
+        tau2[active] = updated
+        active = active[~done]
+    return tau2
+
+
+def pool(estimates, se, method='REML'):
+    '''Fixed and random-effects pooled estimates of each row of (meta-analyses, studies) arrays of estimates and
+    their standard errors, missing studies being NaN.
+
+    method is 'DL' (DerSimonian-Laird) or 'REML' for the between-study variance tau2.  Returns a frame with
+    one row per meta-analysis: the number of studies k, the random-effects estimate with its standard error,
+    95% confidence interval, z and p, tau2, Cochran's Q with its degrees of freedom and p value, I2 (as a
+    percentage) and the fixed-effect (inverse variance) estimate and standard error.
+    '''
+    if method not in METHODS:
+        raise ValueError('unknown method {!r}, expected one of {}'.format(method, ', '.join(METHODS)))
+    y, v = np.atleast_2d(np.asarray(estimates, dtype='float64')), np.atleast_2d(np.asarray(se, dtype='float64')) ** 2
+    present = np.isfinite(y) & np.isfinite(v) & (v > 0)
+    y, v = np.where(present, y, 0), np.where(present, v, 1)
+    k = present.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = present / v
+        sw, fixed = _weighted(w, y)
+        df = k - 1
+        q = np.where(df > 0, (w * (y - fixed[:, None]) ** 2).sum(axis=1), 0)
+        c = sw - (w ** 2).sum(axis=1) / sw
+        tau2 = np.where((df > 0) & (c > 0), np.maximum((q - df) / c, 0), 0)
+        if method == 'REML':
+            tau2 = _reml_tau2(y, v, present, tau2)
+        tau2 = np.where(k > 0, tau2, np.nan)
+
+        sw_random, estimate = _weighted(present / (v + tau2[:, None]), y)
+        random_se = 1 / np.sqrt(sw_random)
+        z = estimate / random_se
+        return pd.DataFrame({
+            'k': k,
+            'estimate': estimate,
+            'se': random_se,
+            'lower': estimate - Z_95 * random_se,
+            'upper': estimate + Z_95 * random_se,
+            'z': z,
+            'p': _two_sided_p(z),
+            'tau2': tau2,
+            'q': np.where(k > 0, q, np.nan),
+            'q_df': df.clip(0),
+            'q_p': chi2_sf(q, df),
+            'i2': np.where((df > 0) & (q > 0), np.maximum((q - df) / q, 0), 0) * 100,
+            'fixed': fixed,
+            'fixed_se': 1 / np.sqrt(sw),
+        })
+
+
+def leave_one_out(estimates, se, method='REML'):
+    '''Pools each row of (meta-analyses, studies) arrays once without each of its studies.
+
+    Returns the pool() frame of every (meta-analysis, left out study) pair, indexed by both, for studies that
+    are present.
+    '''
+    y, s = np.atleast_2d(np.asarray(estimates, dtype='float64')), np.atleast_2d(np.asarray(se, dtype='float64'))
+    n, k = y.shape
+    without = ~np.eye(k, dtype=bool)
+    dropped_y = np.where(without[None, :, :], y[:, None, :], np.nan).reshape(n * k, k)
+    dropped_se = np.where(without[None, :, :], s[:, None, :], np.nan).reshape(n * k, k)
+    pooled = pool(dropped_y, dropped_se, method)
+    pooled.index = pd.MultiIndex.from_product([range(n), range(k)], names=['analysis', 'left_out'])
+    return pooled.loc[np.isfinite(y).ravel()]
+
+
+def stack(frame, by, values=('estimate', 'se')):
+    '''Arranges the rows of frame into one row per group of the by columns, for pool().
+
+    Returns the groups (a frame of their by values, in order of appearance), the (group, position) of each row
+    of frame, and a (groups, largest group) array of each column in values with missing positions as NaN.
+    '''
+    groups = frame.groupby(list(by), sort=False, observed=True)
+    row, position = groups.ngroup().to_numpy(), groups.cumcount().to_numpy()
+    shape = (groups.ngroups, position.max(initial=-1) + 1)
+    arrays = []
+    for col in values:
+        array = np.full(shape, np.nan)
+        array[row, position] = frame[col].to_numpy(dtype='float64')
+        arrays.append(array)
+    keys = frame[list(by)].iloc[np.unique(row, return_index=True)[1]].reset_index(drop=True)
+    return keys, (row, position), arrays
+
+
+def _pooled_terms(estimates, continents=CONTINENTS):
+    '''Converged estimates of the pooled terms, with the continent of each country.'''
+    used = estimates['term'].isin(POOLED_TERMS) & estimates['converged']
+    used &= np.isfinite(estimates['estimate']) & np.isfinite(estimates['se'])
+    pooled = estimates.loc[used].reset_index(drop=True)
+    return pooled.assign(continent=pooled['country'].map(continents).fillna('Other'))
+
+
+def meta_analysis(estimates, by=('term', 'species'), subgroup=None, method='REML', continents=CONTINENTS):
+    '''Random-effects meta-analyses of the interrupted time series estimates of its.py.
+
+    One meta-analysis is run per group of the by columns (by default each term of each species, pooled over
+    countries), or per subgroup within each of those if subgroup names a further column (e.g. 'continent').
+    Returns the by (and subgroup) values with the pool() results.  With a subgroup, the test for differences
+    between subgroups (Q between the random-effects subgroup estimates) is added as q_between, q_between_df
+    and q_between_p, the same for every subgroup of a meta-analysis.
+    '''
+    estimates = _pooled_terms(estimates, continents)
+    keys = list(by) + ([subgroup] if subgroup else [])
+    groups, _, (y, se) = stack(estimates, keys)
+    pooled = pd.concat([groups, pool(y, se, method)], axis=1)
+    if subgroup:
+        # Q of a fixed-effect pool of the subgroup estimates
+        parents, _, (y, se) = stack(pooled, by)
+        between = pool(y, se, 'DL')[['q', 'q_df', 'q_p']]
+        between.columns = ['q_between', 'q_between_df', 'q_between_p']
+        pooled = pooled.merge(pd.concat([parents, between], axis=1), on=list(by), how='left')
+    return pooled
+
+
+def forest_table(estimates, by=('term', 'species'), subgroup='continent', method='REML', continents=CONTINENTS):
+    '''Rows of the forest plots of the interrupted time series estimates, one plot per group of the by columns.
+
+    Each plot lists its studies (row 'study', labelled by country) grouped by subgroup, then the pooled
+    estimate of each subgroup (row 'subgroup') and of all studies (row 'overall').  Estimates and intervals are
+    given as incidence rate ratios, with the weight (%) of each study in the overall random-effects estimate
+    and the number of studies and heterogeneity statistics of each pooled row.
+    '''
+    estimates = _pooled_terms(estimates, continents)
+    if subgroup is None:
+        estimates = estimates.assign(subgroup='')
+        subgroup = 'subgroup'
+    by = list(by)
+    overall = meta_analysis(estimates, by, None, method, continents)
+    subgroups = meta_analysis(estimates, by, subgroup, method, continents)
+
+    # Weight of each study in the random-effects estimate of its plot (overall has one row per plot, in the same
+    # order as stack's groups)
+    plots, (plot, position), (_, se) = stack(estimates, by)
+    weights = 1 / (se ** 2 + overall['tau2'].to_numpy()[:, None])
+    weights = weights / np.nansum(weights, axis=1, keepdims=True) * 100
+    studies = estimates.assign(row='study', label=estimates['country'], k=1, weight=weights[plot, position])
+    subgroup_rows = subgroups.assign(row='subgroup', label=subgroups[subgroup])
+    overall_rows = overall.assign(row='overall', label='Overall', **{subgroup: np.nan})
+
+    columns = by + [subgroup, 'row', 'label', 'isolates', 'k', 'estimate', 'se', 'irr', 'lower', 'upper', 'weight',
+                    'tau2', 'i2', 'q', 'q_df', 'q_p']
+    plot_numbers = plots.assign(_plot=np.arange(len(plots)))
+    rows = []
+    for order, frame in enumerate((studies, subgroup_rows, overall_rows)):
+        frame = frame.assign(irr=np.exp(frame['estimate']), lower=np.exp(frame['estimate'] - Z_95 * frame['se']),
+                             upper=np.exp(frame['estimate'] + Z_95 * frame['se']), _order=order)
+        rows.append(frame.reindex(columns=columns + ['_order']).merge(plot_numbers, on=by, how='left'))
+    table = pd.concat(rows, ignore_index=True)
+
+    # Each plot lists the studies and then the pooled row of each subgroup, with the overall row last
+    table = table.sort_values(['_plot', subgroup, '_order', 'label'], kind='stable', na_position='last')
+    return table.drop(columns=['_plot', '_order']).reset_index(drop=True)
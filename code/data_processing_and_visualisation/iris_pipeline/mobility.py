@@ -0,0 +1,162 @@
+'''Streaming loader for the Google COVID-19 Community Mobility Reports dataset.
+
+The global mobility report contains every sub-region and metropolitan area in the world, but the IRIS
+analyses only use national level data for IRIS countries up to the end of the study period.  Rather than
+reading the whole file into memory and filtering afterwards, the loader reads the file in chunks, keeps only
+the columns of the published dataset, and applies the country, national level and date filters to each chunk
+as it is read.  Peak memory therefore depends on the size of the filtered output rather than the raw file.
+'''
+
+import contextlib
+import pathlib
+import zipfile
+
+import pandas as pd
+
+from .countries import COUNTRIES
+from .dates import DateDimension
+from .schemas import Schema, register
+
+
+# Place categories reported as percentage change from baseline
+PLACE_CATEGORIES = [
+    'retail_and_recreation_percent_change_from_baseline',
+    'grocery_and_pharmacy_percent_change_from_baseline',
+    'parks_percent_change_from_baseline',
+    'transit_stations_percent_change_from_baseline',
+    'workplaces_percent_change_from_baseline',
+    'residential_percent_change_from_baseline',
+]
+
+# Columns kept from the raw file, which are those of the published dataset (columns missing from older snapshots,
+# e.g. 'metro_area', are skipped)
+MOBILITY_COLUMNS = [
+    'country_region_code', 'country_region', 'sub_region_1', 'sub_region_2', 'metro_area', 'iso_3166_2_code',
+    'census_fips_code', 'date',
+] + PLACE_CATEGORIES
+
+# Sub-national columns which must be empty for a row to hold national level data
+SUBNATIONAL_COLUMNS = ['sub_region_1', 'metro_area']
+
+# Human-readable names for the place categories
+PLACE_CATEGORY_NAMES = {
+    'retail_and_recreation_percent_change_from_baseline': 'Retail and recreation',
+    'grocery_and_pharmacy_percent_change_from_baseline': 'Grocery and pharmacy',
+    'parks_percent_change_from_baseline': 'Parks',
+    'transit_stations_percent_change_from_baseline': 'Transit stations',
+    'workplaces_percent_change_from_baseline': 'Workplaces',
+    'residential_percent_change_from_baseline': 'Residential',
+}
+
+# Text columns are read as strings so that pandas doesn't have to infer mixed types in each chunk
+MOBILITY_SCHEMA = register(Schema(
+    'google_mobility',
+    columns=dict({col: 'object' for col in MOBILITY_COLUMNS if col not in PLACE_CATEGORIES},
+                 **{col: 'float64' for col in PLACE_CATEGORIES}),
+    dates={'date': '%Y-%m-%d'},
+))
+
+MOBILITY_FILE = 'Global_Mobility_Report_13102020.csv'
+
+DEFAULT_CHUNKSIZE = 250000
+
+
+@contextlib.contextmanager
+def _open_report(path, member=None):
+    '''Opens a mobility report, reading the CSV straight out of a .zip archive if required.'''
+    path = pathlib.Path(path)
+    if path.suffix.lower() != '.zip':
+        with open(path, 'rb') as handle:
+            yield handle
+        return
+
+    with zipfile.ZipFile(path) as archive:
+        if member is None:
+            csvs = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+            if len(csvs) != 1:
+                raise ValueError("{} contains {} CSV files, specify which one to read with 'member'".format(path, len(csvs)))
+            member = csvs[0]
+        with archive.open(member) as handle:
+            yield handle
+
+
+def _filter_chunk(chunk, countries, aliases, study_start, study_end):
+    '''Applies the country, national level and date filters to a single chunk of the mobility report.'''
+    # Filter on country first as this discards almost all rows before any further work is done
+    chunk = chunk.loc[chunk['country_region'].isin(aliases)]
+
+    # Keep national level data only
+    for col in SUBNATIONAL_COLUMNS:
+        if col in chunk.columns:
+            chunk = chunk.loc[chunk[col].isna()]
+
+    if chunk.empty:
+        return chunk
+
+    # Only parse dates for rows that survived the previous filters
+    chunk = chunk.copy()
+    chunk['country_region'] = COUNTRIES.canonical_names(chunk['country_region'], 'google')
+    chunk = chunk.loc[chunk['country_region'].isin(countries)]
+    chunk = MOBILITY_SCHEMA.parse_dates(chunk)
+
+    if study_start is not None:
+        chunk = chunk.loc[chunk['date'] >= study_start]
+    if study_end is not None:
+        chunk = chunk.loc[chunk['date'] <= study_end]
+    return chunk
+
+
+def read_mobility_report(path, countries, study_end=None, study_start=None, chunksize=DEFAULT_CHUNKSIZE,
+                         columns=MOBILITY_COLUMNS, member=None):
+    '''Reads national level mobility data for the given countries from a Google mobility report.
+
+    path can be the CSV itself or a .zip archive containing it (use member to pick a CSV if the archive holds
+    more than one).  Country names are returned using IRIS/OxCGRT naming (e.g. Czechia as Czech Republic).  Rows
+    keep their row numbers in the file as their index, as when the whole file is read and filtered.
+    '''
+    countries = set(countries)
+
+    # Names to match in the raw file, including Google's own names for any renamed countries
+    aliases = countries | set(COUNTRIES.source_names(countries, 'google'))
+
+    dtypes = MOBILITY_SCHEMA.read_dtypes(columns)
+    wanted = set(columns)
+
+    with _open_report(path, member) as handle:
+        reader = pd.read_csv(
+            handle,
+            usecols=lambda col: col in wanted,
+            dtype=dtypes,
+            chunksize=chunksize,
+        )
+        filtered = [_filter_chunk(chunk, countries, aliases, study_start, study_end) for chunk in reader]
+
+    filtered = [chunk for chunk in filtered if not chunk.empty]
+    if not filtered:
+        return pd.DataFrame(columns=list(columns))
+
+    # Chunks are indexed by their row numbers in the file
+    return pd.concat(filtered)
+
+
+def tidy_mobility(google_iris):
+    '''Sorts mobility data by country and date and gives the place categories readable names.'''
+    google_iris = google_iris.sort_values(by=['country_region', 'date'])
+    return google_iris.rename(columns=PLACE_CATEGORY_NAMES)
+
+
+def with_iso_week(google_iris, calendar=None):
+    '''Returns a copy of the mobility data with an ISO 8601 week column, as used for modelling.
+
+    Weeks are looked up in calendar (a DateDimension covering the dates), or in one built for the mobility dates.
+    '''
+    google_iris = google_iris.copy()
+    google_iris['week'] = (calendar or DateDimension.covering(google_iris['date'])).lookup(google_iris['date'])['week']
+    return google_iris
+
+
+def residential_and_workplaces(google_iris):
+    '''Converts tidied mobility data to long form, keeping only the residential and workplaces categories.'''
+    google_iris_long = pd.melt(google_iris, id_vars=['country_region', 'date'], value_vars=list(PLACE_CATEGORY_NAMES.values()),
+                               var_name='Metric', value_name='Percent change')
+    return google_iris_long.loc[(google_iris_long['Metric'] == 'Residential') | (google_iris_long['Metric'] == 'Workplaces')]
@@ -0,0 +1,226 @@
+'''Local stand-in for the PubMLST (BIGSdb) REST API and the OxCGRT and Google mobility downloads.
+
+Serves the isolate records of each database as paged JSON in the shape of the BIGSdb API
+(/db/<database>/projects/<project>/isolates?page=&page_size=&include_records=1, any project id) and the OxCGRT
+and mobility CSV files under /files/, with ETag and Last-Modified headers and 304 responses to conditional
+requests.  Each page of isolates has its own ETag, so only pages whose records changed are sent again.  The
+data are fixtures: either generated from synthetic.py, or saved to and loaded from a directory (one
+<database>.json list of records per database, and the files as they are served).
+
+Unreliable networks can be simulated with fail_every (every n-th request gets a 503 with Retry-After: 0) and
+a fixed delay per request.
+
+Example:
+    python -m iris_pipeline.mockserver --port 8000 --isolates 100000
+    python -m iris_pipeline.fetch --data-dir fetched --bigsdb-url http://127.0.0.1:8000 --project "S. pneumoniae=1"
+        --oxcgrt-url http://127.0.0.1:8000/files/OxCGRT_latest.csv
+        --mobility-url http://127.0.0.1:8000/files/Global_Mobility_Report.csv
+'''
+
+import argparse
+import email.utils
+import hashlib
+import http.server
+import json
+import math
+import pathlib
+import re
+import threading
+import time
+import urllib.parse
+
+import pandas as pd
+
+from . import synthetic
+from .fetch import BIGSDB_DATABASES, MOBILITY_URL, OXCGRT_URL
+
+
+ISOLATES_PATH = re.compile(r'^/db/(?P<database>[^/]+)/projects/[^/]+/isolates$')
+
+# Last-Modified of the fixtures
+FIXTURE_DATE = email.utils.format_datetime(pd.Timestamp('2020-10-13', tz='UTC').to_pydatetime(), usegmt=True)
+
+
+def _records(export):
+    '''Rows of an isolate export as BIGSdb records, with dates as ISO strings and missing fields left out.'''
+    export = export.copy()
+    for column in export.select_dtypes('datetime').columns:
+        export[column] = export[column].dt.strftime('%Y-%m-%d')
+    rows = json.loads(export.to_json(orient='records'))
+    return [{'provenance': {k: v for k, v in row.items() if v is not None}} for row in rows]
+
+
+def _etag(body):
+    return '"{}"'.format(hashlib.sha256(body).hexdigest()[:16])
+
+
+def _filename(url):
+    return pathlib.PurePosixPath(urllib.parse.urlsplit(url).path).name
+
+
+class MockSources:
+    '''Records served for each BIGSdb database and the files served under /files/.'''
+
+    def __init__(self, records, files):
+        self.records = records
+        self.files = files
+        self.etags = {name: _etag(body) for name, body in files.items()}
+
+    @classmethod
+    def from_synthetic(cls, scale):
+        exports = synthetic.isolate_exports(scale)
+        records = {BIGSDB_DATABASES[species]: _records(export) for species, export in exports.items()}
+        files = {
+            _filename(OXCGRT_URL): synthetic.oxcgrt_frame(scale).to_csv(index=False).encode(),
+            _filename(MOBILITY_URL): synthetic.mobility_frame(scale).to_csv(index=False).encode(),
+        }
+        return cls(records, files)
+
+    @classmethod
+    def load(cls, directory):
+        directory = pathlib.Path(directory)
+        records, files = {}, {}
+        for path in directory.iterdir():
+            if path.suffix == '.json':
+                records[path.stem] = json.loads(path.read_text())
+            else:
+                files[path.name] = path.read_bytes()
+        return cls(records, files)
+
+    def save(self, directory):
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for database, rows in self.records.items():
+            (directory/'{}.json'.format(database)).write_text(json.dumps(rows))
+        for name, body in self.files.items():
+            (directory/name).write_bytes(body)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            number = server.requests
+        if server.delay:
+            time.sleep(server.delay)
+        if server.fail_every and number % server.fail_every == 0:
+            return self._send(503, b'unavailable', [('Retry-After', '0')])
+
+        url = urllib.parse.urlsplit(self.path)
+        sources = server.sources
+        match = ISOLATES_PATH.match(url.path)
+        if match and match.group('database') in sources.records:
+            key = match.group('database')
+        elif url.path.startswith('/files/') and url.path[len('/files/'):] in sources.files:
+            key = url.path[len('/files/'):]
+        else:
+            return self._send(404, b'not found')
+
+        if match:
+            query = urllib.parse.parse_qs(url.query)
+            page = int(query.get('page', ['1'])[0])
+            page_size = int(query.get('page_size', ['100'])[0])
+            records = sources.records[key]
+            body = json.dumps({
+                'records': len(records),
+                'isolates': records[(page - 1) * page_size:page * page_size],
+                'paging': {'last': math.ceil(len(records) / page_size)},
+            }).encode()
+            content_type, etag = 'application/json', _etag(body)
+        else:
+            body = sources.files[key]
+            content_type, etag = 'text/csv', sources.etags[key]
+
+        # If-None-Match takes precedence over If-Modified-Since, as the fixtures all have the same date
+        validators = [('ETag', etag), ('Last-Modified', FIXTURE_DATE)]
+        if 'If-None-Match' in self.headers:
+            unchanged = self.headers['If-None-Match'] == etag
+        else:
+            unchanged = self.headers.get('If-Modified-Since') == FIXTURE_DATE
+        if unchanged:
+            return self._send(304, headers=validators)
+        return self._send(200, body, validators + [('Content-Type', content_type)])
+
+
+class MockServer:
+    '''Serves MockSources on a local port from a background thread, as a context manager.
+
+    Example:
+        with MockServer(MockSources.from_synthetic(synthetic.Scale(10000, 26, 3)), fail_every=7) as server:
+            fetch.fetch_all('fetched', {'S. pneumoniae': 1}, server.url, server.url + '/files/OxCGRT_latest.csv', None)
+    '''
+
+    def __init__(self, sources, port=0, fail_every=0, delay=0.0):
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.sources = sources
+        self.httpd.fail_every = fail_every
+        self.httpd.delay = delay
+        self.httpd.requests = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m iris_pipeline.mockserver', description='Serve stand-in IRIS input data.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fixtures', type=pathlib.Path, help='serve fixtures saved in this directory instead of synthetic data')
+    parser.add_argument('--save', type=pathlib.Path, help='save the synthetic fixtures to this directory and exit')
+    parser.add_argument('--isolates', type=int, default=10000, help='total number of synthetic isolates (default: 10000)')
+    parser.add_argument('--countries', type=int, default=len(synthetic.IRIS_COUNTRIES))
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--fail-every', type=int, default=0, metavar='N', help='answer every N-th request with a 503')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    args = parser.parse_args(argv)
+
+    if args.fixtures is not None:
+        sources = MockSources.load(args.fixtures)
+    else:
+        sources = MockSources.from_synthetic(synthetic.Scale(args.isolates, args.countries, args.years))
+    if args.save is not None:
+        sources.save(args.save)
+        return 0
+
+    with MockServer(sources, args.port, args.fail_every, args.delay) as server:
+        print('Serving on {} (Ctrl-C to stop)'.format(server.url))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,38 @@
+'''Layout of the manuscript output directory.'''
+
+import collections
+import pathlib
+
+
+OutputDirs = collections.namedtuple('OutputDirs', ['root', 'figure_1', 'figure_2', 'figure_S5', 'summaries', 'datasets'])
+
+
+def make_output_dirs(root):
+    '''Creates (if needed) and returns the output directory with a sub-directory for each figure and one for
+    data and summaries.
+
+    The publication_datasets sub-directory within data_and_summaries holds the datasets used in downstream
+    statistical analyses.
+    '''
+    root = pathlib.Path(root)
+    dirs = OutputDirs(
+        root=root,
+        figure_1=root/"figure_1",
+        figure_2=root/"figure_2",
+        figure_S5=root/"figure_S5",
+        summaries=root/"data_and_summaries",
+        datasets=root/"data_and_summaries"/"publication_datasets",
+    )
+    for path in dirs:
+        path.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+def species_slug(species):
+    '''Species name as used in file names, e.g. Spneumoniae.'''
+    return species.replace(". ", "")
+
+
+def figure_2_filename(species, ext):
+    '''Output file name for a species' Figure 2 facet plot, e.g. figure_2_Spneumoniae.png.'''
+    return "figure_2_{}.{}".format(species_slug(species), ext)
@@ -0,0 +1,141 @@
+'''Processing of the Oxford COVID-19 Government Response Tracker (OxCGRT) dataset.
+
+The OxCGRT file holds around 50 columns for every country in the world.  The analyses only read the columns in
+OXCGRT_SCHEMA, with the policy indices as float32 (if their values have no more than the decimal places they are
+published with, otherwise float64) and names as categoricals; the publication dataset keeps every column of the
+IRIS countries' rows.  Given the IRIS countries the loader reads the file in chunks and drops other countries'
+rows as it goes.
+'''
+
+import pandas as pd
+
+from .countries import COUNTRIES
+from .dates import DateDimension
+from .keys import left_join
+from .schemas import Schema, register
+
+
+OXCGRT_FILE = 'OxCGRT_latest13102020.csv'
+
+# OxCGRT provides UK data in aggregated format AND separately for the 4 nations
+UK_NATIONS = COUNTRIES.nations('United Kingdom')
+
+# Policy indices and the indicators that comprise the Stringency Index, with human-readable names for graphing
+OXCGRT_INDICES = {
+    'StringencyIndex': 'Stringency Index',
+    'GovernmentResponseIndex': 'Government Response Index',
+    'ContainmentHealthIndex': 'Containment Health Index',
+    'EconomicSupportIndex': 'Economic Support Index',
+    'C1_School closing': 'School closing',
+    'C2_Workplace closing': 'Workplace closing',
+    'C3_Cancel public events': 'Cancel public events',
+    'C4_Restrictions on gatherings': 'Restrictions on gatherings',
+    'C5_Close public transport': 'Close public transport',
+    'C6_Stay at home requirements': 'Stay at home requirements',
+    'C7_Restrictions on internal movement': 'Restrictions on internal movement',
+    'C8_International travel controls': 'International travel controls',
+    'H1_Public information campaigns': 'Public information campaigns',
+}
+
+# Indices are published to 2 decimal places, the indicators are ordinal codes
+OXCGRT_SCHEMA = register(Schema(
+    'oxcgrt',
+    columns=dict(
+        {'CountryName': 'category', 'CountryCode': 'category', 'RegionName': 'category', 'RegionCode': 'category',
+         'Date': 'int64'},
+        **{col: 'float32' for col in OXCGRT_INDICES}
+    ),
+    dates={'Date': '%Y%m%d'},
+    decimals={col: 2 if col.endswith('Index') else 0 for col in OXCGRT_INDICES},
+))
+
+DEFAULT_CHUNKSIZE = 250000
+
+
+def uk_nations_as_countries(grt):
+    '''CountryName with 'United Kingdom' replaced by the nation in RegionName for rows of the UK nations.'''
+    countries = grt['CountryName']
+    nations = grt['RegionName'].isin(UK_NATIONS)
+    if isinstance(countries.dtype, pd.CategoricalDtype):
+        countries = countries.cat.add_categories([n for n in UK_NATIONS if n not in countries.cat.categories])
+    return countries.mask(nations, grt['RegionName'].astype(object))
+
+
+def _read_oxcgrt(path, countries=None, chunksize=DEFAULT_CHUNKSIZE, all_columns=False):
+    # Columns outside the schema have their types inferred, as they were when the whole file was read
+    usecols = None if all_columns else OXCGRT_SCHEMA.usecols
+    chunks = []
+    reader = pd.read_csv(path, usecols=usecols, dtype=OXCGRT_SCHEMA.read_dtypes(), chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk.assign(CountryName=uk_nations_as_countries(chunk))
+        if countries is not None:
+            chunk = chunk.loc[chunk['CountryName'].isin(countries)]
+        chunks.append(chunk)
+    return OXCGRT_SCHEMA.compact_floats(OXCGRT_SCHEMA.typed(pd.concat(chunks, ignore_index=True)))
+
+
+def read_oxcgrt(path, cache=None, countries=None, chunksize=DEFAULT_CHUNKSIZE, all_columns=False):
+    '''Reads the columns of the OxCGRT dataset in OXCGRT_SCHEMA, with the UK nations as countries.
+
+    If countries is given, only the rows of those countries are kept.  With all_columns, the file's other columns
+    are kept too, as published in publication_dataset_oxcgrt.csv.
+    '''
+    if countries is not None:
+        countries = sorted(set(countries))
+    if cache is not None:
+        return cache.load(path, _read_oxcgrt, countries=countries, chunksize=chunksize, all_columns=all_columns)
+    return _read_oxcgrt(path, countries, chunksize, all_columns)
+
+
+def process_oxcgrt(grt, countries, study_end, calendar=None):
+    '''Extracts IRIS countries from OxCGRT and assigns each date to an ISO year and week.
+
+    In OxCGRT, 'CountryName' is United Kingdom with the individual nation under 'RegionName', so 'United
+    Kingdom' is replaced with the relevant 'RegionName' for the UK nations.  ISO years and weeks are looked up
+    in calendar (a DateDimension covering the dates), or in one built for the OxCGRT dates.
+    '''
+    grt = grt.assign(CountryName=uk_nations_as_countries(grt))
+
+    # Extract IRIS countries from OxCGRT
+    grt_iris = grt.loc[grt['CountryName'].isin(countries)]
+
+    # Convert OxCGRT Date column to pandas dates (unless read_oxcgrt already did) and drop any data from after the
+    # end of the study period
+    grt_iris = OXCGRT_SCHEMA.parse_dates(grt_iris)
+    grt_iris = grt_iris.loc[grt_iris['Date'] <= study_end].copy()
+
+    # Assign each date to its ISO year and week (the ISO year, not the calendar year, so that days at the turn of
+    # the year match isoyear_sampled of the isolates)
+    iso = (calendar or DateDimension.covering(grt_iris['Date'])).lookup(grt_iris['Date'])
+    grt_iris['week'] = iso['week']
+    grt_iris['year'] = iso['isoyear']
+    return grt_iris
+
+
+def weekly_indices(grt_iris):
+    '''Weekly mean of each policy index and Stringency Index indicator per country.'''
+    # Averaged at full precision, so the means are those of the values in the OxCGRT file
+    indices = OXCGRT_SCHEMA.as_float64(grt_iris[list(OXCGRT_INDICES)])
+    # Plain country names rather than categories, which the merged Figure 2 data is summed over
+    keys = [grt_iris['CountryName'].astype(str), grt_iris['year'], grt_iris['week']]
+    grt_iris_indices = indices.groupby(keys, observed=True).mean()
+    grt_iris_indices.rename(columns=OXCGRT_INDICES, inplace=True)
+    return grt_iris_indices
+
+
+def merge_with_isolates(iris_summary, grt_iris_indices):
+    '''Merges weekly isolate counts with OxCGRT indices based on country, ISO year, and ISO week.
+
+    The result is that of a left pd.merge of the two tables (after reset_index), joined on integer keys instead
+    (see keys.py).
+    '''
+    merged_iris_grt = left_join(
+            iris_summary,
+            grt_iris_indices,
+            left_on=['country', 'isoyear_sampled', 'week_sampled'],
+            right_on=['CountryName', 'year', 'week'],
+    )
+
+    # Clean names in preparation for graphing
+    merged_iris_grt.rename(columns={"isoyear_sampled": "Year sampled", "week_sampled": "Week of year"}, inplace=True)
+    return merged_iris_grt
@@ -0,0 +1,199 @@
+'''Content-addressed cache of the rendered panels of the faceted figures (Figure 2 and Figure S5).
+
+Each panel (one country of a faceted figure) and the figure's legend is rendered on its own, at a fixed size,
+to a file whose name is a hash of everything that goes into drawing it: the rows of its slice of the data, its
+style parameters (e.g. the shared axis limits and whether it is on the bottom row or left column of the grid),
+its size, the output format and the source of the plotting code.  Titles too wide for a panel are set in a
+smaller font, since panels are saved uncropped.  The figure file is then composed from the panel files:
+
+- PNG: panel rasters are tiled into a single image array
+- SVG: panel documents are nested in a single SVG document, with their element ids prefixed so they stay unique
+
+A panel is only rendered if its file isn't in the cache, so a weekly refresh in which two countries' data
+changed re-renders two panels per figure rather than all of them.  Panel files no longer used by a figure are
+removed after it is composed.
+
+Example:
+    cache = PanelCache(outdir/PANEL_DIR)
+    tiles = [cache.panel('figure_S5', draw_panel, (rows, country), data=rows, style=style, fmt='png') for ...]
+    cache.compose('figure_S5', tiles, legend, columns=5, path=outdir/'figure_S5.png')
+'''
+
+import hashlib
+import inspect
+import io
+import re
+import xml.etree.ElementTree as ET
+
+import matplotlib
+import matplotlib.image as mpimg
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+
+# Sub-directory of a figure's output directory that its panels are cached in
+PANEL_DIR = '.panels'
+
+# Size of a panel in inches, and the position of its axes within it (left, bottom, width, height in inches),
+# leaving room for the title above and the axis labels and tick labels below and to the left
+PANEL_SIZE = (3.55, 3.45)
+AXES_RECT = (1.0, 0.9, 2.4, 2.2)
+LEGEND_SIZE = (1.3, 3.45)
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+
+def _source_digest(function):
+    '''Digest of the source of the module function was defined in, so panels are redrawn when it changes.'''
+    module = inspect.getmodule(function)
+    return hashlib.sha256(inspect.getsource(module).encode()).hexdigest()
+
+
+def panel_key(figure, draw, data, style, fmt, size=PANEL_SIZE, rect=AXES_RECT):
+    '''Hash of a panel: its figure, data rows, style parameters, size, format and plotting code.'''
+    digest = hashlib.sha256()
+    for part in (figure, draw.__name__, _source_digest(draw), matplotlib.__version__, fmt, repr(sorted(style.items())),
+                 repr(size), repr(rect)):
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    if data is not None:
+        digest.update(repr(list(data.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:32]
+
+
+def _fit_titles(figure):
+    '''Sets axes titles wider than the figure allows (centred on their axes) in a font small enough to fit.'''
+    renderer = figure.canvas.get_renderer()
+    for ax in figure.axes:
+        extent = ax.title.get_window_extent(renderer)
+        centre = ax.bbox.x0 + ax.bbox.width / 2
+        room = 2 * min(centre, figure.bbox.width - centre)
+        if extent.width > room:
+            ax.title.set_fontsize(ax.title.get_fontsize() * room / extent.width * 0.98)
+
+
+def render_panel(draw, args, style, path, size=PANEL_SIZE, rect=AXES_RECT):
+    '''Draws a panel with draw(ax, *args, **style) on axes at a fixed position in a figure of a fixed size.
+
+    With rect None, draw is given the figure instead of axes (e.g. for a legend).
+    '''
+    figure = plt.figure(figsize=size)
+    try:
+        if rect is None:
+            draw(figure, *args, **style)
+        else:
+            left, bottom, width, height = rect
+            ax = figure.add_axes([left / size[0], bottom / size[1], width / size[0], height / size[1]])
+            draw(ax, *args, **style)
+            _fit_titles(figure)
+        # Not cropped, so that every panel has the same size and the panels tile exactly
+        figure.savefig(path)
+    finally:
+        plt.close(figure)
+
+
+def _tile_png(paths, legend, columns):
+    images = [mpimg.imread(path) for path in paths]
+    height, width = images[0].shape[:2]
+    rows = -(-len(images) // columns)
+    legend_image = mpimg.imread(legend) if legend is not None else np.ones((0, 0, 4))
+    canvas = np.ones((max(rows * height, legend_image.shape[0]), columns * width + legend_image.shape[1], 4))
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        canvas[row * height:(row + 1) * height, column * width:(column + 1) * width] = image
+    if legend is not None:
+        top = (canvas.shape[0] - legend_image.shape[0]) // 2
+        canvas[top:top + legend_image.shape[0], columns * width:] = legend_image
+    return canvas
+
+
+def _svg_size(root):
+    '''Width and height of an SVG document in pt (as matplotlib writes them).'''
+    return tuple(float(re.sub('[a-z]+$', '', root.get(name))) for name in ('width', 'height'))
+
+
+def _nested_svg(path, prefix, x, y):
+    '''The root of the SVG document at path, with its ids prefixed and placed at x, y (in pt).'''
+    text = path.read_text(encoding='utf-8')
+    text = re.sub(r'\bid="([^"]+)"', r'id="{}\1"'.format(prefix), text)
+    text = re.sub(r'url\(#', 'url(#{}'.format(prefix), text)
+    text = re.sub(r'href="#', 'href="#{}'.format(prefix), text)
+    root = ET.fromstring(text)
+    width, height = _svg_size(root)
+    root.set('x', str(x))
+    root.set('y', str(y))
+    root.set('width', str(width))
+    root.set('height', str(height))
+    return root, width, height
+
+
+def _tile_svg(paths, legend, columns):
+    outer = ET.Element('{%s}svg' % SVG_NS, {'version': '1.1'})
+    width = height = 0
+    tile_width = tile_height = 0
+    for i, path in enumerate(paths):
+        row, column = divmod(i, columns)
+        nested, tile_width, tile_height = _nested_svg(path, 'p{}-'.format(i), column * tile_width, row * tile_height)
+        outer.append(nested)
+        width, height = max(width, (column + 1) * tile_width), max(height, (row + 1) * tile_height)
+    if legend is not None:
+        nested, legend_width, legend_height = _nested_svg(legend, 'legend-', columns * tile_width, 0)
+        nested.set('y', str(max(0.0, (height - legend_height) / 2)))
+        outer.append(nested)
+        width, height = width + legend_width, max(height, legend_height)
+    outer.set('width', '{}pt'.format(width))
+    outer.set('height', '{}pt'.format(height))
+    outer.set('viewBox', '0 0 {} {}'.format(width, height))
+    buffer = io.BytesIO()
+    ET.ElementTree(outer).write(buffer, encoding='utf-8', xml_declaration=True)
+    return buffer.getvalue()
+
+
+class PanelCache:
+    '''Rendered panels in a directory, each in a file named after its figure and key (see panel_key).'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.rendered = 0
+        self.reused = 0
+
+    def panel(self, figure, draw, args, data, style, fmt, size=PANEL_SIZE, rect=AXES_RECT):
+        '''Path of the panel drawn by draw(ax, *args, **style), rendering it only if it isn't cached.
+
+        data is the panel's slice of the figure data (everything in args that comes from the data).
+        '''
+        path = self.directory/'{}-{}.{}'.format(figure, panel_key(figure, draw, data, style, fmt, size, rect), fmt)
+        if path.exists():
+            self.reused += 1
+        else:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Rendered under a temporary name, so an interrupted render isn't taken for a cached panel
+            partial = path.with_name('partial-' + path.name)
+            render_panel(draw, args, style, partial, size, rect)
+            partial.replace(path)
+            self.rendered += 1
+        return path
+
+    def legend(self, figure, draw, style, fmt, size=LEGEND_SIZE):
+        '''Path of the figure's legend drawn by draw(figure, **style), rendering it only if it isn't cached.'''
+        return self.panel(figure + '-legend', draw, (), None, style, fmt, size, rect=None)
+
+    def compose(self, figure, panels, legend, columns, path):
+        '''Writes the figure file at path from its panels (in rows of columns) and legend, then removes the
+        figure's cached panels of this format that it no longer uses.'''
+        fmt = path.suffix.lstrip('.')
+        columns = max(1, min(columns, len(panels)))
+        if fmt == 'svg':
+            path.write_bytes(_tile_svg(panels, legend, columns))
+        else:
+            plt.imsave(path, _tile_png(panels, legend, columns), format=fmt)
+
+        used = set(panels) | {legend}
+        for stale in list(self.directory.glob('{}-*.{}'.format(figure, fmt))):
+            if stale not in used:
+                stale.unlink()
@@ -0,0 +1,298 @@
+'''The manuscript pipeline split into incremental stages.
+
+Stages and what they produce (relative to the output directory):
+
+- isolates: merged IRIS bacterial isolate dataset (publication_dataset_iris.csv)
+- summaries: data summaries (publication_summaries.xlsx)
+- figure_1_data, figure_1: global weekly counts (figure_1_data.xlsx) and Figure 1
+- weekly_counts: weekly cumulative isolate counts per species and country (iris_summary)
+- oxcgrt: OxCGRT data for IRIS countries (publication_dataset_oxcgrt.csv) and weekly mean indices
+- figure_2_data, figure_2: isolate counts merged with OxCGRT (figure_2_data.csv) and Figure 2/S2-S4
+- its: interrupted time series estimates per species and country (interrupted_time_series.csv)
+- meta: random-effects meta-analyses of the estimates by species and continent (meta_analysis.csv,
+  meta_analysis_forest.csv)
+- resampling: block bootstrap intervals and permutation p values for the change in weekly counts at ISO week 11
+  of 2020 per species and country (resampled_changes.csv)
+- mobility: Google mobility data for IRIS countries (publication_dataset_google.csv, figure_S5_data.csv)
+- figure_S5: Supplementary Figure 5
+
+With stata_export set in the config, the isolates, weekly_counts, oxcgrt and mobility stages also write their
+tables as Stata .dta files to publication_datasets/stata (see stata.py), with the IRIS dataset and weekly counts
+in one file per species.
+
+For example, a new Google mobility snapshot only reruns the mobility and figure_S5 stages.
+
+Plotting libraries are only imported by the figure stages, so runs that only need the datasets (e.g. targets
+STAGE_GROUPS['datasets']) don't load matplotlib or seaborn.
+
+Example:
+    from iris_pipeline import pipeline
+    pipeline.run(pipeline.DEFAULT_CONFIG, 'IRIS_manuscript_outputs', targets=['figure_2'])
+
+or from the command line (see cli.py):
+    python -m iris_pipeline --stages datasets
+'''
+
+import pandas as pd
+
+from .cache import FrameCache
+from .countries import COUNTRIES
+from .cube import WeeklyCube
+from .dates import study_years
+from .isolates import ISOLATE_FILES, load_isolates, write_isolate_dataset
+from .its import LOCKDOWN_WEEKS, interrupted_time_series
+from .meta import forest_table, meta_analysis
+from .mobility import MOBILITY_FILE, read_mobility_report, residential_and_workplaces, tidy_mobility, with_iso_week
+from .outputs import figure_2_filename, make_output_dirs
+from .oxcgrt import OXCGRT_FILE, merge_with_isolates, process_oxcgrt, read_oxcgrt, weekly_indices
+from .profiling import PROFILE_DIR, RUN_REPORT, Profiler
+from .render import RenderPool, figure_1_jobs, figure_2_jobs, figure_S5_jobs, render_job
+from .resampling import BLOCK_WEEKS, CHANGE_WEEK, REPLICATES, SEED, resample_changes
+from .stages import Pipeline, StageContext
+from .stata import STATA_DIR, dta_filename, weekly_count_table, write_dta, write_species_dta
+from .summaries import summary_tables, write_summaries
+from .weekly import figure_1_tables, global_weekly_counts, weekly_counts_by_country, write_figure_1_data
+
+
+DEFAULT_CONFIG = {
+    # Input files
+    'isolate_files': ISOLATE_FILES,
+    'oxcgrt_file': OXCGRT_FILE,
+    'mobility_file': MOBILITY_FILE,
+
+    # Study period and years
+    'study_start': '2018-01-01',
+    'study_end': '2020-05-31',
+    'study_years': [2018, 2019, 2020],
+
+    # First ISO (year, week) of lockdown per country, for the interrupted time series models
+    'lockdown_weeks': LOCKDOWN_WEEKS,
+    # Estimator of the between-country variance in the meta-analyses ('REML' as in the forest plot script, or 'DL')
+    'meta_method': 'REML',
+
+    # Resampling inference for the change in weekly counts from an ISO (year, week) on
+    'change_week': CHANGE_WEEK,
+    'resampling_replicates': REPLICATES,
+    'resampling_block_weeks': BLOCK_WEEKS,
+    'resampling_seed': SEED,
+
+    # Also write the publication datasets and weekly counts as Stata .dta files
+    'stata_export': False,
+
+    # All IRIS countries for use in Google COVID-19 Community Mobility Reports analyses
+    # England, Scotland, Wales, and Northern Ireland to be grouped as United Kingdom
+    'iris_countries': COUNTRIES.iris_countries(grouped=True),
+}
+
+DATASETS = 'data_and_summaries/publication_datasets'
+STATA = DATASETS + '/' + STATA_DIR
+
+# Named groups of stages that can be requested together
+STAGE_GROUPS = {
+    # The publication_datasets used in the statistical analyses, without any figures
+    'datasets': ['isolates', 'oxcgrt', 'mobility'],
+    'figures': ['figure_1', 'figure_2', 'figure_S5'],
+    'analyses': ['its', 'meta', 'resampling'],
+}
+
+manuscript = Pipeline()
+
+
+def _render(ctx, jobs):
+    # Figure files are rendered by the run's render pool if there is one, otherwise straight away.  The stage's
+    # manifest is written before pooled jobs finish, so their old files are removed first: if a job fails, its
+    # file is missing and the stage is rerun next time rather than keeping the stale figure
+    for job in jobs:
+        if ctx.renderer is not None:
+            job.output.unlink(missing_ok=True)
+            ctx.renderer.submit(job)
+        else:
+            render_job(job)
+
+
+def _weekly_cube(config, isolates):
+    return WeeklyCube.from_isolates(isolates, config['study_years'], config['study_start'], config['study_end'])
+
+
+def _with_stata(outputs, name, by_species=False):
+    # A stage's outputs, plus its .dta files when exporting to Stata
+    def stage_outputs(config):
+        if not config['stata_export']:
+            return outputs
+        species = config['isolate_files'] if by_species else [None]
+        return outputs + [STATA + '/' + dta_filename(name, each) for each in species]
+    return stage_outputs
+
+
+@manuscript.stage('isolates', files=['isolate_files'], params=['study_start', 'study_end', 'stata_export'],
+                  outputs=_with_stata([DATASETS + '/publication_dataset_iris.csv'], 'publication_dataset_iris', True))
+def isolates_stage(ctx):
+    config = ctx.config
+    iris_orgs = load_isolates(config['isolate_files'], config['study_start'], config['study_end'], ctx.cache)
+    write_isolate_dataset(iris_orgs, ctx.outputs.datasets/'publication_dataset_iris.csv')
+    if config['stata_export']:
+        write_species_dta(iris_orgs, ctx.outputs.datasets/STATA_DIR, 'publication_dataset_iris', config['isolate_files'])
+    return iris_orgs
+
+
+@manuscript.stage('summaries', deps=['isolates'], outputs=['data_and_summaries/publication_summaries.xlsx'])
+def summaries_stage(ctx, isolates):
+    tables = summary_tables(isolates)
+    write_summaries(tables, ctx.outputs.summaries/'publication_summaries.xlsx')
+    return tables
+
+
+@manuscript.stage('figure_1_data', deps=['isolates'], outputs=['figure_1/figure_1_data.xlsx'])
+def figure_1_data_stage(ctx, isolates):
+    weekly_counts, weekly_by_year = figure_1_tables(global_weekly_counts(isolates))
+    write_figure_1_data(weekly_counts, weekly_by_year, ctx.outputs.figure_1/'figure_1_data.xlsx')
+    return weekly_counts
+
+
+@manuscript.stage('figure_1', deps=['figure_1_data'], outputs=['figure_1/figure_1.png', 'figure_1/figure_1.svg'])
+def figure_1_stage(ctx, figure_1_data):
+    _render(ctx, figure_1_jobs(figure_1_data, ctx.outputs.figure_1))
+
+
+@manuscript.stage('weekly_counts', deps=['isolates'], params=['study_years', 'study_start', 'study_end', 'stata_export'],
+                  outputs=_with_stata([], 'weekly_counts', True))
+def weekly_counts_stage(ctx, isolates):
+    config = ctx.config
+    weekly_counts = weekly_counts_by_country(isolates, config['study_years'], config['study_start'], config['study_end'])
+    if config['stata_export']:
+        write_species_dta(weekly_count_table(weekly_counts), ctx.outputs.datasets/STATA_DIR, 'weekly_counts',
+                          config['isolate_files'])
+    return weekly_counts
+
+
+@manuscript.stage('oxcgrt', deps=['weekly_counts'], files=['oxcgrt_file'], params=['study_end', 'stata_export'],
+                  outputs=_with_stata([DATASETS + '/publication_dataset_oxcgrt.csv'], 'publication_dataset_oxcgrt'))
+def oxcgrt_stage(ctx, weekly_counts):
+    countries = weekly_counts.index.get_level_values('country').unique().to_list()
+    grt = read_oxcgrt(ctx.config['oxcgrt_file'], ctx.cache, countries, all_columns=True)
+    grt_iris = process_oxcgrt(grt, countries, ctx.config['study_end'])
+    grt_iris.to_csv(ctx.outputs.datasets/'publication_dataset_oxcgrt.csv', index=False, date_format='%Y-%m-%d')
+    if ctx.config['stata_export']:
+        write_dta(grt_iris, ctx.outputs.datasets/STATA_DIR/dta_filename('publication_dataset_oxcgrt'))
+    return weekly_indices(grt_iris)
+
+
+@manuscript.stage('figure_2_data', deps=['weekly_counts', 'oxcgrt'], outputs=['figure_2/figure_2_data.csv'])
+def figure_2_data_stage(ctx, weekly_counts, oxcgrt):
+    merged_iris_grt = merge_with_isolates(weekly_counts, oxcgrt)
+    merged_iris_grt.to_csv(ctx.outputs.figure_2/"figure_2_data.csv", index=False)
+    return merged_iris_grt
+
+
+@manuscript.stage('its', deps=['isolates'], params=['study_years', 'study_start', 'study_end', 'lockdown_weeks'],
+                  outputs=['data_and_summaries/interrupted_time_series.csv'])
+def its_stage(ctx, isolates):
+    estimates = interrupted_time_series(_weekly_cube(ctx.config, isolates), ctx.config['lockdown_weeks'])
+    estimates.to_csv(ctx.outputs.summaries/'interrupted_time_series.csv', index=False)
+    return estimates
+
+
+@manuscript.stage('meta', deps=['its'], params=['meta_method'],
+                  outputs=['data_and_summaries/meta_analysis.csv', 'data_and_summaries/meta_analysis_forest.csv'])
+def meta_stage(ctx, its):
+    method = ctx.config['meta_method']
+    pooled = meta_analysis(its, method=method)
+    pooled.to_csv(ctx.outputs.summaries/'meta_analysis.csv', index=False)
+    forest_table(its, method=method).to_csv(ctx.outputs.summaries/'meta_analysis_forest.csv', index=False)
+    return pooled
+
+
+@manuscript.stage('resampling', deps=['isolates'],
+                  params=['study_years', 'study_start', 'study_end', 'change_week', 'resampling_replicates',
+                          'resampling_block_weeks', 'resampling_seed'],
+                  outputs=['data_and_summaries/resampled_changes.csv'])
+def resampling_stage(ctx, isolates):
+    config = ctx.config
+    cube = _weekly_cube(config, isolates)
+    kwargs = dict(replicates=config['resampling_replicates'], block=config['resampling_block_weeks'],
+                  seed=config['resampling_seed'], change_week=config['change_week'])
+    bootstrap = resample_changes(cube, 'bootstrap', **kwargs)
+    permutation = resample_changes(cube, 'permutation', **kwargs)
+    changes = bootstrap.drop(columns='method').assign(p=permutation['p'])
+    changes.to_csv(ctx.outputs.summaries/'resampled_changes.csv', index=False)
+    return changes
+
+
+def _figure_2_outputs(config):
+    return ['figure_2/' + figure_2_filename(species, ext) for species in config['isolate_files'] for ext in ('png', 'svg')]
+
+
+@manuscript.stage('figure_2', deps=['figure_2_data'], params=['study_years', 'study_end'], outputs=_figure_2_outputs)
+def figure_2_stage(ctx, figure_2_data):
+    from .figures import stringency_bar_data
+    final_year, final_week, _ = pd.Timestamp(ctx.config['study_end']).isocalendar()
+    iris_oxcgrt_bar = stringency_bar_data(figure_2_data, ctx.config['study_years'], final_year, final_week)
+    _render(ctx, figure_2_jobs(iris_oxcgrt_bar, ctx.outputs.figure_2))
+
+
+@manuscript.stage('mobility', files=['mobility_file'], params=['iris_countries', 'study_end', 'stata_export'],
+                  outputs=_with_stata([DATASETS + '/publication_dataset_google.csv', 'figure_S5/figure_S5_data.csv'],
+                                      'publication_dataset_google'))
+def mobility_stage(ctx):
+    config = ctx.config
+    load = ctx.cache.load if ctx.cache is not None else lambda path, reader, **kwargs: reader(path, **kwargs)
+    google_iris = load(config['mobility_file'], read_mobility_report,
+                       countries=config['iris_countries'], study_end=config['study_end'])
+    google_iris = tidy_mobility(google_iris)
+    google_dataset = with_iso_week(google_iris)
+    google_dataset.to_csv(ctx.outputs.datasets/'publication_dataset_google.csv')
+    if config['stata_export']:
+        write_dta(google_dataset, ctx.outputs.datasets/STATA_DIR/dta_filename('publication_dataset_google'))
+
+    google_res_work = residential_and_workplaces(google_iris)
+    google_res_work.to_csv(ctx.outputs.figure_S5/'figure_S5_data.csv')
+    return google_res_work
+
+
+@manuscript.stage('figure_S5', deps=['mobility'], outputs=['figure_S5/figure_S5.png', 'figure_S5/figure_S5.svg'])
+def figure_S5_stage(ctx, mobility):
+    _render(ctx, figure_S5_jobs(mobility, ctx.outputs.figure_S5))
+
+
+def study_config(study_start, study_end, **overrides):
+    '''DEFAULT_CONFIG for a different study period (study years are the ISO years it spans), with any other
+    entries (e.g. input files) replaced by overrides.'''
+    config = dict(DEFAULT_CONFIG, study_start=study_start, study_end=study_end,
+                  study_years=study_years(study_start, study_end))
+    config.update(overrides)
+    return config
+
+
+def expand_stages(names):
+    '''Replaces the names of stage groups (see STAGE_GROUPS) with the stages they contain.'''
+    stages = []
+    for name in names:
+        for stage in STAGE_GROUPS.get(name, [name]):
+            if stage not in stages:
+                stages.append(stage)
+    return stages
+
+
+def run(config, output_root, targets=None, force=(), cache_dir='.iris_cache', render_workers=1, profile=(), report=True):
+    '''Runs the manuscript pipeline incrementally, writing outputs to output_root.
+
+    Stage state is kept in output_root/.stages, so rerunning with the same output_root only recomputes stages
+    whose input files, parameters or upstream results changed.  With render_workers > 1 (or None for one per
+    CPU) figures are rendered headless in a process pool while the remaining stages run.
+
+    Unless report is False, the time, memory, rows and bytes written of each stage are written to
+    output_root/run_report.json (see profiling.py).  Stages named in profile are also run under cProfile,
+    with profiles written to output_root/profiles.
+    '''
+    cache = FrameCache(cache_dir) if cache_dir is not None else None
+    renderer = RenderPool(render_workers) if render_workers != 1 else None
+    outputs = make_output_dirs(output_root)
+    ctx = StageContext(config, outputs, cache, renderer)
+    profiler = Profiler(profile, outputs.root/PROFILE_DIR)
+    status = manuscript.run(ctx, targets=targets, force=force, profiler=profiler)
+    if renderer is not None:
+        with profiler.measure_extra('render_wait'):
+            renderer.wait()
+    if report:
+        profiler.write(outputs.root/RUN_REPORT, outputs.root)
+    return status
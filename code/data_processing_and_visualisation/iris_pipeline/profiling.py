@@ -0,0 +1,182 @@
+'''Per-stage profiling of pipeline runs.
+
+For every stage in a run the Profiler records wall time, CPU time, peak resident memory, the number of rows in
+its inputs and its result, and the bytes it wrote (declared output files and the stored result).  The
+measurements are written as a JSON run report next to the outputs (run_report.json), and are cheap enough to
+always be on: each stage costs a handful of system calls.  On Linux the peak memory is that of the stage alone
+(the kernel's high-water mark is reset when the stage starts); elsewhere it is the peak of the process so far.
+
+CPU time is that of the pipeline process; figures rendered by worker processes (render_workers > 1) are
+measured as a whole by the 'render_wait' entry of the report.
+
+Chosen stages can also be run under cProfile, writing profiles/<stage>.prof (for pstats, snakeviz or a
+flamegraph tool such as flameprof) and a plain text summary, profiles/<stage>.txt.
+
+Example:
+    python -m iris_pipeline --stages figure_2 --profile figure_2_data
+'''
+
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import os
+import pathlib
+import platform
+import pstats
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+RUN_REPORT = 'run_report.json'
+PROFILE_DIR = 'profiles'
+
+# Functions listed in the text summary of a cProfile capture
+PROFILE_SUMMARY_LINES = 40
+
+
+def _reset_peak_rss():
+    '''Resets the kernel's record of this process's peak resident memory, returning False if unsupported.'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    '''Peak resident memory of this process in bytes (since the last reset, on Linux), or None if unknown.'''
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes, except on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def rows(value):
+    '''Number of rows in a stage input or result: the length of a dataframe or series, summed over the values
+    of a dict, list or tuple.  Returns None for anything else.'''
+    if hasattr(value, 'shape') and hasattr(value, 'index'):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        counts = [rows(v) for v in value]
+        return sum(counts) if counts and None not in counts else None
+    return None
+
+
+def _megabytes(size):
+    return None if size is None else round(size / 2**20, 1)
+
+
+class Profiler:
+    '''Collects the measurements of one pipeline run.
+
+    profile names the stages to run under cProfile; their profiles are written to profile_dir.
+    '''
+
+    def __init__(self, profile=(), profile_dir=PROFILE_DIR):
+        self.profile = set(profile)
+        self.profile_dir = pathlib.Path(profile_dir)
+        self.stages = {}
+        self.extra = {}
+        self._peak = 0
+        self.started = datetime.datetime.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        '''Measures the enclosed block as the stage name, yielding a dict for further details of the stage.'''
+        record = {'status': 'ran'}
+        # Keep the process peak so far before resetting it for this stage
+        self._track_peak()
+        per_stage = _reset_peak_rss()
+        profile = cProfile.Profile() if name in self.profile else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+            record['cpu_seconds'] = round(time.process_time() - cpu, 4)
+            record['peak_rss_mb'] = _megabytes(peak_rss())
+            record['peak_rss_scope'] = 'stage' if per_stage else 'process'
+            if profile is not None:
+                record['profile'] = str(self._dump(name, profile))
+            self.stages[name] = record
+
+    def _track_peak(self):
+        self._peak = max(self._peak, peak_rss() or 0)
+
+    def skipped(self, name):
+        self.stages[name] = {'status': 'skipped'}
+
+    @contextlib.contextmanager
+    def measure_extra(self, name):
+        '''Measures wall time of a step outside the stages (e.g. waiting for the render pool).'''
+        wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.extra[name] = {'wall_seconds': round(time.perf_counter() - wall, 4)}
+
+    def _dump(self, name, profile):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        path = self.profile_dir/'{}.prof'.format(name)
+        profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+        (self.profile_dir/'{}.txt'.format(name)).write_text(summary.getvalue())
+        return path
+
+    def report(self, root=None):
+        '''The run report as a dict.  Output file sizes are read now (so after any render pool has finished),
+        with declared output paths taken relative to root.'''
+        stages = {}
+        for name, record in self.stages.items():
+            record = dict(record)
+            outputs = record.pop('outputs', None)
+            if outputs is not None:
+                paths = [pathlib.Path(root or '.')/p for p in outputs]
+                written = sum(p.stat().st_size for p in paths if p.exists())
+                record['bytes_written'] = written + record.pop('result_bytes', 0)
+            stages[name] = record
+
+        self._track_peak()
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_seconds': round(time.perf_counter() - self._wall, 4),
+            'cpu_seconds': round(time.process_time() - self._cpu, 4),
+            'peak_rss_mb': _megabytes(self._peak or None),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'stages': stages,
+            'other': self.extra,
+        }
+
+    def write(self, path, root=None):
+        with open(path, 'w') as handle:
+            json.dump(self.report(root), handle, indent=1)
+        return path
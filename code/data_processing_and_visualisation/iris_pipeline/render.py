@@ -0,0 +1,107 @@
+'''Headless, parallel rendering of the manuscript figures.
+
+Each figure file is an independent render job: Figure 1 and Figure S5 in each format, and each organism's
+Figure 2 facet plot in each format.  Jobs carry only the data they need and always write to the same file
+name, so they can be rendered in any order by a pool of worker processes using the non-interactive Agg
+backend.  Figure 2 and Figure S5 are composed from per-country panels cached in the figure's output directory
+(see panels.py), so a job only renders the panels whose data changed.
+
+Example:
+    with RenderPool(max_workers=8) as pool:
+        for job in figure_2_jobs(iris_oxcgrt_bar, outputs.figure_2):
+            pool.submit(job)
+'''
+
+import collections
+import concurrent.futures
+import os
+
+from .outputs import figure_2_filename
+
+
+FIGURE_FORMATS = ('png', 'svg')
+
+# plot is the name of a plotting function in iris_pipeline.figures, called as plot(*args, outdir, formats=(fmt,))
+RenderJob = collections.namedtuple('RenderJob', ['plot', 'args', 'outdir', 'fmt', 'output'])
+
+
+def figure_1_jobs(weekly_counts, outdir, formats=FIGURE_FORMATS):
+    return [RenderJob('plot_figure_1', (weekly_counts,), outdir, fmt, outdir/"figure_1.{}".format(fmt)) for fmt in formats]
+
+
+def figure_2_jobs(iris_oxcgrt_bar, outdir, formats=FIGURE_FORMATS):
+    '''One job per organism and format, each holding only that organism's rows.'''
+    jobs = []
+    for species in iris_oxcgrt_bar['species'].unique():
+        data = iris_oxcgrt_bar.loc[iris_oxcgrt_bar['species'] == species]
+        for fmt in formats:
+            jobs.append(RenderJob('plot_figure_2_panels', (data, species), outdir, fmt, outdir/figure_2_filename(species, fmt)))
+    return jobs
+
+
+def figure_S5_jobs(google_res_work, outdir, formats=FIGURE_FORMATS):
+    return [RenderJob('plot_figure_S5_panels', (google_res_work,), outdir, fmt, outdir/"figure_S5.{}".format(fmt)) for fmt in formats]
+
+
+def _use_headless_backend():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def render_job(job):
+    '''Renders a single job in the current process and returns the path of the file written.
+
+    If rendering fails, any partly written file is removed, so the figure isn't taken to be up to date.
+    '''
+    import matplotlib.pyplot as plt
+    from . import figures
+
+    figures.set_style()
+    try:
+        getattr(figures, job.plot)(*job.args, job.outdir, formats=(job.fmt,))
+    except BaseException:
+        job.output.unlink(missing_ok=True)
+        raise
+    finally:
+        plt.close('all')
+    return job.output
+
+
+class RenderPool:
+    '''Renders jobs in a pool of worker processes, starting each job as soon as it is submitted.
+
+    With max_workers=1 jobs are rendered in the calling process instead.  wait() (or leaving the with block)
+    blocks until every job has finished and raises the first error encountered.
+    '''
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._futures = []
+        self.outputs = []
+
+    def submit(self, job):
+        if self.max_workers == 1:
+            self.outputs.append(render_job(job))
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.max_workers, initializer=_use_headless_backend)
+        self._futures.append(self._executor.submit(render_job, job))
+
+    def wait(self):
+        '''Waits for all submitted jobs, returning the paths written.'''
+        try:
+            for future in self._futures:
+                self.outputs.append(future.result())
+        finally:
+            self._futures = []
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        return self.outputs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wait()
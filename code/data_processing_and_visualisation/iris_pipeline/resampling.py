@@ -0,0 +1,200 @@
+'''Block bootstrap and permutation inference for the change in weekly isolate counts after ISO week 11 of 2020.
+
+For each reported (species, country) series of a WeeklyCube, the statistic is the ratio of the mean weekly count
+from the change week (the WHO declaration of the pandemic, 11/03/2020, ISO week 11) to the end of the study period
+over the mean weekly count before it.  Two resampling schemes keep the week-to-week dependence of the counts by
+moving whole blocks of consecutive weeks:
+
+- bootstrap: the weeks before and after the change are each resampled with circular moving blocks, giving a
+  percentile confidence interval for the ratio;
+- permutation: non-overlapping blocks of the whole series are shuffled, with the change week held fixed, giving
+  a two-sided p value for no change.
+
+Replicates of a series are drawn in chunks, each chunk resampling all of its weeks at once, with the sums of the
+resampled weeks taken from block sums rather than gathered week by week.  Only a histogram of the log ratios
+(bootstrap) or a count of permuted ratios at least as extreme (permutation) is kept between chunks, so memory
+doesn't grow with the number of replicates.  Series are spread across a process pool, each with its own random
+stream spawned from one seed, so results don't depend on the number of workers.
+
+Example:
+    results = resample_changes(WeeklyCube.from_isolates(iris_orgs, study_years, study_start, study_end),
+                               replicates=10000, seed=20200311)
+'''
+
+import collections
+import concurrent.futures
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from .its import cube_series
+
+
+# First ISO week of the post-change period
+CHANGE_WEEK = (2020, 11)
+
+METHODS = ('bootstrap', 'permutation')
+REPLICATES = 10000
+BLOCK_WEEKS = 4
+SEED = 20200311
+
+# Replicates drawn at once per series, bounding the size of the index arrays
+CHUNK_REPLICATES = 1000
+
+# Grid the bootstrap log ratios are binned on, with a bin below and above it for values off the grid (including
+# infinite ratios of series with no isolates after the change)
+LOG_RATIO_RANGE = (-10.0, 10.0)
+LOG_RATIO_BINS = 20000
+
+Task = collections.namedtuple('Task', ['counts', 'change', 'method', 'replicates', 'block', 'seed', 'chunk'])
+
+
+def _ratio(pre_sums, post_sums, n_pre, n_post):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (post_sums / n_post) / (pre_sums / n_pre)
+
+
+def bootstrap_sums(rng, values, block, size):
+    '''Sums of size circular moving block bootstrap samples of values.
+
+    A sample joins blocks of block consecutive values (wrapping round the end) from random starts, the last
+    one cut short to the length of values.  Its sum is taken from tables of the sums of the block (and of the
+    shortened block) starting at each position, rather than by gathering every value.
+    '''
+    n = len(values)
+    full, rest = divmod(n, block)
+    cumulative = np.concatenate([[0], np.cumsum(np.concatenate([values, values[:block]]))])
+    starts = rng.integers(0, n, size=(size, -(-n // block)))
+    sums = (cumulative[starts[:, :full] + block] - cumulative[starts[:, :full]]).sum(axis=1)
+    if rest:
+        sums += cumulative[starts[:, full] + rest] - cumulative[starts[:, full]]
+    return sums
+
+
+def _last_blocks(rng, n_blocks, count, size):
+    '''The blocks placed last, last first, in size random orders of n_blocks blocks: the first count steps of a
+    Fisher-Yates shuffle of each order, run on all orders at once.'''
+    order = np.tile(np.arange(n_blocks), (size, 1))
+    rows = np.arange(size)
+    for i in range(count):
+        j = rng.integers(i, n_blocks, size=size)
+        swapped = order[rows, j]
+        order[rows, j] = order[rows, i]
+        order[rows, i] = swapped
+    return order[:, :count]
+
+
+def permuted_tail_sums(rng, values, block, tail, size):
+    '''Sums of the last tail values in size shuffles of the non-overlapping blocks of values (the last block
+    being shorter if block doesn't divide the length).
+
+    Only the blocks that can reach the last tail positions are drawn, and the sum is taken from the sums of
+    whole blocks and of the start of the block straddling the boundary.
+    '''
+    n = len(values)
+    n_blocks = -(-n // block)
+    lengths = np.minimum(block, n - np.arange(n_blocks) * block)
+    cumulative = np.concatenate([[0], np.cumsum(values)])
+    starts = np.arange(n_blocks) * block
+
+    # At most one block is short, so one more block than a tail of whole blocks needs always covers it
+    last = _last_blocks(rng, n_blocks, min(n_blocks, -(-tail // block) + 1), size)
+    placed = lengths[last]
+    from_end = np.cumsum(placed, axis=1)
+    # Values of each placed block within the tail: all of it, or the part after the boundary
+    within = np.clip(tail - (from_end - placed), 0, placed)
+    ends = starts[last] + placed
+    return (cumulative[ends] - cumulative[ends - within]).sum(axis=1)
+
+
+def _log_ratio_bins(log_ratios):
+    low, high = LOG_RATIO_RANGE
+    bins = np.floor((log_ratios - low) / (high - low) * LOG_RATIO_BINS) + 1
+    return np.clip(np.nan_to_num(bins, nan=-1, posinf=LOG_RATIO_BINS + 1, neginf=0), -1, LOG_RATIO_BINS + 1)
+
+
+def _percentile(histogram, q):
+    '''Value of the q quantile of the log ratios binned in histogram (to within a bin width).'''
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return np.nan
+    position = np.searchsorted(cumulative, q * cumulative[-1])
+    if position == 0:
+        return -np.inf
+    if position == len(histogram) - 1:
+        return np.inf
+    low, high = LOG_RATIO_RANGE
+    return low + (position - 0.5) * (high - low) / LOG_RATIO_BINS
+
+
+def resample_series(task):
+    '''Resamples one series (see Task), returning the observed ratio and the bootstrap 95% interval or the
+    permutation p value as a dict.'''
+    counts, change = task.counts, task.change
+    n_weeks = len(counts)
+    n_pre, n_post = change, n_weeks - change
+    total = counts.sum()
+    observed = _ratio(counts[:change].sum(), counts[change:].sum(), n_pre, n_post)
+    rng = np.random.default_rng(task.seed)
+
+    histogram = np.zeros(LOG_RATIO_BINS + 2, dtype=np.int64)
+    extreme = 0
+    for start in range(0, task.replicates, task.chunk):
+        size = min(task.chunk, task.replicates - start)
+        if task.method == 'bootstrap':
+            pre = bootstrap_sums(rng, counts[:change], task.block, size)
+            post = bootstrap_sums(rng, counts[change:], task.block, size)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bins = _log_ratio_bins(np.log(_ratio(pre, post, n_pre, n_post)))
+            histogram += np.bincount(bins[bins >= 0].astype(np.int64), minlength=len(histogram))
+        else:
+            post = permuted_tail_sums(rng, counts, task.block, n_post, size)
+            ratios = _ratio(total - post, post, n_pre, n_post)
+            # At least as far from no change as the observed ratio, allowing for rounding of equal sums
+            with np.errstate(divide='ignore', invalid='ignore'):
+                extreme += np.sum(np.abs(np.log(ratios)) >= np.abs(np.log(observed)) * (1 - 1e-12))
+
+    result = {'pre_mean': counts[:change].mean(), 'post_mean': counts[change:].mean(), 'ratio': observed}
+    if task.method == 'bootstrap':
+        result.update(lower=np.exp(_percentile(histogram, 0.025)), upper=np.exp(_percentile(histogram, 0.975)))
+    else:
+        result.update(p=(extreme + 1) / (task.replicates + 1) if np.isfinite(np.log(observed)) else np.nan)
+    return result
+
+
+def resample_changes(cube, method='bootstrap', replicates=REPLICATES, block=BLOCK_WEEKS, seed=SEED,
+                     change_week=CHANGE_WEEK, workers=None, chunk=CHUNK_REPLICATES):
+    '''Block bootstrap ('bootstrap') or permutation ('permutation') inference for the change in mean weekly
+    counts at change_week (an ISO (year, week)) of every reported (species, country) series of a WeeklyCube.
+
+    Series are resampled in up to workers processes (by default one per CPU, 1 to resample in this process).
+    If change_week isn't after the first week of the study period, no series are resampled.
+    Returns a frame with one row per series: the numbers of weeks before and after the change, the mean
+    weekly counts and their ratio, and the bootstrap 95% interval (lower, upper) or the permutation p value.
+    '''
+    if method not in METHODS:
+        raise ValueError('unknown method {!r}, expected one of {}'.format(method, ', '.join(METHODS)))
+    series, counts, years, weeks = cube_series(cube)
+    after = np.flatnonzero((years > change_week[0]) | ((years == change_week[0]) & (weeks >= change_week[1])))
+    if len(after) == 0 or after[0] == 0:
+        warnings.warn('change week {}-W{:02d} is not after the first week of the study period, no series are '
+                      'resampled'.format(*change_week))
+        series, counts = series.iloc[:0], counts[:0]
+        change = 0
+    else:
+        change = after[0]
+
+    streams = np.random.SeedSequence(seed).spawn(len(series))
+    tasks = [Task(counts[i], change, method, replicates, block, streams[i], chunk) for i in range(len(series))]
+    workers = min(len(tasks), workers or os.cpu_count() or 1)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(resample_series, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    else:
+        results = [resample_series(task) for task in tasks]
+
+    columns = ['pre_mean', 'post_mean', 'ratio'] + (['lower', 'upper'] if method == 'bootstrap' else ['p'])
+    return series.assign(method=method, pre_weeks=change, post_weeks=counts.shape[1] - change).join(
+        pd.DataFrame(results, columns=columns))
@@ -0,0 +1,127 @@
+'''Registry of the columns used from each external data source, and the types they are read as.
+
+The external CSV sources hold many more columns (and countries) than the IRIS analyses use.  A schema lists only
+the used columns, so loaders can skip the rest while parsing, with compact types: policy indices as float32
+(where their values fit the precision they are published with), country and region names as categoricals, and
+dates stored as integers (e.g. OxCGRT's 20200315) converted arithmetically instead of being parsed as text.
+
+Each source module registers the schema of its file when imported (oxcgrt.py registers 'oxcgrt', mobility.py
+registers 'google_mobility').
+
+Example:
+    grt = pd.read_csv(path, usecols=OXCGRT_SCHEMA.usecols, dtype=OXCGRT_SCHEMA.read_dtypes())
+    grt = OXCGRT_SCHEMA.typed(grt)
+'''
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+SCHEMAS = {}
+
+
+def register(schema):
+    '''Adds schema to the registry under its name, returning it.'''
+    if schema.name in SCHEMAS:
+        raise ValueError("a schema named '{}' is already registered".format(schema.name))
+    SCHEMAS[schema.name] = schema
+    return schema
+
+
+def integer_dates(values):
+    '''Converts integer dates in YYYYMMDD form (e.g. 20200315) to datetimes.'''
+    values = pd.Series(values)
+    parts = pd.DataFrame({'year': values // 10000, 'month': values // 100 % 100, 'day': values % 100})
+    return pd.to_datetime(parts).rename(values.name)
+
+
+class Schema:
+    '''Columns used from an external source, with the dtype each is read as.
+
+    columns maps each used column to its dtype.  Date columns are listed in dates with their format, and are
+    read with the dtype given in columns (an integer type for '%Y%m%d' dates held as numbers, otherwise 'object')
+    before typed() converts them.  Categorical columns are read as strings and converted by typed(), so that
+    a file can be read in chunks and filtered before the categories are fixed.  float32 columns are read as
+    float64 and stored as float32 by compact_floats() only if their values have no more than the number of
+    decimal places given in decimals, so that as_float64() can restore their exact values.
+    '''
+
+    def __init__(self, name, columns, dates=None, decimals=None):
+        self.name = name
+        self.columns = dict(columns)
+        self.dates = dict(dates or {})
+        self.decimals = dict(decimals or {})
+
+    @property
+    def usecols(self):
+        '''Callable for read_csv's usecols, skipping used columns that a version of the file doesn't have.'''
+        wanted = set(self.columns)
+        return lambda col: col in wanted
+
+    def read_dtypes(self, columns=None):
+        '''dtypes for read_csv of the given columns (default: all of them), with any not in the schema as text.
+
+        float32 columns are read as float64, to be checked by compact_floats().
+        '''
+        columns = self.columns if columns is None else columns
+        dtypes = {col: self.columns.get(col, 'object') for col in columns}
+        read_as = {'category': str, 'float32': 'float64'}
+        return {col: read_as.get(dtype, dtype) for col, dtype in dtypes.items()}
+
+    def parse_dates(self, frame):
+        '''Returns frame with its date columns (if not already converted) as datetimes.'''
+        converted = {}
+        for col, fmt in self.dates.items():
+            if col not in frame or pd.api.types.is_datetime64_any_dtype(frame[col]):
+                continue
+            if fmt == '%Y%m%d' and pd.api.types.is_integer_dtype(frame[col]):
+                converted[col] = integer_dates(frame[col])
+            else:
+                converted[col] = pd.to_datetime(frame[col], format=fmt)
+        return frame.assign(**converted) if converted else frame
+
+    def typed(self, frame):
+        '''Returns frame with categorical and date columns converted to their final types.'''
+        categorical = {
+            col: frame[col].astype('category') for col, dtype in self.columns.items()
+            if dtype == 'category' and col in frame and not isinstance(frame[col].dtype, pd.CategoricalDtype)
+        }
+        if categorical:
+            frame = frame.assign(**categorical)
+        return self.parse_dates(frame)
+
+    def compact_floats(self, frame):
+        '''Returns frame with its float32 schema columns (read as float64) stored as float32 where every value has
+        at most the column's decimal places.
+
+        Other columns are kept as float64, with a warning, so values more precise than expected are never rounded.
+        '''
+        compact = {}
+        for col, dtype in self.columns.items():
+            if dtype != 'float32' or col not in frame or frame[col].dtype != 'float64':
+                continue
+            values = frame[col].to_numpy()
+            places = self.decimals.get(col)
+            scaled = values * 10.0 ** (places or 0)
+            if places is not None and np.allclose(scaled, np.round(scaled), rtol=0, atol=1e-6, equal_nan=True):
+                compact[col] = frame[col].astype('float32')
+            else:
+                warnings.warn("{} column '{}' has values with more than {} decimal places, kept as float64".format(
+                    self.name, col, places))
+        return frame.assign(**compact) if compact else frame
+
+    def as_float64(self, frame):
+        '''Returns the float32 columns of frame as float64, with the exact values of the source file.
+
+        A float32 value such as 53.7 widens to 53.70000076..., so it is rounded back to its decimal places (which
+        compact_floats() checked it has); without that, means and other sums of the compact columns would differ
+        from those of the values in the source file.
+        '''
+        widened = {}
+        for col in frame.columns:
+            if frame[col].dtype == 'float32':
+                values = frame[col].astype('float64')
+                widened[col] = values.round(self.decimals[col]) if col in self.decimals else values
+        return frame.assign(**widened) if widened else frame
@@ -0,0 +1,384 @@
+'''Resident local query service over the weekly isolate counts, OxCGRT indices and Google mobility data.
+
+Questions such as "S. pneumoniae counts for the Netherlands in weeks 5-20 of 2019 and 2020, with the mean
+Stringency Index" otherwise need a full rerun.  The service reads the isolate exports, OxCGRT and Google mobility
+files once (through the FrameCache), and keeps in memory the weekly count cube (see cube.py) and the weekly
+means of the OxCGRT indices and mobility categories.  The indices and mobility means are held as arrays laid out
+on the cube's country, ISO year and ISO week axes, so a query is a slice of the arrays.  The UK nations get the
+United Kingdom's mobility data, as Google only reports the UK as a whole.
+
+It serves a small HTTP/JSON API on localhost:
+
+- GET /query: weekly rows selected by species, country, year (each repeatable or comma separated; default all)
+  and weeks (e.g. 5-20), with cumulative=1 for cumulative counts within each ISO year, index=<OxCGRT index>
+  and mobility=<place category> (repeatable, or 'all') for the joined weekly means, and summary=1 for one row
+  per species, country and year (the total count, or with cumulative=1 the last cumulative count, and the mean
+  of each index over the selected weeks)
+- GET /meta: the species, countries, years, indices and mobility categories that can be queried, and the cache
+  statistics
+- POST /reload: re-reads the input files.  If any of them changed, the data are replaced and the result cache
+  cleared.
+
+Results are kept in an LRU cache keyed by the normalised query, so repeated queries are answered without
+slicing the arrays again.
+
+Example:
+    python -m iris_pipeline.service --data-dir ~/iris_data --port 8765
+    curl 'http://127.0.0.1:8765/query?species=S.%20pneumoniae&country=Netherlands&year=2019,2020&weeks=5-20&index=Stringency%20Index'
+    curl -X POST http://127.0.0.1:8765/reload
+'''
+
+import argparse
+import functools
+import http.server
+import json
+import pathlib
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from .cache import FrameCache, file_digest
+from .countries import COUNTRIES
+from .cube import INDEX_NAMES, MAX_ISO_WEEKS, WeeklyCube
+from .dates import DateDimension
+from .isolates import load_isolates
+from .mobility import PLACE_CATEGORY_NAMES, read_mobility_report, tidy_mobility
+from .outputs import species_slug
+from .oxcgrt import OXCGRT_INDICES, process_oxcgrt, read_oxcgrt, weekly_indices
+
+
+DEFAULT_PORT = 8765
+
+# Number of query results kept in the LRU cache
+CACHE_SIZE = 1024
+
+INDICES = list(OXCGRT_INDICES.values())
+MOBILITY = list(PLACE_CATEGORY_NAMES.values())
+
+TRUE_VALUES = {'1', 'true', 'yes'}
+
+
+class QueryError(ValueError):
+    '''A query that can't be answered, reported to the client as a 400 response.'''
+
+
+def _weekly_array(frame, names, countries, years):
+    '''(columns, countries, years, weeks) array of the columns of a frame indexed by (country, ISO year, ISO week),
+    NaN where the frame has no row.'''
+    values = np.full((len(names), len(countries), len(years), MAX_ISO_WEEKS), np.nan)
+    country, year, week = (frame.index.get_level_values(level) for level in range(3))
+    c = pd.Index(countries).get_indexer(country)
+    y = pd.Index(years).get_indexer(np.asarray(year, dtype='int64'))
+    w = np.asarray(week, dtype='int64') - 1
+    inside = (c >= 0) & (y >= 0) & (w >= 0) & (w < MAX_ISO_WEEKS)
+    for i, name in enumerate(names):
+        values[i, c[inside], y[inside], w[inside]] = frame[name].to_numpy(dtype='float64')[inside]
+    return values
+
+
+def weekly_mobility(google_iris):
+    '''Weekly mean of each place category per country, ISO year and ISO week of tidied mobility data.'''
+    iso = DateDimension.covering(google_iris['date']).lookup(google_iris['date'])
+    keys = [google_iris['country_region'].astype(str), iso['isoyear'], iso['week']]
+    return google_iris[MOBILITY].astype('float64').groupby(keys, observed=True).mean()
+
+
+class ServiceData:
+    '''The weekly count cube with the weekly OxCGRT indices and mobility means on its country, year and week axes.
+
+    digests identifies the input files the data were read from.
+    '''
+
+    def __init__(self, cube, indices, mobility, digests):
+        self.cube = cube
+        self.indices = indices
+        self.mobility = mobility
+        self.digests = digests
+        self.cumulative = cube.cumulative()
+        self.loaded = time.time()
+
+    @staticmethod
+    def input_digests(config, cache=None):
+        '''Content digests of the input files of config.'''
+        digest = cache.digest if cache is not None else file_digest
+        paths = sorted(config['isolate_files'].values()) + [config['oxcgrt_file'], config['mobility_file']]
+        return tuple(digest(path) for path in paths)
+
+    @classmethod
+    def load(cls, config, cache=None):
+        '''Reads the input files of a pipeline config (see pipeline.DEFAULT_CONFIG).'''
+        digests = cls.input_digests(config, cache)
+        isolates = load_isolates(config['isolate_files'], config['study_start'], config['study_end'], cache)
+        cube = WeeklyCube.from_isolates(isolates, config['study_years'], config['study_start'], config['study_end'])
+
+        grt = read_oxcgrt(config['oxcgrt_file'], cache, cube.countries)
+        indices = weekly_indices(process_oxcgrt(grt, cube.countries, config['study_end']))
+        indices = _weekly_array(indices, INDICES, cube.countries, cube.years)
+
+        # Mobility is reported per nation (the UK nations share the United Kingdom's), so it is laid out on the
+        # distinct nations and then repeated for each cube country of a nation
+        national = COUNTRIES.national(cube.countries)
+        nations = sorted(set(national))
+        load = cache.load if cache is not None else lambda path, reader, **kwargs: reader(path, **kwargs)
+        google_iris = load(config['mobility_file'], read_mobility_report, countries=nations,
+                           study_end=config['study_end'])
+        mobility = _weekly_array(weekly_mobility(tidy_mobility(google_iris)), MOBILITY, nations, cube.years)
+        mobility = mobility[:, pd.Index(nations).get_indexer(national)]
+        return cls(cube, indices, mobility, digests)
+
+    def meta(self):
+        return {
+            'species': self.cube.species,
+            'countries': self.cube.countries,
+            'years': self.cube.years.tolist(),
+            'indices': INDICES,
+            'mobility': MOBILITY,
+            'loaded': pd.Timestamp(self.loaded, unit='s').isoformat(),
+        }
+
+
+def _values(query, name):
+    '''All values of a query parameter, given repeatedly or comma separated.'''
+    return [value.strip() for values in query.get(name, []) for value in values.split(',') if value.strip()]
+
+
+def _select(values, known, what, aliases=None):
+    '''Positions of the selected values in known (all of them if none were given).'''
+    if not values:
+        return tuple(range(len(known)))
+    aliases = aliases or {}
+    positions = []
+    for value in values:
+        value = aliases.get(value, value)
+        if value not in known:
+            raise QueryError('unknown {} {!r}, expected one of {}'.format(what, value, ', '.join(map(str, known))))
+        positions.append(known.index(value))
+    return tuple(sorted(set(positions)))
+
+
+def _weeks(values):
+    '''ISO weeks 1-53, or a range like 5-20, as a (first, last) pair.'''
+    if not values:
+        return 1, MAX_ISO_WEEKS
+    try:
+        first, _, last = values[-1].partition('-')
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise QueryError("weeks must be a week or a range of weeks such as 5-20, got {!r}".format(values[-1])) from None
+    if not 1 <= first <= last <= MAX_ISO_WEEKS:
+        raise QueryError('weeks must be within 1-{}, got {}-{}'.format(MAX_ISO_WEEKS, first, last))
+    return first, last
+
+
+def _columns(values, known, what):
+    if values == ['all']:
+        return tuple(known)
+    for value in values:
+        if value not in known:
+            raise QueryError('unknown {} {!r}, expected one of {}'.format(what, value, ', '.join(known)))
+    return tuple(dict.fromkeys(values))
+
+
+class QueryService:
+    '''Answers queries on ServiceData, caching the encoded results of the latest cache_size distinct queries.
+
+    The data and their result cache are replaced together on reload, and each query is answered from the pair
+    current when it arrived, so queries run concurrently without a lock.
+    '''
+
+    def __init__(self, config, cache=None, cache_size=CACHE_SIZE):
+        self.config = config
+        self.cache = cache
+        self.cache_size = cache_size
+        # Serialises reloads only
+        self.lock = threading.Lock()
+        self._current = self._answers(ServiceData.load(config, cache))
+
+    def _answers(self, data):
+        '''The data with an empty result cache for them.'''
+        return data, functools.lru_cache(maxsize=self.cache_size)(functools.partial(self._answer, data))
+
+    @property
+    def data(self):
+        return self._current[0]
+
+    def reload(self):
+        '''Re-reads the input files if any of them changed, clearing the result cache.  Returns whether they
+        changed.'''
+        with self.lock:
+            if ServiceData.input_digests(self.config, self.cache) == self.data.digests:
+                return False
+            # Queries are answered from the previous data while the files are read
+            self._current = self._answers(ServiceData.load(self.config, self.cache))
+        return True
+
+    def cache_info(self):
+        info = self._current[1].cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+
+    def meta(self):
+        return dict(self.data.meta(), cache=self.cache_info())
+
+    def parse(self, query, data=None):
+        '''The normalised, hashable form of a query given as a {parameter: [values]} dict (from parse_qs).'''
+        cube = (data or self.data).cube
+        slugs = {species_slug(species): species for species in cube.species}
+        years = _values(query, 'year')
+        try:
+            years = [int(year) for year in years]
+        except ValueError:
+            raise QueryError('years must be ISO years, got {}'.format(', '.join(years))) from None
+        return (
+            _select(_values(query, 'species'), cube.species, 'species', slugs),
+            _select(_values(query, 'country'), cube.countries, 'country'),
+            _select(years, cube.years.tolist(), 'year'),
+            _weeks(_values(query, 'weeks')),
+            any(value.lower() in TRUE_VALUES for value in _values(query, 'cumulative')),
+            _columns(_values(query, 'index'), INDICES, 'index'),
+            _columns(_values(query, 'mobility'), MOBILITY, 'mobility category'),
+            any(value.lower() in TRUE_VALUES for value in _values(query, 'summary')),
+        )
+
+    def query(self, query):
+        '''JSON-encoded answer to a query given as a {parameter: [values]} dict (see the module docstring).'''
+        data, answers = self._current
+        return answers(self.parse(query, data))
+
+    def _answer(self, data, parsed):
+        return json.dumps({'rows': json.loads(self.frame(parsed, data).to_json(orient='records'))}).encode()
+
+    def frame(self, parsed, data=None):
+        '''The rows answering a parsed query, as a frame.'''
+        species, countries, years, (first, last), cumulative, indices, mobility, summary = parsed
+        species, countries, years = (np.asarray(axis, dtype=np.intp) for axis in (species, countries, years))
+        data = data or self.data
+        cube = data.cube
+        weeks = np.arange(first - 1, last)
+        cells = np.ix_(species, countries, years, weeks)
+        counts = (data.cumulative if cumulative else np.where(cube.week_valid, cube.counts, np.nan))[cells]
+        joined = {name: data.indices[INDICES.index(name)][np.ix_(countries, years, weeks)] for name in indices}
+        joined.update({name: data.mobility[MOBILITY.index(name)][np.ix_(countries, years, weeks)] for name in mobility})
+
+        # Rows of reported pairs in weeks of the study period
+        keep = cube.reported[np.ix_(species, countries)][:, :, None, None] & cube.week_valid[np.ix_(years, weeks)]
+        s, c, y, w = np.nonzero(keep)
+        rows = pd.DataFrame({
+            'species': [cube.species[species[i]] for i in s],
+            'country': [cube.countries[countries[i]] for i in c],
+            'isoyear_sampled': cube.years[years[y]],
+            'week_sampled': weeks[w] + 1,
+            'cumulative' if cumulative else 'count': counts[s, c, y, w],
+        })
+        for name, values in joined.items():
+            rows[name] = values[c, y, w]
+        if not summary:
+            return rows
+        aggregate = dict({'cumulative': 'last'} if cumulative else {'count': 'sum'}, **{name: 'mean' for name in joined})
+        grouped = rows.groupby(INDEX_NAMES[:3], sort=False).agg(aggregate)
+        return grouped.assign(weeks=rows.groupby(INDEX_NAMES[:3], sort=False).size()).reset_index()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, value):
+        self._send(status, json.dumps(value).encode())
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        service = self.server.service
+        if url.path == '/meta':
+            return self._json(200, service.meta())
+        if url.path != '/query':
+            return self._json(404, {'error': 'not found, expected /query, /meta or POST /reload'})
+        try:
+            body = service.query(urllib.parse.parse_qs(url.query))
+        except QueryError as error:
+            return self._json(400, {'error': str(error)})
+        self._send(200, body)
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != '/reload':
+            return self._json(404, {'error': 'not found, expected POST /reload'})
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        changed = self.server.service.reload()
+        self._json(200, {'reloaded': changed, 'loaded': self.server.service.data.meta()['loaded']})
+
+
+class QueryServer:
+    '''Serves a QueryService on a local port from a background thread, as a context manager.
+
+    Example:
+        with QueryServer(QueryService(pipeline.DEFAULT_CONFIG, FrameCache())) as server:
+            urllib.request.urlopen(server.url + '/query?country=Netherlands&weeks=5-20')
+    '''
+
+    def __init__(self, service, port=0):
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = service
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    from . import cli, pipeline
+
+    parser = argparse.ArgumentParser(prog='python -m iris_pipeline.service',
+                                     description='Serve queries of the weekly IRIS counts, OxCGRT indices and mobility data.')
+    parser.add_argument('--data-dir', type=pathlib.Path, default=pathlib.Path('.'),
+                        help='directory containing the input files (default: current directory)')
+    parser.add_argument('--isolates', metavar='SPECIES=PATH', type=cli._isolate_file, action='append',
+                        help='PubMLST export for an organism (repeat for each organism to replace)')
+    parser.add_argument('--oxcgrt', metavar='PATH', help='OxCGRT dataset')
+    parser.add_argument('--mobility', metavar='PATH', help='Google COVID-19 Community Mobility Reports dataset')
+    parser.add_argument('--start', metavar='YYYY-MM-DD', help='first day of the study period (default: 2018-01-01)')
+    parser.add_argument('--end', metavar='YYYY-MM-DD', help='last day of the study period (default: 2020-05-31)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port (default: {})'.format(DEFAULT_PORT))
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=pathlib.Path('.iris_cache'),
+                        help='cache of parsed input files (default: .iris_cache)')
+    parser.add_argument('--no-cache', action='store_true', help="don't cache parsed input files")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='number of query results kept (default: {})'.format(CACHE_SIZE))
+    parser.set_defaults(stata=False)
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    service = QueryService(cli._config(args, pipeline), None if args.no_cache else FrameCache(args.cache_dir),
+                           args.cache_size)
+    with QueryServer(service, args.port) as server:
+        print('Loaded in {:.1f}s, serving on {} (Ctrl-C to stop)'.format(time.time() - started, server.url))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,256 @@
+'''Batch comparison of dated snapshots of the PubMLST isolate exports in a single run.
+
+The project keeps dated exports side by side (e.g. IRIS_Sp_corrected_20052021.xlsx next to the *_13102020.xlsx
+files), and comparing two of them used to take two full, independent runs.  Here each snapshot is a set of
+exports (a {species: path} dict, as isolate_files in the pipeline config), and:
+
+- every distinct export is parsed once, however many snapshots share it: files are matched by content digest
+  and read through the FrameCache, concurrently if they aren't cached (see isolates.read_export_files)
+- the weekly count cubes of all snapshots are built side by side, as one (snapshots, species, country, ISO year,
+  ISO week) array on the same species and country axes
+- the changes between consecutive snapshots are worked out per cell from each isolate's cell in both cubes:
+  isolates are matched on their organism and PubMLST id, and each cell counts the isolates added, removed and
+  moved in or out (e.g. by a corrected sampling date or country).  Added isolates sampled on or before the
+  latest sampling date of the earlier snapshot are also counted as back-dated (late reports of weeks the
+  earlier snapshot already covered)
+- the publication summary tables of each snapshot are compared, keeping the values that changed
+
+Isolates moved into or out of the study period by a corrected date are counted as added or removed, as only
+isolates sampled in the study period are kept.  So the cost of N snapshots is that of reading their distinct
+exports, plus array diffs.
+
+Example:
+    python -m iris_pipeline --snapshot 2020-10-13 --snapshot "2021-05-20:S. pneumoniae=IRIS_Sp_corrected_20052021.xlsx"
+'''
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+from .cache import file_digest
+from .cube import INDEX_NAMES, KNOWN_ZERO_REPORTERS, WeeklyCube, _pair_order, _recode, study_week_mask
+from .isolates import label_export, prepare_isolates, read_export_files
+from .summaries import summary_tables
+
+
+# Sub-directory of the output directory the comparison is written to
+COMPARISON_DIR = 'snapshot_comparison'
+
+# Isolates in each cell that changed between two snapshots
+CHANGE_COLUMNS = ['added', 'backdated', 'removed', 'moved_in', 'moved_out']
+
+# PubMLST ids are below this, so (organism, id) packs into an int64 key
+_ID_SLOTS = 2 ** 40
+
+Snapshot = collections.namedtuple('Snapshot', ['label', 'isolate_files'])
+
+
+def _same_files(snapshots, cache=None):
+    '''{path: first path with the same contents} for the isolate exports of all snapshots.'''
+    first, same = {}, {}
+    for snapshot in snapshots:
+        for path in snapshot.isolate_files.values():
+            if path not in same:
+                digest = cache.digest(path) if cache is not None else file_digest(path)
+                same[path] = first.setdefault(digest, path)
+    return same
+
+
+def load_snapshots(snapshots, study_start, study_end, cache=None, workers=None):
+    '''The IRIS isolates of each snapshot (see isolates.load_isolates), parsing each distinct export once.'''
+    same = _same_files(snapshots, cache)
+    exports = read_export_files(same.values(), cache, workers)
+    return [prepare_isolates([label_export(exports[same[path]], species)
+                              for species, path in snapshot.isolate_files.items()], study_start, study_end)
+            for snapshot in snapshots]
+
+
+def _flat_table(table):
+    '''A summary table as a Series indexed by (row, column), with multi-level column labels joined by spaces.'''
+    columns = [' '.join(str(part) for part in label if part != '') if isinstance(label, tuple) else str(label)
+               for label in table.columns]
+    flat = table.set_axis(columns, axis=1)
+    flat.index = flat.index.astype(str)
+    return flat.rename_axis(index='row', columns='column').stack(future_stack=True)
+
+
+class SnapshotComparison:
+    '''Weekly count cubes of several snapshots side by side, with what changed between consecutive snapshots.
+
+    counts is a (snapshots, species, countries, years, weeks) array and reported a (snapshots, species,
+    countries) mask, on the same species and countries axes for every snapshot.
+    '''
+
+    def __init__(self, labels, isolates, study_years, study_start, study_end):
+        self.labels = list(labels)
+        if len(set(self.labels)) != len(self.labels):
+            raise ValueError('snapshot labels must be unique, got {}'.format(', '.join(self.labels)))
+        self.years = np.asarray(study_years)
+        self.week_valid = study_week_mask(self.years, study_start, study_end)
+        self.summaries = [summary_tables(iris_orgs) for iris_orgs in isolates]
+
+        # As in WeeklyCube.from_isolates, only isolates with a name and an ISO year and week are counted
+        counted = [iris_orgs.dropna(subset=['isolate', 'isoyear_sampled', 'week_sampled']) for iris_orgs in isolates]
+        species = sorted(set().union(*(iris_orgs['species'].dropna().unique() for iris_orgs in counted)))
+        countries = sorted(set().union(*(iris_orgs['country'].dropna().unique() for iris_orgs in counted)))
+        codes = [(pd.Index(species).get_indexer(iris_orgs['species']), pd.Index(countries).get_indexer(iris_orgs['country']))
+                 for iris_orgs in counted]
+
+        # Species and countries are ordered as in the sorted (species, country) index of all the isolates
+        pairs = np.zeros((len(species), len(countries)), dtype=bool)
+        for s, c in codes:
+            known = (s >= 0) & (c >= 0)
+            pairs[s[known], c[known]] = True
+        species_order, country_order = _pair_order(*np.nonzero(pairs), len(species), len(countries))
+        self.species = [species[i] for i in species_order]
+        self.countries = [countries[i] for i in country_order]
+
+        self.shape = (len(self.species), len(self.countries)) + self.week_valid.shape
+        self.cells, self.keys, self.sampled = [], [], []
+        counts, reported = [], []
+        for iris_orgs, (s, c) in zip(counted, codes):
+            s = _recode(s, species_order, len(species))
+            c = _recode(c, country_order, len(countries))
+            self.cells.append(self._cells(iris_orgs, s, c))
+            self.keys.append(self._keys(iris_orgs, s))
+            self.sampled.append(iris_orgs['date_sampled'].to_numpy())
+            counts.append(np.bincount(self.cells[-1][self.cells[-1] >= 0], minlength=int(np.prod(self.shape))).reshape(self.shape))
+            reported.append(self._reported(counts[-1], iris_orgs))
+        self.counts = np.stack(counts)
+        self.reported = np.stack(reported)
+
+    def _cells(self, iris_orgs, s, c):
+        '''Flat cell number of each isolate in the cube, or -1 if it isn't in the cube.'''
+        y = pd.Index(self.years).get_indexer(iris_orgs['isoyear_sampled'].to_numpy())
+        w = iris_orgs['week_sampled'].to_numpy(dtype='float64', na_value=np.nan) - 1
+        inside = (s >= 0) & (c >= 0) & (y >= 0) & (w >= 0) & (w < self.shape[3])
+        cells = np.full(len(iris_orgs), -1, dtype=np.int64)
+        cells[inside] = np.ravel_multi_index((s[inside], c[inside], y[inside], w[inside].astype('int64')), self.shape)
+        return cells
+
+    def _keys(self, iris_orgs, s):
+        '''int64 key of each isolate's organism and PubMLST id, negative (matching nothing) without an id.'''
+        ids = pd.to_numeric(iris_orgs['id'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        valid = (s >= 0) & (ids >= 0) & (ids < _ID_SLOTS)
+        keys = np.where(valid, s * _ID_SLOTS + np.where(valid, ids, 0).astype(np.int64), -1)
+        if pd.Index(keys[valid]).has_duplicates:
+            raise ValueError('isolates of the same organism share a PubMLST id, so snapshots can\'t be matched')
+        return keys
+
+    def _reported(self, counts, iris_orgs):
+        # A pair submitted data if any isolates were counted for it, or if it is a known zero reporter
+        reported = counts.sum(axis=(2, 3)) > 0
+        present_species, present_countries = set(iris_orgs['species'].dropna()), set(iris_orgs['country'].dropna())
+        for species, country in KNOWN_ZERO_REPORTERS:
+            if species in present_species and country in present_countries:
+                reported[self.species.index(species), self.countries.index(country)] = True
+        return reported
+
+    def _position(self, label):
+        try:
+            return self.labels.index(label)
+        except ValueError:
+            raise KeyError('no snapshot labelled {!r}'.format(label)) from None
+
+    def cube(self, label):
+        '''The WeeklyCube of a snapshot, e.g. to run the analyses on it.'''
+        n = self._position(label)
+        return WeeklyCube(self.counts[n], self.species, self.countries, self.years, self.reported[n], self.week_valid)
+
+    def _frame(self, mask, columns):
+        '''Long-form frame of the selected cells, indexed by species, country, ISO year and ISO week.'''
+        s, c, y, w = np.nonzero(mask)
+        index = pd.MultiIndex.from_arrays([
+            pd.Categorical.from_codes(s, self.species), pd.Categorical.from_codes(c, self.countries),
+            self.years[y], w + 1,
+        ], names=INDEX_NAMES)
+        return pd.DataFrame({name: values[mask] for name, values in columns.items()}, index=index)
+
+    def weekly_counts(self):
+        '''Weekly isolate counts of every snapshot side by side, one column per snapshot.
+
+        There is a row for each study week of the (species, country) pairs reported in any snapshot, with NaN
+        counts where a snapshot has no data for the pair.
+        '''
+        mask = self.reported.any(axis=0)[:, :, None, None] & self.week_valid
+        counts = np.where(self.reported[:, :, :, None, None], self.counts, np.nan)
+        return self._frame(mask, {label: counts[n] for n, label in enumerate(self.labels)})
+
+    def cell_changes(self, before, after):
+        '''{class: counts per cell} of the isolates added, back-dated, removed and moved in or out of each cell
+        (see CHANGE_COLUMNS) from snapshot before to snapshot after.'''
+        a, b = self._position(before), self._position(after)
+        size = int(np.prod(self.shape))
+        count = lambda cells: np.bincount(cells[cells >= 0], minlength=size).reshape(self.shape)
+
+        # Position in the earlier snapshot of each isolate of the later one, -1 if it is new
+        match = pd.Index(self.keys[a]).get_indexer(self.keys[b])
+        match[self.keys[b] < 0] = -1
+        new = match < 0
+        kept = np.flatnonzero(~new)
+        moved = self.cells[a][match[kept]] != self.cells[b][kept]
+        gone = np.ones(len(self.keys[a]), dtype=bool)
+        gone[match[kept]] = False
+        latest = pd.Series(self.sampled[a]).max()
+        backdated = new & (self.sampled[b] <= latest) if pd.notna(latest) else np.zeros_like(new)
+
+        return {
+            'added': count(self.cells[b][new]),
+            'backdated': count(self.cells[b][backdated]),
+            'removed': count(self.cells[a][gone]),
+            'moved_in': count(self.cells[b][kept[moved]]),
+            'moved_out': count(self.cells[a][match[kept[moved]]]),
+        }
+
+    def changes(self, before, after):
+        '''The cells that changed from snapshot before to snapshot after, with their counts in both and the
+        isolates added, back-dated, removed and moved in or out.'''
+        a, b = self._position(before), self._position(after)
+        classes = self.cell_changes(before, after)
+        valid = (self.reported[a] | self.reported[b])[:, :, None, None] & self.week_valid
+        counts = np.where(self.reported[:, :, :, None, None], self.counts, np.nan)
+        changed = valid & (np.logical_or.reduce([values > 0 for values in classes.values()])
+                           | (self.reported[a] != self.reported[b])[:, :, None, None])
+        frame = self._frame(changed, dict({'count_before': counts[a], 'count_after': counts[b]}, **classes))
+        return frame.reset_index().assign(before=before, after=after).set_index(['before', 'after'] + INDEX_NAMES)
+
+    def summary_changes(self, before, after):
+        '''The values of the publication summary tables that changed from snapshot before to snapshot after.'''
+        tables_before, tables_after = self.summaries[self._position(before)], self.summaries[self._position(after)]
+        rows = []
+        for table in tables_before:
+            values = pd.concat({'value_before': _flat_table(tables_before[table]),
+                                'value_after': _flat_table(tables_after[table])}, axis=1)
+            same = (values['value_before'] == values['value_after']) | (values['value_before'].isna() & values['value_after'].isna())
+            rows.append(values.loc[~same].assign(table=table))
+        changed = pd.concat(rows).reset_index().assign(before=before, after=after)
+        return changed[['before', 'after', 'table', 'row', 'column', 'value_before', 'value_after']]
+
+    def consecutive(self):
+        '''(before, after) labels of each pair of consecutive snapshots.'''
+        return list(zip(self.labels[:-1], self.labels[1:]))
+
+
+def compare_snapshots(snapshots, study_years, study_start, study_end, cache=None, workers=None):
+    '''Reads the isolate exports of each snapshot (see load_snapshots) and returns their SnapshotComparison.'''
+    isolates = load_snapshots(snapshots, study_start, study_end, cache, workers)
+    return SnapshotComparison([snapshot.label for snapshot in snapshots], isolates, study_years, study_start, study_end)
+
+
+def write_comparison(comparison, outdir):
+    '''Writes the side-by-side weekly counts, and the changed cells and summary values of each pair of
+    consecutive snapshots, to CSV files in outdir.
+
+    Returns the number of isolates added, back-dated, removed and moved between each pair as a frame.
+    '''
+    outdir.mkdir(parents=True, exist_ok=True)
+    comparison.weekly_counts().to_csv(outdir/'snapshot_weekly_counts.csv')
+    changes = [comparison.changes(before, after) for before, after in comparison.consecutive()]
+    summaries = [comparison.summary_changes(before, after) for before, after in comparison.consecutive()]
+    if changes:
+        pd.concat(changes).to_csv(outdir/'snapshot_changes.csv')
+        pd.concat(summaries).to_csv(outdir/'snapshot_summary_changes.csv', index=False)
+    return pd.DataFrame([dict(before=before, after=after, **{name: int(changed[name].sum()) for name in CHANGE_COLUMNS})
+                         for (before, after), changed in zip(comparison.consecutive(), changes)],
+                        columns=['before', 'after'] + CHANGE_COLUMNS)
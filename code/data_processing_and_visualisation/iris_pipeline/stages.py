@@ -0,0 +1,251 @@
+'''Minimal incremental stage runner.
+
+A pipeline is a set of named stages.  Each stage declares the stages it depends on, the input files and
+parameters it reads from the run configuration, and the output files it writes.  Each stage's result is
+persisted in the state directory together with a fingerprint of everything that went into it: the contents of
+its input files, its parameter values, the source code of its function and of every module of the package it
+is defined in (so editing a helper module reruns the stages), and the hashes of the results of the stages it
+depends on.  On a rerun a stage is only recomputed if its fingerprint changed or one of its declared
+outputs is missing; otherwise its stored result is reused (and only loaded from disk if a downstream stage
+needs it).  Because dependents are keyed on upstream results rather than upstream inputs, a stage that reruns
+but produces an identical result doesn't trigger its dependents.
+
+Every stage that runs is measured by a Profiler (see profiling.py): time, memory, rows in and out and bytes
+written.
+'''
+
+import functools
+import hashlib
+import inspect
+import json
+import pathlib
+import pickle
+import sys
+import time
+
+from .cache import file_digest
+from .profiling import Profiler, rows
+
+
+STATE_DIR = '.stages'
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _file_paths(value):
+    '''Flattens a configuration value naming input files (a path, or a list or dict of paths).'''
+    if isinstance(value, dict):
+        return [p for v in value.values() for p in _file_paths(v)]
+    if isinstance(value, (list, tuple)):
+        return [p for v in value for p in _file_paths(v)]
+    return [pathlib.Path(value)]
+
+
+@functools.lru_cache(maxsize=None)
+def package_digest(module_name):
+    '''Digest of the source of every module of the package module_name is part of (or of the module itself if it
+    isn't in a package), computed once per process.'''
+    package = sys.modules.get(module_name.partition('.')[0])
+    if getattr(package, '__path__', None):
+        root = pathlib.Path(list(package.__path__)[0])
+        paths = sorted(root.rglob('*.py'))
+    else:
+        try:
+            root, paths = None, [pathlib.Path(inspect.getsourcefile(sys.modules[module_name]))]
+        except (KeyError, TypeError):
+            return _hash(module_name)
+    parts = []
+    for path in paths:
+        parts += [str(path.relative_to(root)) if root is not None else path.name, path.read_text(encoding='utf-8')]
+    return _hash(*parts)
+
+
+class Stage:
+    '''A named pipeline step.
+
+    func is called as func(ctx, **results) with the results of the stages in deps passed by name.  files and
+    params name entries in the run configuration; outputs lists the files written relative to the output
+    directory (or is a callable taking the configuration and returning that list).
+    '''
+
+    def __init__(self, name, func, deps=(), files=(), params=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.files = tuple(files)
+        self.params = tuple(params)
+        self.outputs = outputs
+
+    def output_paths(self, config):
+        outputs = self.outputs(config) if callable(self.outputs) else self.outputs
+        return [pathlib.Path(p) for p in outputs]
+
+    def source_hash(self):
+        try:
+            source = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            source = '{}.{}'.format(self.func.__module__, self.func.__qualname__)
+        return _hash(source, package_digest(self.func.__module__))
+
+
+class StageContext:
+    '''Passed to each stage function: the run configuration, output directory layout, shared file cache and the
+    pool that figure stages submit render jobs to (None to render in the calling process).'''
+
+    def __init__(self, config, outputs, cache=None, renderer=None):
+        self.config = config
+        self.outputs = outputs
+        self.cache = cache
+        self.renderer = renderer
+
+
+class Pipeline:
+    '''An ordered collection of stages run incrementally against a persistent state directory.'''
+
+    def __init__(self, stages=()):
+        self.stages = {}
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise ValueError("stage '{}' depends on unknown stage '{}'".format(stage.name, dep))
+        self.stages[stage.name] = stage
+        return stage
+
+    def stage(self, name, deps=(), files=(), params=(), outputs=()):
+        '''Decorator registering a function as a stage.'''
+        def register(func):
+            self.add(Stage(name, func, deps, files, params, outputs))
+            return func
+        return register
+
+    def upstream(self, targets=None):
+        '''Returns the names of the target stages and everything they depend on, in run order.'''
+        if targets is None:
+            return list(self.stages)
+        unknown = set(targets) - set(self.stages)
+        if unknown:
+            raise ValueError('unknown stages: {}'.format(', '.join(sorted(unknown))))
+
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].deps)
+        # Stages are registered after their dependencies, so registration order is a valid run order
+        return [name for name in self.stages if name in needed]
+
+    def run(self, ctx, targets=None, state_dir=None, force=(), profiler=None):
+        '''Runs the target stages (all stages by default), recomputing only those that are out of date.
+
+        Returns a dict mapping each stage name to 'ran' or 'skipped'.  Stages listed in force are always rerun.
+        Measurements of each stage are added to profiler, if given.
+        '''
+        state_dir = pathlib.Path(state_dir) if state_dir is not None else ctx.outputs.root/STATE_DIR
+        state_dir.mkdir(parents=True, exist_ok=True)
+        runner = _Run(self, ctx, state_dir, profiler if profiler is not None else Profiler())
+
+        status = {}
+        for name in self.upstream(targets):
+            status[name] = 'ran' if runner.ensure(name, force=name in force) else 'skipped'
+        return status
+
+
+class _Run:
+    '''State for a single pipeline run: result hashes and lazily loaded results of each stage.'''
+
+    def __init__(self, pipeline, ctx, state_dir, profiler):
+        self.pipeline = pipeline
+        self.ctx = ctx
+        self.state_dir = state_dir
+        self.profiler = profiler
+        self.result_hashes = {}
+        self.results = {}
+
+    def _manifest_path(self, name):
+        return self.state_dir/'{}.json'.format(name)
+
+    def _result_path(self, name):
+        return self.state_dir/'{}.pkl'.format(name)
+
+    def _file_digest(self, path):
+        if self.ctx.cache is not None:
+            return self.ctx.cache.digest(path)
+        return file_digest(path)
+
+    def fingerprint(self, name):
+        stage = self.pipeline.stages[name]
+        config = self.ctx.config
+        parts = [name, stage.source_hash()]
+        for key in stage.files:
+            for path in _file_paths(config[key]):
+                parts.append('{}={}'.format(path, self._file_digest(path)))
+        for key in stage.params:
+            parts.append('{}={!r}'.format(key, config[key]))
+        for dep in stage.deps:
+            parts.append('{}={}'.format(dep, self.result_hashes[dep]))
+        return _hash(*parts)
+
+    def manifest(self, name):
+        try:
+            with open(self._manifest_path(name)) as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def up_to_date(self, manifest, name, fingerprint):
+        if manifest.get('fingerprint') != fingerprint or not self._result_path(name).exists():
+            return False
+        outputs = self.pipeline.stages[name].output_paths(self.ctx.config)
+        return all((self.ctx.outputs.root/p).exists() for p in outputs)
+
+    def result(self, name):
+        '''Returns a stage's result, loading it from the state directory if it wasn't computed in this run.'''
+        if name not in self.results:
+            with open(self._result_path(name), 'rb') as handle:
+                self.results[name] = pickle.load(handle)
+        return self.results[name]
+
+    def ensure(self, name, force=False):
+        '''Makes sure a stage is up to date, returning True if it had to be recomputed.'''
+        fingerprint = self.fingerprint(name)
+        manifest = self.manifest(name)
+        if not force and self.up_to_date(manifest, name, fingerprint):
+            self.result_hashes[name] = manifest['result']
+            self.profiler.skipped(name)
+            return False
+
+        stage = self.pipeline.stages[name]
+        with self.profiler.measure(name) as record:
+            loading = time.perf_counter()
+            inputs = {dep: self.result(dep) for dep in stage.deps}
+            record['load_seconds'] = round(time.perf_counter() - loading, 4)
+            result = stage.func(self.ctx, **inputs)
+        record['rows_in'] = rows(list(inputs.values())) if inputs else None
+        record['rows_out'] = rows(result)
+        self.results[name] = result
+        pickled = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        self.result_hashes[name] = hashlib.sha256(pickled).hexdigest()
+
+        # Store the result before the manifest, so an interrupted write leaves the stage out of date
+        with open(self._result_path(name), 'wb') as handle:
+            handle.write(pickled)
+        with open(self._manifest_path(name), 'w') as handle:
+            json.dump({
+                'fingerprint': fingerprint,
+                'result': self.result_hashes[name],
+                'outputs': [str(p) for p in stage.output_paths(self.ctx.config)],
+            }, handle, indent=1)
+        record['outputs'] = [str(p) for p in stage.output_paths(self.ctx.config)]
+        record['result_bytes'] = len(pickled)
+        return True
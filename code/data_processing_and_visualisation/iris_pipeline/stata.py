@@ -0,0 +1,137 @@
+'''Stata (.dta) exports of the publication datasets and weekly isolate counts, with compact column types.
+
+The Stata analyses import the full publication dataset CSVs, then drop most of their columns and collapse the
+isolates to weekly counts, once for every country.  The .dta files written here keep the types the pipeline
+holds: integers in the smallest Stata type that holds them (byte, int or long), categorical columns such as
+species and country as value-labelled integers, yes/no flags as labelled bytes and dates as Stata dates.  The
+isolate dataset and the weekly counts are written one file per species, so each model only loads its species;
+country value labels are the same in every file.
+
+Example:
+    write_dta(weekly_count_table(weekly_counts), 'weekly_counts.dta')
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from .outputs import species_slug
+
+
+STATA_VERSION = 118
+
+# Sub-directory of the publication datasets that the .dta files are written to
+STATA_DIR = 'stata'
+
+# Stata integer types and the range of values they hold (larger values are reserved for missing values)
+STATA_INTEGERS = [('int8', -127, 100), ('int16', -32767, 32740), ('int32', -2147483647, 2147483620)]
+
+# Largest integer that float32 holds exactly
+_FLOAT32_EXACT = 2 ** 24
+
+FLAG_LABELS = ['no', 'yes']
+
+
+def stata_name(name):
+    '''Valid Stata variable name for a column: at most 32 letters, digits and underscores, not starting with a
+    digit.'''
+    name = re.sub(r'[^A-Za-z0-9_]', '_', str(name))
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name[:32]
+
+
+def _compact_integers(values):
+    '''Integers in the smallest Stata integer type holding them, or as float32 (exact for small integers) if
+    there are missing values, which Stata integer types written from pandas can't hold.'''
+    present = values.dropna()
+    low, high = (present.min(), present.max()) if len(present) else (0, 0)
+    if values.isna().any():
+        exact = -_FLOAT32_EXACT <= low and high <= _FLOAT32_EXACT
+        return values.astype('float32' if exact else 'float64')
+    for dtype, smallest, largest in STATA_INTEGERS:
+        if smallest <= low and high <= largest:
+            return values.astype(dtype)
+    return values.astype('float64')
+
+
+def _flags(values):
+    '''True/False (or missing) flags as a categorical of no/yes, written as a value-labelled byte.'''
+    codes = values.astype('boolean').astype('Int8').fillna(-1).to_numpy(dtype='int8')
+    return pd.Series(pd.Categorical.from_codes(codes, FLAG_LABELS), index=values.index, name=values.name)
+
+
+def stata_table(frame):
+    '''frame with Stata variable names and compact types, for to_stata.
+
+    Returns the table, the convert_dates argument of to_stata for its date columns and the variable labels
+    (the original names of renamed columns).
+    '''
+    columns, dates, labels = {}, {}, {}
+    for col in frame.columns:
+        name = stata_name(col)
+        if name in columns:
+            raise ValueError("columns '{}' and '{}' have the same Stata name '{}'".format(labels.get(name, name), col, name))
+        values = frame[col]
+        if pd.api.types.is_bool_dtype(values):
+            values = _flags(values)
+        elif pd.api.types.is_integer_dtype(values):
+            values = _compact_integers(values)
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            dates[name] = 'td'
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            # Written by to_stata as integer codes with the categories as value labels (which must be strings)
+            values = values.cat.rename_categories([str(category) for category in values.cat.categories])
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            # Stata's missing string is empty
+            values = values.astype(object).where(values.notna(), '').astype(str)
+        columns[name] = values
+        if name != col:
+            labels[name] = str(col)[:80]
+    return pd.DataFrame(columns, index=frame.index), dates, labels
+
+
+def write_dta(frame, path, label=None):
+    '''Writes frame (without its index) to a Stata .dta file with compact types (see stata_table).'''
+    table, dates, labels = stata_table(frame)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_stata(path, write_index=False, version=STATA_VERSION, convert_dates=dates, variable_labels=labels,
+                   data_label=label)
+
+
+def dta_filename(name, species=None):
+    '''File name of a .dta export, with the species if it is partitioned by species, e.g.
+    weekly_counts_Spneumoniae.dta.'''
+    return '{}_{}.dta'.format(name, species_slug(species)) if species is not None else '{}.dta'.format(name)
+
+
+def write_species_dta(frame, outdir, name, species):
+    '''Writes the rows of each species in frame (which has a species column) to its own .dta file in outdir.
+
+    Categorical columns keep all of their categories in every file, so value labels are the same throughout.
+    '''
+    for each in species:
+        write_dta(frame.loc[frame['species'] == each], outdir/dta_filename(name, each),
+                  label='{} ({})'.format(name, each))
+
+
+def weekly_count_table(weekly_counts):
+    '''Weekly isolate counts from weekly_counts_by_country, as the Stata analyses use them.
+
+    One row per reported species and country and week of the study period, with the week's isolate count
+    (cases), the cumulative count, and the study week (time, from 1 in the first week of the study period).
+    '''
+    counts = weekly_counts.reset_index()
+    counts = counts.loc[counts['count'].notna()]
+    week_keys = counts['isoyear_sampled'].to_numpy() * 100 + counts['week_sampled'].to_numpy()
+    time = np.unique(week_keys, return_inverse=True)[1] + 1
+    return pd.DataFrame({
+        'species': pd.Categorical(counts['species']),
+        'country': pd.Categorical(counts['country']),
+        'isoyear_sampled': counts['isoyear_sampled'].astype('int64'),
+        'week_sampled': counts['week_sampled'].astype('int64'),
+        'time': time,
+        'cases': counts['count'].astype('int64'),
+        'cumulative': counts['Cumulative isolate count'].astype('int64'),
+    }).reset_index(drop=True)
@@ -0,0 +1,156 @@
+'''Basic data summaries of the IRIS bacterial isolate data (data_and_summaries/publication_summaries.xlsx).
+
+In these tables 'NaN' indicates no data were collected.  This is distinct from '0', which indicates that no
+isolates were received.  (species, country) pairs in KNOWN_ZERO_REPORTERS (Iceland reported no N. meningitidis
+isolates during the study period) are included as participating with zero isolates.
+
+All tables are built from a single pass over the isolate table: the country, organism, ISO year and continent of
+each isolate are converted to integer codes and the isolates in each combination are counted with np.bincount.
+Each table and its 'All' margins are then sums over this small array, so once the isolates are counted the
+cost of a table doesn't depend on the number of isolates.
+'''
+
+import numpy as np
+import pandas as pd
+
+from .cube import KNOWN_ZERO_REPORTERS
+
+
+MARGINS_NAME = 'All'
+
+# Keys of the count array; each axis has a final slot for isolates with a missing value
+KEYS = ['country', 'species', 'isoyear_sampled', 'continent']
+
+
+def _factorize(values):
+    '''Integer codes and sorted unique values, with missing values given the code len(uniques).'''
+    codes, uniques = pd.factorize(values, sort=True)
+    return np.where(codes < 0, len(uniques), codes), list(uniques)
+
+
+def _margin(counts):
+    '''Margin totals, NaN where there were no isolates to count.'''
+    return np.where(counts > 0, counts, np.nan)
+
+
+def _table(counts, present, index, columns, row_margin, column_margin=None):
+    '''A summary table with NaN where no data were collected, an 'All' row and optionally an 'All' column.
+
+    As in a pivot table, counts are floats if there are any gaps in the table.
+    '''
+    values = np.vstack([np.where(present, counts, np.nan), _margin(row_margin)])
+    table = pd.DataFrame(values, index=pd.Index(list(index) + [MARGINS_NAME], name=index.name), columns=columns)
+    if not np.isnan(values).any():
+        table = table.astype('int64')
+
+    if column_margin is not None:
+        label = (MARGINS_NAME, '') if isinstance(columns, pd.MultiIndex) else MARGINS_NAME
+        column = _margin(np.append(column_margin, column_margin.sum()))
+        table[label] = column if np.isnan(column).any() else column.astype('int64')
+    return table
+
+
+class SummaryCounts:
+    '''Isolate counts per country, organism, ISO year and continent, from which the summary tables are built.
+
+    counts holds the number of isolates (rows with an isolate name) and rows the number of records in each
+    combination, with a final slot on each axis for missing values.
+    '''
+
+    def __init__(self, iris_orgs, known_zero=KNOWN_ZERO_REPORTERS):
+        codes, labels = zip(*(_factorize(iris_orgs[key]) for key in KEYS))
+        self.countries, self.species, self.years, self.continents = labels
+        shape = tuple(len(l) + 1 for l in labels)
+
+        # Count records and named isolates in the same pass, as the two halves of a final axis
+        cells = np.ravel_multi_index(codes, shape) * 2 + iris_orgs['isolate'].notna().to_numpy()
+        both = np.bincount(cells, minlength=2 * int(np.prod(shape))).reshape(shape + (2,))
+        self.rows = both.sum(axis=-1)
+        self.counts = both[..., 1]
+
+        # Known zero reporters, as a (country, species) mask
+        self.known_zero = np.zeros((len(self.countries), len(self.species)), dtype=bool)
+        for species, country in known_zero:
+            if species in self.species and country in self.countries:
+                self.known_zero[self.countries.index(country), self.species.index(species)] = True
+
+    def _country_index(self):
+        return pd.Index(self.countries, name='country')
+
+    def _species_index(self):
+        return pd.Index(self.species, name='species')
+
+    def lab_continent_breakdown(self):
+        '''Number of participating IRIS laboratories (countries) per organism broken down by continent.'''
+        c, s, k = len(self.countries), len(self.species), len(self.continents)
+
+        # A country participates for an organism if it sent any isolates or is a known zero reporter, and is
+        # counted under every continent it was recorded in
+        sent = self.rows.sum(axis=2)[:c, :s, :k] > 0
+        in_continent = self.rows.sum(axis=(1, 2))[:c, None, :k] > 0
+        labs = sent | (self.known_zero[:, :, None] & in_continent)
+
+        # Records without a country still make an (empty) group for their continent and organism
+        present = (self.rows.sum(axis=2)[:, :s, :k] > 0).any(axis=0) | labs.any(axis=0)
+        return _table(labs.sum(axis=0).T, present.T, pd.Index(self.continents, name='continent'), self._species_index(),
+                      row_margin=labs.any(axis=2).sum(axis=0))
+
+    def country_breakdown(self):
+        '''Total number of isolates per organism broken down by country.'''
+        c, s = len(self.countries), len(self.species)
+        counts = self.counts.sum(axis=(2, 3))[:c, :s]
+        present = (self.rows.sum(axis=(2, 3))[:c, :s] > 0) | self.known_zero
+        return _table(counts, present, self._country_index(), self._species_index(),
+                      row_margin=counts.sum(axis=0), column_margin=counts.sum(axis=1))
+
+    def country_time_breakdown(self):
+        '''Total number of isolates per organism broken down by country and ISO year.'''
+        c, s, y = len(self.countries), len(self.species), len(self.years)
+        counts = self.counts.sum(axis=3)[:c, :s, :y]
+        present = self.rows.sum(axis=3)[:c, :s, :y] > 0
+
+        # Only (organism, year) columns with data are shown; known zero reporters get zeros in each of them
+        columns = present.any(axis=0)
+        present |= self.known_zero[:, :, None] & columns[None]
+
+        species, years = np.nonzero(columns)
+        index = pd.MultiIndex.from_arrays([[self.species[i] for i in species], [self.years[i] for i in years]],
+                                          names=['species', 'isoyear_sampled'])
+        counts, present = counts[:, species, years], present[:, species, years]
+        return _table(counts, present, self._country_index(), index,
+                      row_margin=counts.sum(axis=0), column_margin=counts.sum(axis=1))
+
+    def tables(self):
+        '''All publication summary tables keyed by sheet name.'''
+        return {
+            'lab_continent_breakdown': self.lab_continent_breakdown(),
+            'country_breakdown': self.country_breakdown(),
+            'country_time_breakdown': self.country_time_breakdown(),
+        }
+
+
+def lab_continent_breakdown(iris_orgs):
+    '''Number of participating IRIS laboratories per organism broken down by continent.'''
+    return SummaryCounts(iris_orgs).lab_continent_breakdown()
+
+
+def country_breakdown(iris_orgs):
+    '''Total number of isolates per organism broken down by country.'''
+    return SummaryCounts(iris_orgs).country_breakdown()
+
+
+def country_time_breakdown(iris_orgs):
+    '''Total number of isolates per organism broken down by country and ISO year.'''
+    return SummaryCounts(iris_orgs).country_time_breakdown()
+
+
+def summary_tables(iris_orgs):
+    '''Returns all publication summary tables keyed by sheet name, counting the isolates once.'''
+    return SummaryCounts(iris_orgs).tables()
+
+
+def write_summaries(tables, path):
+    '''Writes summary tables to an Excel workbook with one sheet per table.'''
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name, table in tables.items():
+            table.to_excel(writer, sheet_name=sheet_name)
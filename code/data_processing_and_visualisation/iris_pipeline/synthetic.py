@@ -0,0 +1,256 @@
+'''Synthetic input data in the format of the real inputs, at configurable scale.
+
+Generates PubMLST-format isolate exports (one per organism), an OxCGRT-shaped CSV and a Google mobility-shaped
+CSV for a chosen number of isolates, countries and ISO years.  The data are random but shaped like the real
+inputs, so every stage of the pipeline can be run and timed on them:
+
+- countries start with the IRIS countries (in PubMLST spelling, e.g. 'UK [England]') followed by 'Country 024'
+  etc., with a skewed number of isolates per country
+- isolates are sampled uniformly over the study period plus a month either side (to exercise the study period
+  filter), with ISO years and weeks as populated by BIGSdb
+- Iceland sends no N. meningitidis isolates, as in the real data (see KNOWN_ZERO_REPORTERS)
+- OxCGRT has daily rows from 1 January of the final study year, with the UK nations as regions of 'United
+  Kingdom', indices from 0-100 to 2 decimal places and the C and H indicators as integer levels within their
+  real ranges (OXCGRT_INDICATOR_LEVELS); the mobility report has national and sub-national rows from 15
+  February of the final study year
+
+Example:
+    python -m iris_pipeline.synthetic --isolates 1000000 --countries 200 --years 10 --output synthetic_data
+'''
+
+import argparse
+import collections
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from .countries import COUNTRIES
+from .cube import KNOWN_ZERO_REPORTERS
+from .dates import DateDimension
+from .isolates import ISOLATE_FILES
+from .mobility import MOBILITY_FILE, PLACE_CATEGORIES
+from .oxcgrt import OXCGRT_FILE, OXCGRT_INDICES, UK_NATIONS
+
+
+# Maximum number of data rows in an Excel worksheet
+EXCEL_MAX_ROWS = 1048575
+
+# IRIS countries as named in PubMLST, with their continents
+IRIS_COUNTRIES = {
+    'Belgium': 'Europe', 'Brazil': 'South America', 'Canada': 'North America', 'China': 'Asia',
+    'Czech Republic': 'Europe', 'Denmark': 'Europe', 'Finland': 'Europe', 'France': 'Europe', 'Germany': 'Europe',
+    'China [Hong Kong]': 'Asia', 'Iceland': 'Europe', 'Ireland': 'Europe', 'Israel': 'Asia', 'Luxembourg': 'Europe',
+    'The Netherlands': 'Europe', 'New Zealand': 'Oceania', 'Poland': 'Europe', 'South Africa': 'Africa',
+    'South Korea': 'Asia', 'Spain': 'Europe', 'Sweden': 'Europe', 'Switzerland': 'Europe',
+    'UK [England]': 'Europe', 'UK [Scotland]': 'Europe', 'UK [Wales]': 'Europe', 'UK [Northern Ireland]': 'Europe',
+}
+
+CONTINENTS = ['Africa', 'Asia', 'Europe', 'North America', 'Oceania', 'South America']
+
+# Highest level of each OxCGRT indicator (ordinal codes from 0)
+OXCGRT_INDICATOR_LEVELS = {
+    'C1_School closing': 3, 'C2_Workplace closing': 3, 'C3_Cancel public events': 2,
+    'C4_Restrictions on gatherings': 4, 'C5_Close public transport': 2, 'C6_Stay at home requirements': 3,
+    'C7_Restrictions on internal movement': 2, 'C8_International travel controls': 4,
+    'H1_Public information campaigns': 2,
+}
+
+# Share of isolates for each organism
+SPECIES_SHARES = {'S. pneumoniae': 0.4, 'H. influenzae': 0.25, 'N. meningitidis': 0.15, 'S. agalactiae': 0.2}
+
+Scale = collections.namedtuple('Scale', ['isolates', 'countries', 'years', 'final_year', 'subregions', 'seed'],
+                               defaults=(2020, 5, 0))
+
+SyntheticData = collections.namedtuple('SyntheticData', ['isolate_files', 'oxcgrt_file', 'mobility_file',
+                                                         'study_start', 'study_end', 'countries'])
+
+
+def study_period(scale):
+    '''Study start (Monday of ISO week 1 of the first year) and end (31 May of the final year).'''
+    first_year = scale.final_year - scale.years + 1
+    study_start = pd.Timestamp.fromisocalendar(first_year, 1, 1)
+    return study_start, pd.Timestamp(scale.final_year, 5, 31)
+
+
+def pubmlst_countries(n):
+    '''The first n countries (IRIS countries first) as named in PubMLST, with their continents.'''
+    countries = dict(list(IRIS_COUNTRIES.items())[:n])
+    for i in range(len(countries), n):
+        countries['Country {:03d}'.format(i)] = CONTINENTS[i % len(CONTINENTS)]
+    return countries
+
+
+def iris_country_names(pubmlst_names):
+    '''Country names after merging (as used for OxCGRT and in the IRIS country list).'''
+    return list(COUNTRIES.canonical_names(list(pubmlst_names), 'pubmlst'))
+
+
+def isolate_exports(scale):
+    '''PubMLST-format isolate exports as a {species: dataframe} dict.'''
+    rng = np.random.default_rng(scale.seed)
+    countries = pubmlst_countries(scale.countries)
+    names = np.array(list(countries))
+    continents = np.array(list(countries.values()))
+    study_start, study_end = study_period(scale)
+
+    # Skewed country sizes (a few countries send most isolates)
+    weights = 1 / np.arange(1, len(names) + 1) ** 0.8
+
+    first = study_start - pd.Timedelta(days=30)
+    n_days = (study_end - first).days + 31
+    calendar = DateDimension(first, first + pd.Timedelta(days=n_days - 1))
+
+    merged_names = np.array(iris_country_names(names))
+
+    exports = {}
+    next_id = 1
+    for species, share in SPECIES_SHARES.items():
+        n = int(round(scale.isolates * share))
+
+        # Known zero reporters send no isolates for the organism
+        country_weights = weights.copy()
+        for zero_species, zero_country in KNOWN_ZERO_REPORTERS:
+            if zero_species == species:
+                country_weights[merged_names == zero_country] = 0
+        country = rng.choice(len(names), size=n, p=country_weights / country_weights.sum())
+
+        date_sampled = first + pd.to_timedelta(rng.integers(0, n_days, size=n), unit='D')
+        iso = calendar.lookup(date_sampled)
+        ids = np.arange(next_id, next_id + n)
+        next_id += n
+
+        export = pd.DataFrame({
+            'id': ids,
+            'isolate': pd.Series(ids).astype(str).radd('IRIS_').to_numpy(),
+            'aliases': None,
+            'country': names[country],
+            'continent': continents[country],
+            'year': date_sampled.year,
+            'date_sampled': date_sampled,
+            'isoyear_sampled': iso['isoyear'].to_numpy(),
+            'week_sampled': iso['week'].to_numpy(),
+            'date_received': date_sampled + pd.to_timedelta(rng.integers(1, 60, size=n), unit='D'),
+            'non_culture': rng.choice(np.array(['no', 'yes', None], dtype=object), size=n, p=[0.8, 0.1, 0.1]),
+        })
+        # The S. pneumoniae export names the 'disease' column 'diagnosis'
+        export['diagnosis' if species == 'S. pneumoniae' else 'disease'] = rng.choice(['bacteraemia', 'meningitis', 'pneumonia'], size=n)
+        exports[species] = export
+    return exports
+
+
+def oxcgrt_frame(scale, days_after_study=120):
+    '''An OxCGRT-shaped dataset for the synthetic countries.'''
+    rng = np.random.default_rng(scale.seed + 1)
+    _, study_end = study_period(scale)
+    dates = pd.date_range(pd.Timestamp(scale.final_year, 1, 1), study_end + pd.Timedelta(days=days_after_study))
+
+    # UK nations are reported as regions of the United Kingdom, alongside national UK rows
+    jurisdictions = []
+    for name in iris_country_names(pubmlst_countries(scale.countries)):
+        if name in UK_NATIONS:
+            jurisdictions.append(('United Kingdom', name))
+            if ('United Kingdom', None) not in jurisdictions:
+                jurisdictions.append(('United Kingdom', None))
+        else:
+            jurisdictions.append((name, None))
+
+    frame = pd.DataFrame({
+        'CountryName': np.repeat([c for c, _ in jurisdictions], len(dates)),
+        'CountryCode': np.repeat(['X{:02X}'.format(i % 256) for i in range(len(jurisdictions))], len(dates)),
+        'RegionName': np.repeat(np.array([r for _, r in jurisdictions], dtype=object), len(dates)),
+        'RegionCode': None,
+        'Jurisdiction': np.repeat(['STATE_TOTAL' if r else 'NAT_TOTAL' for _, r in jurisdictions], len(dates)),
+        'Date': np.tile(dates.strftime('%Y%m%d').astype(int), len(jurisdictions)),
+    })
+    # Indices (0-100, to 2 decimal places) and indicators (ordinal levels, changing now and then) follow bounded
+    # random walks within each jurisdiction
+    for index in OXCGRT_INDICES:
+        if index in OXCGRT_INDICATOR_LEVELS:
+            top = OXCGRT_INDICATOR_LEVELS[index]
+            steps = rng.choice([-1, 0, 1], p=[0.05, 0.9, 0.05], size=(len(jurisdictions), len(dates)))
+            start = rng.integers(0, top + 1, size=(len(jurisdictions), 1))
+            frame[index] = np.clip(start + steps.cumsum(axis=1), 0, top).ravel().astype('float64')
+        else:
+            steps = rng.normal(0, 2, size=(len(jurisdictions), len(dates)))
+            frame[index] = np.clip(50 + steps.cumsum(axis=1), 0, 100).round(2).ravel()
+    return frame
+
+
+def mobility_frame(scale, days_after_study=120):
+    '''A Google mobility report-shaped dataset, with national and sub-national rows for the synthetic countries.'''
+    rng = np.random.default_rng(scale.seed + 2)
+    _, study_end = study_period(scale)
+    dates = pd.date_range(pd.Timestamp(scale.final_year, 2, 15), study_end + pd.Timedelta(days=days_after_study))
+
+    countries = []
+    for name in iris_country_names(pubmlst_countries(scale.countries)):
+        name = 'United Kingdom' if name in UK_NATIONS else COUNTRIES.source_names([name], 'google')[0]
+        if name not in countries:
+            countries.append(name)
+
+    # One national row and scale.subregions sub-national rows per country and date
+    regions = [(country, None) for country in countries]
+    regions += [(country, '{} region {}'.format(country, i)) for country in countries for i in range(scale.subregions)]
+    frame = pd.DataFrame({
+        'country_region_code': np.repeat(['X{}'.format(i % 100) for i, _ in enumerate(regions)], len(dates)),
+        'country_region': np.repeat([c for c, _ in regions], len(dates)),
+        'sub_region_1': np.repeat(np.array([r for _, r in regions], dtype=object), len(dates)),
+        'sub_region_2': None,
+        'metro_area': None,
+        'iso_3166_2_code': None,
+        'census_fips_code': None,
+        'date': np.tile(dates.strftime('%Y-%m-%d'), len(regions)),
+    })
+    for category in PLACE_CATEGORIES:
+        frame[category] = rng.integers(-80, 60, size=len(frame)).astype(float)
+    return frame
+
+
+def write(scale, output, excel=True):
+    '''Writes the synthetic inputs to the output directory under their usual file names.
+
+    Isolate exports are written as Excel workbooks (limited to EXCEL_MAX_ROWS isolates per organism) unless
+    excel is False, in which case only the OxCGRT and mobility files are written.
+    '''
+    output = pathlib.Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    study_start, study_end = study_period(scale)
+
+    isolate_files = {}
+    if excel:
+        for species, export in isolate_exports(scale).items():
+            if len(export) > EXCEL_MAX_ROWS:
+                raise ValueError('{} isolates of {} exceed the Excel row limit ({})'.format(len(export), species, EXCEL_MAX_ROWS))
+            isolate_files[species] = str(output/ISOLATE_FILES[species])
+            export.to_excel(isolate_files[species], index=False)
+
+    oxcgrt_file = output/OXCGRT_FILE
+    oxcgrt_frame(scale).to_csv(oxcgrt_file, index=False)
+    mobility_file = output/MOBILITY_FILE
+    mobility_frame(scale).to_csv(mobility_file, index=False)
+
+    countries = sorted({'United Kingdom' if c in UK_NATIONS else c for c in iris_country_names(pubmlst_countries(scale.countries))})
+    return SyntheticData(isolate_files, str(oxcgrt_file), str(mobility_file),
+                         study_start.strftime('%Y-%m-%d'), study_end.strftime('%Y-%m-%d'), countries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m iris_pipeline.synthetic', description='Write synthetic IRIS input files.')
+    parser.add_argument('--isolates', type=int, default=100000, help='total number of isolates (default: 100000)')
+    parser.add_argument('--countries', type=int, default=len(IRIS_COUNTRIES), help='number of countries (default: the IRIS countries)')
+    parser.add_argument('--years', type=int, default=3, help='number of ISO years in the study period (default: 3)')
+    parser.add_argument('--final-year', type=int, default=2020, help='final year of the study period (default: 2020)')
+    parser.add_argument('--subregions', type=int, default=5, help='sub-national mobility rows per country and date (default: 5)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('synthetic_data'))
+    args = parser.parse_args(argv)
+
+    scale = Scale(args.isolates, args.countries, args.years, args.final_year, args.subregions, args.seed)
+    data = write(scale, args.output)
+    print('Wrote synthetic inputs to {} (study period {} to {})'.format(args.output, data.study_start, data.study_end))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,40 @@
+'''Weekly and cumulative isolate counts by ISO year and ISO week.'''
+
+import pandas as pd
+
+from .cube import WeeklyCube
+
+
+def global_weekly_counts(iris_orgs):
+    '''Total and cumulative number of isolates per ISO year and week for each organism.'''
+    # Calculate total number of isolates per ISO year and week for each organism
+    base_weekly_counts = pd.pivot_table(iris_orgs, values='isolate', index=['species', 'isoyear_sampled', 'week_sampled'],
+                                        aggfunc='count', observed=True)
+
+    # Calculate cumulative isolate count per ISO year for each organism
+    base_weekly_counts['Cumulative isolate count'] = base_weekly_counts.groupby(level=[0,1], observed=True).cumsum()
+    return base_weekly_counts
+
+
+def figure_1_tables(base_weekly_counts):
+    '''Flattens global weekly counts for graphing, and reformats them to give counts per year.'''
+    weekly_counts = base_weekly_counts.reset_index()
+    weekly_counts.rename(columns={"isolate": "Count", "isoyear_sampled": "Year sampled", "week_sampled": "Week of year"}, inplace=True)
+    weekly_by_year = base_weekly_counts.unstack(level=1)['isolate']
+    return weekly_counts, weekly_by_year
+
+
+def write_figure_1_data(weekly_counts, weekly_by_year, path):
+    '''Saves global weekly isolate counts to file.'''
+    with pd.ExcelWriter(path, datetime_format='yyyy-mm-dd') as writer:
+        weekly_counts.to_excel(writer, index=False, sheet_name='figure_1_data')
+        weekly_by_year.reset_index().to_excel(writer, index=False, sheet_name='figure_1_counts_by_year')
+
+
+def weekly_counts_by_country(iris_orgs, study_years, study_start, study_end):
+    '''Weekly and cumulative isolate counts per species, country, ISO year and ISO week.
+
+    A zero count is recorded in weeks when no isolates were received, except for (species, country) pairs for
+    which data were never provided and for weeks outside the study period (see WeeklyCube).
+    '''
+    return WeeklyCube.from_isolates(iris_orgs, study_years, study_start, study_end).to_frame()
@@ -0,0 +1,134 @@
+'''Streaming reader for selected columns of an Excel (.xlsx) worksheet.
+
+The worksheet XML is parsed incrementally straight from the workbook archive, and only the values of the
+requested columns are kept, so wide exports (PubMLST exports have many typing and metadata columns that the
+pipeline doesn't use) are read several times faster than with pd.read_excel, in a fraction of the memory.
+Column types are inferred from the kept values in the same way as pd.read_excel.
+
+Example:
+    isolates = read_columns('IRIS_Sp_corrected_20052021.xlsx', ['id', 'isolate', 'country'])
+'''
+
+import datetime
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pandas as pd
+
+
+_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELATIONSHIPS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Day 0 of Excel serial dates in the 1900 and 1904 date systems
+EXCEL_EPOCHS = {False: '1899-12-30', True: '1904-01-01'}
+
+_DATETIME_DTYPE = pd.to_datetime(pd.Series([datetime.datetime(2000, 1, 1)])).dtype
+
+
+def _column_number(ref):
+    '''Zero-based column number of a cell reference, e.g. 'C12' -> 2.'''
+    number = 0
+    for char in ref:
+        if char.isdigit():
+            break
+        number = number * 26 + ord(char) - 64
+    return number - 1
+
+
+def _text(element):
+    return ''.join(t.text or '' for t in element.iter(_MAIN + 't'))
+
+
+def _first_sheet(archive):
+    '''Path of the first worksheet in the archive, and whether the workbook uses the 1904 date system.'''
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    properties = workbook.find(_MAIN + 'workbookPr')
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+
+    sheet_id = workbook.find('{0}sheets/{0}sheet'.format(_MAIN)).get(_RELATIONSHIPS + 'id')
+    relationships = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relationship in relationships.iter(_PACKAGE_RELATIONSHIPS + 'Relationship'):
+        if relationship.get('Id') == sheet_id:
+            target = relationship.get('Target')
+            path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+            return path, date1904
+    raise ValueError('workbook has no worksheets')
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as handle:
+        for _, element in ET.iterparse(handle):
+            if element.tag == _MAIN + 'si':
+                strings.append(_text(element))
+                element.clear()
+    return strings
+
+
+def _cell_value(cell, strings):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return _text(cell)
+    value = cell.findtext(_MAIN + 'v')
+    if value is None or kind == 'e':
+        return None
+    if kind == 's':
+        return strings[int(value)]
+    if kind == 'b':
+        return value == '1'
+    return value
+
+
+def excel_dates(values, date1904=False):
+    '''Converts a column of Excel serial dates (and any dates stored as text) to datetimes.'''
+    serial = pd.to_numeric(values, errors='coerce')
+    dates = pd.to_datetime(serial, unit='D', origin=EXCEL_EPOCHS[date1904])
+    # Same resolution as dates parsed from datetime objects, as pd.read_excel parses them
+    dates = dates.astype(_DATETIME_DTYPE).dt.round('us')
+    text = values.notna() & serial.isna()
+    if text.any():
+        dates[text] = pd.to_datetime(values[text])
+    return dates
+
+
+def read_columns(path, columns, date_columns=()):
+    '''Reads the named columns of the first worksheet of an .xlsx workbook into a dataframe.
+
+    The first row holds the column names; requested columns that don't exist are left out.  Columns in
+    date_columns are converted to datetimes.
+    '''
+    with zipfile.ZipFile(path) as archive:
+        sheet, date1904 = _first_sheet(archive)
+        strings = _shared_strings(archive)
+
+        header, positions, rows = None, [], []
+        with archive.open(sheet) as handle:
+            values, column = {}, -1
+            for _, element in ET.iterparse(handle):
+                tag = element.tag
+                if tag == _MAIN + 'c':
+                    ref = element.get('r')
+                    column = _column_number(ref) if ref else column + 1
+                    if header is None or column in positions:
+                        values[column] = _cell_value(element, strings)
+                    element.clear()
+                elif tag == _MAIN + 'row':
+                    if header is None:
+                        header = {i: name for i, name in values.items() if name in columns}
+                        positions = sorted(header)
+                    else:
+                        rows.append([values.get(i) for i in positions])
+                    values, column = {}, -1
+                    element.clear()
+
+    # Parsed as pd.read_excel parses worksheet rows, so column types are inferred in the same way
+    names = [header[i] for i in positions] if header else []
+    frame = pd.io.parsers.TextParser(rows, names=names).read()
+    for name in date_columns:
+        if name in frame:
+            frame[name] = excel_dates(frame[name], date1904)
+    return frame